@@ -0,0 +1,198 @@
+"""Many concurrent pollers against the sync (gunicorn) and async (uvicorn) servers.
+
+Usage (from the repository root; needs uvicorn and aiosqlite installed):
+
+    python -m benchmarks.async_reads --clients 50,200,1000 --workers 2 --duration 10
+
+The dataset is built once. For each server, and each number of clients, that many
+keep-alive connections poll the list and dashboard endpoints for the given duration,
+each client pausing --think-time seconds between requests as a polling app does.
+The sync server is gunicorn with gunicorn.conf.py (gthread, --threads per worker);
+the async one is `uvicorn src.asgi:app` with the same number of workers.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import Scenarios, summarize, git_revision, READER_PIN, SUPERVISOR, ENGINEER
+from benchmarks.scaling import free_port, wait_until_ready, gunicorn
+
+POLL_SCENARIOS = (
+    'reports_list_reader', 'anomalies_list_reader', 'escalations_list',
+    'dashboard_reader', 'dashboard_supervisor', 'dashboard_stats'
+)
+
+@contextlib.contextmanager
+def uvicorn(workers, env):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'src.asgi:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--no-access-log', '--log-level', 'warning'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_until_ready(base_url, process)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+class Connection:
+    """A minimal HTTP/1.1 keep-alive client; enough for GETs answered with Content-Length"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def get(self, path, headers):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f'GET {path} HTTP/1.1', f'Host: {self.host}:{self.port}', *(f'{k}: {v}' for k, v in headers.items())]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin1'))
+        status = int((await self.reader.readline()).split()[1])
+        length, close = 0, False
+        while True:
+            line = (await self.reader.readline()).decode('latin1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            name = name.lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value.strip().lower() == 'close':
+                close = True
+        await self.reader.readexactly(length)
+        if close:
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+async def poll(base_url, scenarios, clients, duration, think_time):
+    host, port = base_url.split('//')[1].split(':')
+    targets = [(name, path, scenarios.headers(role)) for name, method, path, role, _ in scenarios.all()]
+    latencies = {name: [] for name, _, _ in targets}
+    errors = {name: 0 for name, _, _ in targets}
+    deadline = time.perf_counter() + duration
+
+    async def client(index):
+        rng = random.Random(index)
+        connection = Connection(host, int(port))
+        # Spread the first requests out so the clients do not all arrive at once
+        await asyncio.sleep(rng.uniform(0, think_time))
+        try:
+            while time.perf_counter() < deadline:
+                name, path, headers = rng.choice(targets)
+                t0 = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(connection.get(path, headers), timeout=60)
+                    if status >= 400:
+                        errors[name] += 1
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    errors[name] += 1
+                    connection.close()
+                latencies[name].append(time.perf_counter() - t0)
+                if think_time:
+                    await asyncio.sleep(think_time)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    elapsed = time.perf_counter() - started
+    result = summarize([l for values in latencies.values() for l in values], elapsed, errors=sum(errors.values()))
+    result['scenarios'] = {name: summarize(latencies[name], elapsed, errors=errors[name]) for name in latencies}
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=50)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--reports-per-day', type=int, default=1)
+    parser.add_argument('--anomaly-rate', type=float, default=0.08)
+    parser.add_argument('--escalation-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=2, help='worker processes of either server')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gunicorn worker')
+    parser.add_argument('--clients', default='50,200,1000', help='comma-separated numbers of concurrent pollers')
+    parser.add_argument('--think-time', type=float, default=1.0, help='seconds each client waits between polls')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load per run')
+    parser.add_argument('--servers', default='sync,async', help='comma-separated: sync, async')
+    parser.add_argument('--scenarios', default=','.join(POLL_SCENARIOS), help='comma-separated scenario names')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='reading-reports-async-')
+    database = os.path.join(workdir, 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        from src.main import create_app
+        from src.models.user import User, Anomaly
+        from benchmarks.dataset import build_dataset, reader_staff_number
+
+        app = create_app()
+        with app.app_context():
+            counts = build_dataset(
+                readers=args.readers, days=args.days, reports_per_day=args.reports_per_day,
+                anomaly_rate=args.anomaly_rate, escalation_rate=args.escalation_rate, seed=args.seed
+            )
+            reader = User.query.filter_by(staff_number=reader_staff_number(0)).first()
+            engineer = User.query.filter_by(role='Commercial Engineer').first()
+            anomaly_ids = [a.id for a in Anomaly.query.with_entities(Anomaly.id).filter_by(staff_id=reader.id).all()]
+
+        client = app.test_client()
+        tokens = {}
+        for role, (staff_number, pin) in {'reader': (reader.staff_number, READER_PIN), 'supervisor': SUPERVISOR, 'engineer': ENGINEER}.items():
+            tokens[role] = client.post('/api/login', json={'staff_number': staff_number, 'pin': pin}).json['token']
+
+    wanted = set(args.scenarios.split(','))
+    scenarios = Scenarios(tokens, reader.staff_number, anomaly_ids or [1], engineer.id, random.Random(args.seed))
+    all_scenarios = scenarios.all
+    scenarios.all = lambda: [s for s in all_scenarios() if s[0] in wanted]
+
+    results = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+            'dataset': {**vars(args), **counts}
+        },
+        'servers': {}
+    }
+
+    servers = {
+        'sync': lambda: gunicorn(args.workers, args.threads, dict(os.environ)),
+        'async': lambda: uvicorn(args.workers, dict(os.environ))
+    }
+    for server in args.servers.split(','):
+        results['servers'][server] = {}
+        for clients in [int(c) for c in args.clients.split(',')]:
+            with servers[server]() as base_url:
+                result = asyncio.run(poll(base_url, scenarios, clients, args.duration, args.think_time))
+            results['servers'][server][clients] = result
+            print(f"{server:>5} {clients:>5} clients: {result['throughput_rps'] or 0:>8.1f} req/s  "
+                  f"p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms  errors {result['errors']}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
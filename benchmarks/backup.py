@@ -0,0 +1,138 @@
+"""Report write latency while online backups run, checked against a budget.
+
+Usage (from the repository root):
+
+    python -m benchmarks.backup --submitters 4 --duration 10 --budget-ms 50
+
+Reports are POSTed over HTTP to a threaded server, first with no backup running and
+then while snapshots of the database are taken back to back. The run fails (exit
+status 1) if the p99 write latency during backups exceeds the p99 without them by
+more than --budget-ms, or if any snapshot is missing or fails its integrity check.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.run import git_revision
+from benchmarks.group_commit import READER, submit_reports
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=50)
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--reports-per-day', type=int, default=2)
+    parser.add_argument('--anomaly-rate', type=float, default=0.2)
+    parser.add_argument('--escalation-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--submitters', type=int, default=4, help='concurrent report submitters')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load per phase')
+    parser.add_argument('--budget-ms', type=float, default=50.0, help='allowed rise of the p99 write latency during backups')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='reading-reports-backup-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['BACKUP_DIR'] = os.path.join(workdir, 'backups')
+    os.environ['BACKUP_KEEP'] = '2'
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        from werkzeug.serving import make_server
+        from src.main import create_app
+        from src.utils import backup
+        from benchmarks.dataset import build_dataset
+
+        app = create_app()
+        with app.app_context():
+            counts = build_dataset(
+                readers=args.readers, days=args.days, reports_per_day=args.reports_per_day,
+                anomaly_rate=args.anomaly_rate, escalation_rate=args.escalation_rate, seed=args.seed
+            )
+        token = app.test_client().post('/api/login', json={'staff_number': READER[0], 'pin': READER[1]}).json['token']
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    snapshots, failures = [], []
+    stop = threading.Event()
+
+    def take_snapshots():
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    manifest = backup.create_snapshot()
+                    if manifest:
+                        snapshots.append(manifest)
+                except Exception as e:
+                    failures.append(str(e))
+
+    try:
+        # Confirmation emails are printed; keep them out of the results
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            baseline = submit_reports(base_url, token, args.submitters, args.duration)
+            backups = threading.Thread(target=take_snapshots)
+            backups.start()
+            try:
+                during = submit_reports(base_url, token, args.submitters, args.duration)
+            finally:
+                stop.set()
+                backups.join()
+    finally:
+        server.shutdown()
+
+    kept = backup.list_snapshots()
+    for snapshot in kept:
+        for entry in snapshot['databases']:
+            try:
+                backup.check_integrity(os.path.join(backup.BACKUP_DIR, snapshot['name'], entry['file']))
+            except backup.BackupError as e:
+                failures.append(str(e))
+
+    seconds = [entry['seconds'] for snapshot in snapshots for entry in snapshot['databases']]
+    rise = during['p99_ms'] - baseline['p99_ms']
+    passed = not failures and bool(snapshots) and len(kept) <= 2 and rise <= args.budget_ms
+    results = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+            'dataset': {**vars(args), **counts}
+        },
+        'baseline': baseline,
+        'during_backup': during,
+        'snapshots': {
+            'taken': len(snapshots),
+            'kept': len(kept),
+            'bytes': snapshots[-1]['databases'][0]['bytes'] if snapshots else None,
+            'mean_seconds': round(sum(seconds) / len(seconds), 3) if seconds else None,
+            'failures': failures
+        },
+        'p99_rise_ms': round(rise, 2),
+        'budget_ms': args.budget_ms,
+        'passed': passed
+    }
+
+    print(f"writes p99 {baseline['p99_ms']} ms without backups, {during['p99_ms']} ms during "
+          f"{len(snapshots)} snapshots (+{rise:.1f} ms, budget {args.budget_ms} ms): {'PASS' if passed else 'FAIL'}",
+          file=sys.stderr)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    if not passed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
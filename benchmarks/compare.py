@@ -0,0 +1,63 @@
+"""Compare two benchmark result files produced by benchmarks.run.
+
+Usage:
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+
+Prints the change in p95 latency, throughput and queries per request for
+every scenario, and exits non-zero when any p95 regressed by more than the
+threshold percentage.
+"""
+import argparse
+import json
+import sys
+
+def pct_change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+def fmt(value, suffix=''):
+    return '-' if value is None else f'{value:.1f}{suffix}'
+
+def compare(baseline, candidate, threshold):
+    regressions = []
+    for section in ('test_client', 'http'):
+        if section not in baseline or section not in candidate:
+            continue
+        print(f'[{section}]')
+        print(f"{'scenario':34} {'p95 ms':>18} {'rps':>18} {'queries':>14}")
+        for name, before in baseline[section].items():
+            after = candidate[section].get(name)
+            if not after:
+                continue
+            p95_change = pct_change(before.get('p95_ms'), after.get('p95_ms'))
+            print(f"{name:34} "
+                  f"{fmt(before.get('p95_ms')):>7} -> {fmt(after.get('p95_ms')):>7} "
+                  f"{fmt(before.get('throughput_rps')):>7} -> {fmt(after.get('throughput_rps')):>7} "
+                  f"{fmt(before.get('queries_per_request')):>5} -> {fmt(after.get('queries_per_request')):>5}"
+                  f"{'  REGRESSION' if p95_change is not None and p95_change > threshold else ''}")
+            if p95_change is not None and p95_change > threshold:
+                regressions.append((section, name, p95_change))
+        print()
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed p95 regression in percent')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    regressions = compare(baseline, candidate, args.threshold)
+    for section, name, change in regressions:
+        print(f'{section}/{name}: p95 regressed by {change:.1f}%')
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
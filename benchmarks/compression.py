@@ -0,0 +1,129 @@
+"""Byte size and CPU cost of the response encodings for typical payloads.
+
+Usage (from the repository root):
+
+    python -m benchmarks.compression [--repeat 20] [--output compression.json]
+
+Payloads mirror what the list and dashboard endpoints return. Every payload
+is encoded as JSON and MessagePack, each uncompressed, gzipped and (when the
+brotli package is installed) brotli-compressed at the levels the response
+layer uses. The table reports bytes on the wire and CPU milliseconds per
+encode, including serialization.
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+from datetime import datetime, date, timedelta
+
+from src.utils.json_provider import encode, encode_msgpack, msgpack
+from src.utils.compression import brotli, COMPRESS_GZIP_LEVEL, COMPRESS_BROTLI_QUALITY
+
+def report_dicts(count, rng):
+    start = datetime(2025, 1, 1, 14)
+    return [{
+        'id': i,
+        'itin': f'{rng.randint(1, 400):03d}-{rng.randint(1, 9999):04d}',
+        'report_date': (start + timedelta(days=i // 50)).date(),
+        'percentage_attained': round(rng.uniform(60, 100), 1),
+        'reasons_not_attained': rng.choice(['Locked gates', 'Customer absent', 'Heavy rain', None]),
+        'staff_id': rng.randint(1, 200),
+        'staff_number': f'7{rng.randint(0, 199):06d}',
+        'timestamp': start + timedelta(days=i // 50, seconds=rng.randint(0, 21600)),
+        'status': rng.choice(['Pending', 'Approved', 'Reviewed']),
+        'notes_comments': ''
+    } for i in range(count)]
+
+def anomaly_dicts(count, rng):
+    start = datetime(2025, 1, 1, 14)
+    return [{
+        'id': i,
+        'report_id': i * 12,
+        'type': rng.choice(['Meter Not Accessible', 'Faulty Meter', 'Dog on Premises', 'Meter Tampering']),
+        'description': 'Customer gate locked, meter behind wall',
+        'timestamp': start + timedelta(hours=i),
+        'escalation_flag': rng.random() < 0.25,
+        'assigned_to_id': None,
+        'assigned_to_staff_number': None,
+        'resolution_status': rng.choice(['Open', 'Resolved']),
+        'staff_id': rng.randint(1, 200),
+        'staff_number': f'7{rng.randint(0, 199):06d}'
+    } for i in range(count)]
+
+def supervisor_dashboard(readers, rng):
+    return {
+        'reader_performance': [{
+            'staff_number': f'7{i:06d}',
+            'staff_id': i,
+            'average_percentage': round(rng.uniform(70, 99), 2),
+            'total_reports': rng.randint(20, 60),
+            'pending_reports': rng.randint(0, 15),
+            'open_anomalies': rng.randint(0, 5),
+            'escalated_anomalies': rng.randint(0, 3)
+        } for i in range(readers)],
+        'total_reports': readers * 40,
+        'total_anomalies': readers * 3,
+        'escalated_anomalies': readers,
+        'anomaly_distribution': [{'type': t, 'count': rng.randint(1, 300)} for t in ('Faulty Meter', 'Dog on Premises', 'Meter Tampering')],
+        'user': {'id': 1, 'staff_number': '12345', 'role': 'Supervisor', 'created_at': datetime(2025, 1, 1)}
+    }
+
+def payloads(seed):
+    rng = random.Random(seed)
+    return {
+        'reports_list_100': report_dicts(100, rng),
+        'reports_list_1000': report_dicts(1000, rng),
+        'reports_list_10000': report_dicts(10000, rng),
+        'anomalies_list_500': anomaly_dicts(500, rng),
+        'dashboard_supervisor_200_readers': supervisor_dashboard(200, rng)
+    }
+
+def codecs():
+    serializers = [('json', encode)]
+    if msgpack is not None:
+        serializers.append(('msgpack', encode_msgpack))
+    compressors = [
+        ('identity', lambda body: body),
+        (f'gzip-{COMPRESS_GZIP_LEVEL}', lambda body: gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)),
+        ('gzip-1', lambda body: gzip.compress(body, compresslevel=1, mtime=0))
+    ]
+    if brotli is not None:
+        compressors.append((f'br-{COMPRESS_BROTLI_QUALITY}', lambda body: brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)))
+        compressors.append(('br-11', lambda body: brotli.compress(body, quality=11)))
+    for serializer_name, serializer in serializers:
+        for compressor_name, compressor in compressors:
+            yield f'{serializer_name}+{compressor_name}', serializer, compressor
+
+def measure(obj, serializer, compressor, repeat):
+    started = time.process_time()
+    for _ in range(repeat):
+        body = compressor(serializer(obj))
+    return len(body), (time.process_time() - started) / repeat * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for payload_name, obj in payloads(args.seed).items():
+        baseline = None
+        print(f'{payload_name}')
+        print(f"  {'encoding':22} {'bytes':>10} {'ratio':>7} {'cpu ms':>8}")
+        results[payload_name] = {}
+        for name, serializer, compressor in codecs():
+            size, cpu_ms = measure(obj, serializer, compressor, args.repeat)
+            baseline = baseline or size
+            results[payload_name][name] = {'bytes': size, 'ratio': round(size / baseline, 4), 'cpu_ms': round(cpu_ms, 3)}
+            print(f'  {name:22} {size:>10} {size / baseline:>7.3f} {cpu_ms:>8.2f}')
+        print()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
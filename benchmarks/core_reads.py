@@ -0,0 +1,136 @@
+"""Rows per second and memory per row: ORM objects versus the Core read layer.
+
+Usage (from the repository root):
+
+    python -m benchmarks.core_reads --readers 50 --days 180 --repeat 5
+
+Each table's full listing is turned into the dicts the API sends, once by loading
+ORM objects (with their staff eagerly joined) and calling to_dict(), and once from
+the column rows of src.models.reads. Throughput is the best of --repeat runs, each
+in a fresh session; memory is the tracemalloc peak of one run divided by its rows,
+so it covers the result dicts as well as whatever the loading kept alive.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.run import git_revision
+
+def measure(app, load, repeat):
+    from src.models.user import db
+
+    def run():
+        try:
+            return len(load())
+        finally:
+            db.session.remove()
+
+    with app.app_context():
+        rows = run()  # warm the statement caches
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'rows': rows,
+        'seconds': round(best, 4),
+        'rows_per_second': round(rows / best) if best else None,
+        'peak_bytes_per_row': round(peak / rows) if rows else None
+    }
+
+def loaders():
+    from sqlalchemy.orm import joinedload
+    from src.models.user import Report, Anomaly, Escalation, db
+    from src.models import reads
+
+    return {
+        'reports': (
+            lambda: [r.to_dict() for r in Report.query.options(joinedload(Report.staff)).order_by(Report.timestamp.desc())],
+            lambda: [reads.report_dict(row) for row in db.session.execute(reads.report_select().order_by(Report.timestamp.desc()))]
+        ),
+        'anomalies': (
+            lambda: [a.to_dict() for a in Anomaly.query.options(joinedload(Anomaly.staff), joinedload(Anomaly.assigned_to)).order_by(Anomaly.timestamp.desc())],
+            lambda: [reads.anomaly_dict(row) for row in db.session.execute(reads.anomaly_select().order_by(Anomaly.timestamp.desc()))]
+        ),
+        'escalations': (
+            lambda: [e.to_dict() for e in Escalation.query.options(joinedload(Escalation.escalated_to)).order_by(Escalation.escalation_timestamp.desc())],
+            lambda: [reads.escalation_dict(row) for row in db.session.execute(reads.escalation_select().order_by(Escalation.escalation_timestamp.desc()))]
+        )
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=50)
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--reports-per-day', type=int, default=1)
+    parser.add_argument('--anomaly-rate', type=float, default=0.2)
+    parser.add_argument('--escalation-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per path; the best is kept')
+    parser.add_argument('--database', help='SQLite file to use (default: a temporary file)')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='reading-reports-core-')
+    database = args.database or os.path.join(workdir, 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        from src.main import create_app
+        from benchmarks.dataset import build_dataset
+
+        app = create_app()
+        counts = {}
+        if not args.database:
+            with app.app_context():
+                counts = build_dataset(
+                    readers=args.readers, days=args.days, reports_per_day=args.reports_per_day,
+                    anomaly_rate=args.anomaly_rate, escalation_rate=args.escalation_rate, seed=args.seed
+                )
+
+    results = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'dataset': {**vars(args), **counts}
+        },
+        'tables': {}
+    }
+
+    for table, (orm, core) in loaders().items():
+        orm_result = measure(app, orm, args.repeat)
+        core_result = measure(app, core, args.repeat)
+        results['tables'][table] = {
+            'orm': orm_result,
+            'core': core_result,
+            'speedup': round(orm_result['seconds'] / core_result['seconds'], 2) if core_result['seconds'] else None
+        }
+        print(f"{table:>12}: {orm_result['rows']:>7} rows  orm {orm_result['rows_per_second']:>8} rows/s "
+              f"{orm_result['peak_bytes_per_row']:>6} B/row  core {core_result['rows_per_second']:>8} rows/s "
+              f"{core_result['peak_bytes_per_row']:>6} B/row", file=sys.stderr)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import random
+from datetime import datetime, date, timedelta
+from werkzeug.security import generate_password_hash
+from src.models.user import User, Report, Anomaly, Escalation, db
+
+ANOMALY_TYPES = [
+    'Meter Tampering', 'Faulty Meter', 'Access Denied', 'Dog on Premises',
+    'Meter Not Found', 'Illegal Connection', 'Broken Seal', 'Damaged Display'
+]
+
+REASONS = [
+    'Heavy rain', 'Locked gates', 'Vehicle breakdown', 'Customer absent',
+    'Insecure area', 'Impassable road', None, None, None
+]
+
+def reader_staff_number(index):
+    return f'9{index:05d}'
+
+def build_dataset(readers=20, days=60, reports_per_day=1, anomaly_rate=0.2, escalation_rate=0.3, seed=1, batch_size=5000):
+    """Populate the database with synthetic readers, reports, anomalies and escalations through the ORM models
+
+    Readers get staff numbers 900000, 900001, ... with the usual PIN (first four digits).
+    """
+    rng = random.Random(seed)
+
+    # PBKDF2 is deliberately slow, so hash the shared PIN once
+    pin_hash = generate_password_hash('9000')
+    answer_hash = generate_password_hash('benchmark')
+
+    engineer = User.query.filter_by(role='Commercial Engineer').first()
+    supervisor = User.query.filter_by(role='Supervisor').first()
+    escalation_targets = [u.id for u in (engineer, supervisor) if u]
+
+    reader_ids = []
+    for i in range(readers):
+        staff_number = reader_staff_number(i)
+        user = User.query.filter_by(staff_number=staff_number).first()
+        if not user:
+            user = User(
+                staff_number=staff_number,
+                role='Meter Reader',
+                pin_hash=pin_hash,
+                security_question='What is your staff number?',
+                security_answer_hash=answer_hash
+            )
+            db.session.add(user)
+            db.session.flush()
+        reader_ids.append(user.id)
+    db.session.commit()
+
+    counts = {'readers': readers, 'reports': 0, 'anomalies': 0, 'escalations': 0}
+    today = date.today()
+    pending = []
+
+    def flush():
+        db.session.add_all(pending)
+        db.session.commit()
+        pending.clear()
+
+    for day in range(days):
+        report_date = today - timedelta(days=day)
+        for staff_id in reader_ids:
+            for _ in range(reports_per_day):
+                submitted = datetime.combine(report_date, datetime.min.time()) + timedelta(
+                    hours=rng.randint(7, 18), minutes=rng.randint(0, 59)
+                )
+                percentage = round(min(100.0, max(0.0, rng.gauss(88, 10))), 1)
+                report = Report(
+                    itin=f'ITIN{rng.randint(1, readers * 10):05d}',
+                    report_date=report_date,
+                    percentage_attained=percentage,
+                    reasons_not_attained=rng.choice(REASONS) if percentage < 100 else None,
+                    staff_id=staff_id,
+                    timestamp=submitted,
+                    status=rng.choice(['Pending', 'Pending', 'Approved', 'Reviewed'])
+                )
+                pending.append(report)
+                counts['reports'] += 1
+
+                if rng.random() < anomaly_rate:
+                    anomaly = Anomaly(
+                        report=report,
+                        type=rng.choice(ANOMALY_TYPES),
+                        description='Synthetic anomaly',
+                        staff_id=staff_id,
+                        timestamp=submitted,
+                        resolution_status=rng.choice(['Open', 'Open', 'Resolved'])
+                    )
+                    pending.append(anomaly)
+                    counts['anomalies'] += 1
+
+                    if escalation_targets and rng.random() < escalation_rate:
+                        anomaly.escalation_flag = True
+                        pending.append(Escalation(
+                            anomaly=anomaly,
+                            escalated_to_id=rng.choice(escalation_targets),
+                            escalation_timestamp=submitted + timedelta(days=4)
+                        ))
+                        counts['escalations'] += 1
+
+                if len(pending) >= batch_size:
+                    flush()
+
+    flush()
+    return counts
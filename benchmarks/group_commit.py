@@ -0,0 +1,132 @@
+"""Report inserts per second with and without group commit.
+
+Usage (from the repository root):
+
+    python -m benchmarks.group_commit --submitters 50,200 --duration 10
+
+For each number of concurrent submitters, reports are POSTed over HTTP to a
+threaded server for the given duration, once committing every insert on its
+own and once with WRITE_COALESCING, on a fresh database each time. Rejected
+inserts (503 once the latency budget is spent) are counted as errors.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import date
+
+from benchmarks.run import summarize, git_revision
+
+READER = ('85891', '8589')
+
+def submit_reports(base_url, token, submitters, duration):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local_latencies, local_errors = [], 0
+        while time.perf_counter() < deadline:
+            body = json.dumps({
+                'itin': f'ITIN{rng.randint(1, 99999):05d}',
+                'report_date': date.today().isoformat(),
+                'percentage_attained': round(rng.uniform(60, 100), 1),
+                'reasons_not_attained': 'Benchmark'
+            }).encode()
+            req = urllib.request.Request(base_url + '/api/reports', data=body, method='POST', headers={
+                'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'
+            })
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=60) as response:
+                    response.read()
+            except (urllib.error.URLError, OSError):
+                local_errors += 1
+            local_latencies.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(submitters)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - started, errors=errors[0])
+
+def run_mode(database, coalescing, submitters, duration):
+    from werkzeug.serving import make_server
+    from src.main import create_app
+    from src.models.user import Report
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}', 'WRITE_COALESCING': coalescing})
+    token = app.test_client().post('/api/login', json={'staff_number': READER[0], 'pin': READER[1]}).json['token']
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        result = submit_reports(f'http://127.0.0.1:{server.server_port}', token, submitters, duration)
+    finally:
+        server.shutdown()
+
+    with app.app_context():
+        result['rows_written'] = Report.query.count()
+    committers = (app.extensions.get('group_commit') or {}).values()
+    batches = sum(committer.batches for committer in committers)
+    if batches:
+        result['mean_batch_size'] = round(sum(committer.rows for committer in committers) / batches, 2)
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--submitters', default='50,200', help='comma-separated numbers of concurrent submitters')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load per run')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='reading-reports-group-commit-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'unused.db')}"
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    results = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+            'duration': args.duration
+        },
+        'runs': {}
+    }
+
+    for submitters in [int(n) for n in args.submitters.split(',')]:
+        for name, coalescing in (('commit_per_insert', False), ('group_commit', True)):
+            database = os.path.join(workdir, f'{name}_{submitters}.db')
+            # Confirmation emails are printed; keep them out of the results
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                result = run_mode(database, coalescing, submitters, args.duration)
+            results['runs'].setdefault(str(submitters), {})[name] = result
+            print(f"{submitters:>4} submitters {name:18} {result['throughput_rps']:>8} inserts/s  "
+                  f"p95 {result['p95_ms']} ms  errors {result['errors']}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Worker start-up cost: import time of the app factory, and what a fresh app loads.
+
+Usage (from the repository root):
+
+    python -m benchmarks.import_time --repeat 5 --budget-ms 800
+
+Each run is a fresh interpreter. `python -X importtime` measures importing src.main,
+and a second interpreter builds the app with create_app() on an empty database and
+reports its peak RSS and the modules it loaded. The run fails (exit status 1) if the
+median import time is over --budget-ms, or if building the app loads any of the
+heavy libraries that only exports, imports and forecasts need.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import git_revision
+
+# Loaded on first use by the code that needs them, never by create_app()
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'PIL')
+
+# Median import time of src.main a worker may spend before serving
+BUDGET_MS = 800.0
+
+PROBE = '''
+import json, resource, sys, time
+from src.main import create_app
+imported = time.perf_counter()
+create_app()
+print(json.dumps({
+    'create_app_seconds': time.perf_counter() - imported,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': sorted(sys.modules)
+}))
+'''
+
+def import_profile(env):
+    """(total microseconds to import src.main, {top-level package: self microseconds})"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import src.main'],
+        env=env, capture_output=True, text=True, check=True
+    )
+    total, packages = None, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        packages[name.split('.')[0]] = packages.get(name.split('.')[0], 0) + int(self_us)
+        if name == 'src.main':
+            total = int(cumulative_us)
+    return total, packages
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per measurement; the median is kept')
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS, help='allowed median import time of src.main')
+    parser.add_argument('--top', type=int, default=10, help='packages listed by import cost')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='reading-reports-import-')
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'app.db')}", PYTHONDONTWRITEBYTECODE='1')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+
+    # One unmeasured run, so every interpreter finds the bytecode cache warm
+    import_profile(env)
+    totals, packages = [], {}
+    for _ in range(args.repeat):
+        total, run_packages = import_profile(env)
+        totals.append(total)
+        for name, self_us in run_packages.items():
+            packages.setdefault(name, []).append(self_us)
+
+    probes = []
+    for _ in range(args.repeat):
+        result = subprocess.run([sys.executable, '-c', PROBE], env=env, capture_output=True, text=True, check=True)
+        probes.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    loaded = sorted({name for probe in probes for name in probe['modules'] if name.split('.')[0] in HEAVY_MODULES and '.' not in name})
+
+    import_ms = statistics.median(totals) / 1000
+    passed = import_ms <= args.budget_ms and not loaded
+    results = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat
+        },
+        'import_ms': round(import_ms, 1),
+        'create_app_ms': round(statistics.median(p['create_app_seconds'] for p in probes) * 1000, 1),
+        'max_rss_mb': round(statistics.median(p['max_rss_kb'] for p in probes) / 1024, 1),
+        'modules_loaded': round(statistics.median(len(p['modules']) for p in probes)),
+        'heavy_modules_loaded': loaded,
+        'slowest_packages_ms': {
+            name: round(statistics.median(values) / 1000, 1)
+            for name, values in sorted(packages.items(), key=lambda item: -statistics.median(item[1]))[:args.top]
+        },
+        'budget_ms': args.budget_ms,
+        'passed': passed
+    }
+
+    print(f"import src.main {results['import_ms']} ms (budget {args.budget_ms} ms), create_app {results['create_app_ms']} ms, "
+          f"peak RSS {results['max_rss_mb']} MB, heavy modules loaded: {', '.join(loaded) or 'none'}: "
+          f"{'PASS' if passed else 'FAIL'}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    if not passed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
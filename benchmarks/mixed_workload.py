@@ -0,0 +1,162 @@
+"""Concurrent reads and writes with and without the read/write connection split.
+
+Usage (from the repository root):
+
+    python -m benchmarks.mixed_workload --readers-threads 16 --writer-threads 4 --duration 10
+
+The dataset is built once and copied for each mode, so both runs start from
+the same file. In each mode a threaded server takes list and dashboard GETs
+from the reader threads while the writer threads submit reports and
+anomalies. With the split, GETs use the read-only pool and the database runs
+in WAL mode, so reads no longer wait behind the writer's lock.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.run import Scenarios, summarize, git_revision, READER_PIN, SUPERVISOR, ENGINEER
+
+READ_SCENARIOS = ('reports_list_reader', 'reports_list_supervisor_month', 'anomalies_list_supervisor_open',
+                  'dashboard_reader', 'dashboard_supervisor')
+WRITE_SCENARIOS = ('reports_create', 'anomalies_create')
+
+def drive(base_url, scenarios, names, threads, deadline, results):
+    chosen = [s for s in scenarios.all() if s[0] in names]
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local_latencies, local_errors = [], 0
+        while time.perf_counter() < deadline:
+            name, method, path, role, body = rng.choice(chosen)
+            data = json.dumps(body()).encode() if body else None
+            headers = {'Content-Type': 'application/json', **scenarios.headers(role)}
+            req = urllib.request.Request(base_url + path, data=data, method=method, headers=headers)
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=60) as response:
+                    response.read()
+            except (urllib.error.URLError, OSError):
+                local_errors += 1
+            local_latencies.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    results.append((latencies, errors, workers))
+
+def run_mode(database, split, args):
+    from werkzeug.serving import make_server
+    from src.main import create_app
+    from src.models.user import User, Anomaly
+    from benchmarks.dataset import reader_staff_number
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}', 'DATABASE_READ_SPLIT': split})
+    with app.app_context():
+        reader = User.query.filter_by(staff_number=reader_staff_number(0)).first()
+        engineer = User.query.filter_by(role='Commercial Engineer').first()
+        anomaly_ids = [a.id for a in Anomaly.query.with_entities(Anomaly.id).filter_by(staff_id=reader.id).all()]
+
+    client = app.test_client()
+    tokens = {}
+    for role, (staff_number, pin) in {'reader': (reader.staff_number, READER_PIN), 'supervisor': SUPERVISOR, 'engineer': ENGINEER}.items():
+        tokens[role] = client.post('/api/login', json={'staff_number': staff_number, 'pin': pin}).json['token']
+    scenarios = Scenarios(tokens, reader.staff_number, anomaly_ids or [1], engineer.id, random.Random(args.seed))
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    try:
+        runs = []
+        started = time.perf_counter()
+        deadline = started + args.duration
+        drive(base_url, scenarios, READ_SCENARIOS, args.reader_threads, deadline, runs)
+        drive(base_url, scenarios, WRITE_SCENARIOS, args.writer_threads, deadline, runs)
+        for _, _, workers in runs:
+            for worker in workers:
+                worker.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+
+    (read_latencies, read_errors, _), (write_latencies, write_errors, _) = runs
+    return {
+        'reads': summarize(read_latencies, elapsed, errors=read_errors[0]),
+        'writes': summarize(write_latencies, elapsed, errors=write_errors[0])
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=50, help='meter readers in the dataset')
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--reports-per-day', type=int, default=1)
+    parser.add_argument('--anomaly-rate', type=float, default=0.08)
+    parser.add_argument('--escalation-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reader-threads', type=int, default=16)
+    parser.add_argument('--writer-threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load per mode')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='reading-reports-mixed-')
+    base = os.path.join(workdir, 'base.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{base}'
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    results = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+            'dataset': vars(args)
+        }
+    }
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        from src.main import create_app
+        from benchmarks.dataset import build_dataset
+
+        # Built without the split so the copies start out in the default rollback-journal mode
+        with create_app({'DATABASE_READ_SPLIT': False}).app_context():
+            results['meta']['dataset'].update(build_dataset(
+                readers=args.readers, days=args.days, reports_per_day=args.reports_per_day,
+                anomaly_rate=args.anomaly_rate, escalation_rate=args.escalation_rate, seed=args.seed
+            ))
+
+        for name, split in (('single_engine', False), ('read_write_split', True)):
+            database = os.path.join(workdir, f'{name}.db')
+            shutil.copy(base, database)
+            results[name] = run_mode(database, split, args)
+
+    for name in ('single_engine', 'read_write_split'):
+        reads, writes = results[name]['reads'], results[name]['writes']
+        print(f"{name:18} reads {reads['throughput_rps']:>8} req/s p95 {reads['p95_ms']} ms   "
+              f"writes {writes['throughput_rps']:>7} req/s p95 {writes['p95_ms']} ms", file=sys.stderr)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""Benchmark every API endpoint against a synthetic dataset.
+
+Usage (from the repository root):
+
+    python -m benchmarks.run --readers 50 --days 90 --output bench.json
+    python -m benchmarks.compare before.json after.json
+
+Each scenario is driven twice: sequentially through the Flask test client
+(latency and SQL query counts, read from the Server-Timing header) and
+concurrently over HTTP against a threaded server (throughput and latency
+under load). Results are written as JSON so runs can be compared across
+commits.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import date
+
+SERVER_TIMING_QUERIES = re.compile(r'sql;dur=[\d.]+;desc="(\d+) queries"')
+
+READER_PIN = '9000'
+SUPERVISOR = ('12345', '1234')
+ENGINEER = ('67890', '6789')
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def summarize(latencies, elapsed, queries=None, errors=0):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else None
+    }
+    if queries:
+        summary['queries_per_request'] = round(sum(queries) / len(queries), 2)
+        summary['max_queries'] = max(queries)
+    return summary
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+class Scenarios:
+    """Request factories for every endpoint, bound to the tokens and ids of a built dataset"""
+
+    def __init__(self, tokens, reader_staff_number, anomaly_ids, engineer_id, rng):
+        self.tokens = tokens
+        self.reader_staff_number = reader_staff_number
+        self.anomaly_ids = anomaly_ids
+        self.engineer_id = engineer_id
+        self.rng = rng
+        month_start = date.today().replace(day=1)
+        self.month_range = f'start_date={month_start.isoformat()}&end_date={date.today().isoformat()}'
+
+    def all(self):
+        return [
+            ('login', 'POST', '/api/login', None, lambda: {'staff_number': self.reader_staff_number, 'pin': READER_PIN}),
+            ('reports_create', 'POST', '/api/reports', 'reader', self.new_report),
+            ('reports_list_reader', 'GET', '/api/reports', 'reader', None),
+            ('reports_list_supervisor_month', 'GET', f'/api/reports?{self.month_range}', 'supervisor', None),
+            ('reports_download_csv', 'GET', f'/api/reports/download?format=csv&{self.month_range}', 'supervisor', None),
+            ('reports_download_excel', 'GET', f'/api/reports/download?format=excel&{self.month_range}', 'supervisor', None),
+            ('anomalies_create', 'POST', '/api/anomalies', 'reader', self.new_anomaly),
+            ('anomalies_list_reader', 'GET', '/api/anomalies', 'reader', None),
+            ('anomalies_list_supervisor_open', 'GET', '/api/anomalies?resolution_status=Open', 'supervisor', None),
+            ('anomalies_escalate', 'POST', '/api/escalate', 'supervisor', self.new_escalation),
+            ('escalations_list', 'GET', '/api/escalations', 'supervisor', None),
+            ('dashboard_reader', 'GET', '/api/dashboard/reader', 'reader', None),
+            ('dashboard_supervisor', 'GET', '/api/dashboard/supervisor', 'supervisor', None),
+            ('dashboard_stats', 'GET', '/api/dashboard/stats?days=30', 'supervisor', None)
+        ]
+
+    def new_report(self):
+        return {
+            'itin': f'ITIN{self.rng.randint(1, 99999):05d}',
+            'report_date': date.today().isoformat(),
+            'percentage_attained': round(self.rng.uniform(60, 100), 1),
+            'reasons_not_attained': 'Benchmark'
+        }
+
+    def new_anomaly(self):
+        return {'type': 'Faulty Meter', 'description': 'Benchmark anomaly'}
+
+    def new_escalation(self):
+        return {'anomaly_id': self.rng.choice(self.anomaly_ids), 'escalated_to_id': self.engineer_id}
+
+    def headers(self, role):
+        return {'Authorization': f'Bearer {self.tokens[role]}'} if role else {}
+
+def run_test_client(app, scenarios, iterations):
+    client = app.test_client()
+    results = {}
+    for name, method, path, role, body in scenarios.all():
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            response = client.open(path, method=method, headers=scenarios.headers(role), json=body() if body else None)
+            latencies.append(time.perf_counter() - t0)
+            if response.status_code >= 400:
+                errors += 1
+            match = SERVER_TIMING_QUERIES.search(response.headers.get('Server-Timing', ''))
+            if match:
+                queries.append(int(match.group(1)))
+        results[name] = summarize(latencies, time.perf_counter() - started, queries, errors)
+    return results
+
+def run_http(base_url, scenarios, concurrency, duration):
+    results = {}
+    for name, method, path, role, body in scenarios.all():
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def worker():
+            local_latencies, local_errors = [], 0
+            while time.perf_counter() < deadline:
+                data = json.dumps(body()).encode() if body else None
+                headers = {'Content-Type': 'application/json', **scenarios.headers(role)}
+                req = urllib.request.Request(base_url + path, data=data, method=method, headers=headers)
+                t0 = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(req, timeout=60) as response:
+                        response.read()
+                except (urllib.error.URLError, OSError):
+                    local_errors += 1
+                local_latencies.append(time.perf_counter() - t0)
+            with lock:
+                latencies.extend(local_latencies)
+                errors[0] += local_errors
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[name] = summarize(latencies, time.perf_counter() - started, errors=errors[0])
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=20)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--reports-per-day', type=int, default=1)
+    parser.add_argument('--anomaly-rate', type=float, default=0.2)
+    parser.add_argument('--escalation-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--iterations', type=int, default=20, help='sequential test-client requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent HTTP clients')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of HTTP load per scenario')
+    parser.add_argument('--skip-http', action='store_true')
+    parser.add_argument('--database', help='SQLite file to use (default: a temporary file)')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='reading-reports-bench-')
+    database = args.database or os.path.join(workdir, 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    # The load generator is a single IP hammering the heavy endpoints on purpose
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+    # Endpoints print email bodies; keep them out of the results
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        from src.main import create_app
+        from src.models.user import User, Anomaly
+        from benchmarks.dataset import build_dataset, reader_staff_number
+
+        app = create_app()
+
+        with app.app_context():
+            t0 = time.perf_counter()
+            counts = build_dataset(
+                readers=args.readers, days=args.days, reports_per_day=args.reports_per_day,
+                anomaly_rate=args.anomaly_rate, escalation_rate=args.escalation_rate, seed=args.seed
+            )
+            build_seconds = time.perf_counter() - t0
+            reader = User.query.filter_by(staff_number=reader_staff_number(0)).first()
+            engineer = User.query.filter_by(role='Commercial Engineer').first()
+            anomaly_ids = [a.id for a in Anomaly.query.with_entities(Anomaly.id).filter_by(staff_id=reader.id).all()]
+
+        client = app.test_client()
+        tokens = {}
+        for role, (staff_number, pin) in {'reader': (reader.staff_number, READER_PIN), 'supervisor': SUPERVISOR, 'engineer': ENGINEER}.items():
+            tokens[role] = client.post('/api/login', json={'staff_number': staff_number, 'pin': pin}).json['token']
+
+        scenarios = Scenarios(tokens, reader.staff_number, anomaly_ids or [1], engineer.id, random.Random(args.seed))
+        results = {
+            'meta': {
+                'git_revision': git_revision(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'dataset': {**vars(args), **counts, 'build_seconds': round(build_seconds, 2)}
+            },
+            'test_client': run_test_client(app, scenarios, args.iterations)
+        }
+
+        if not args.skip_http:
+            from werkzeug.serving import make_server
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                results['http'] = run_http(f'http://127.0.0.1:{server.server_port}', scenarios, args.concurrency, args.duration)
+            finally:
+                server.shutdown()
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
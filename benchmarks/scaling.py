@@ -0,0 +1,145 @@
+"""Throughput of the production server as the number of gunicorn workers grows.
+
+Usage (from the repository root):
+
+    python -m benchmarks.scaling --workers 1,2,4,8 --concurrency 32 --output scaling.json
+
+The dataset is built once, then gunicorn is started with gunicorn.conf.py for
+each worker count and the read scenarios of benchmarks.run are driven over
+HTTP against it. Write scenarios are left out by default: SQLite serializes
+writers, so they measure the database rather than the server.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.run import Scenarios, run_http, git_revision, READER_PIN, SUPERVISOR, ENGINEER
+
+READ_SCENARIOS = (
+    'reports_list_reader', 'reports_list_supervisor_month', 'anomalies_list_reader',
+    'anomalies_list_supervisor_open', 'escalations_list', 'dashboard_reader',
+    'dashboard_supervisor', 'dashboard_stats'
+)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(base_url, process, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        try:
+            with urllib.request.urlopen(base_url + '/api/metrics', timeout=2):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start in time')
+
+@contextlib.contextmanager
+def gunicorn(workers, threads, env):
+    port = free_port()
+    env = {**env, 'GUNICORN_BIND': f'127.0.0.1:{port}', 'GUNICORN_WORKERS': str(workers),
+           'GUNICORN_THREADS': str(threads), 'GUNICORN_ACCESS_LOG': ''}
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_until_ready(base_url, process)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=50)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--reports-per-day', type=int, default=1)
+    parser.add_argument('--anomaly-rate', type=float, default=0.08)
+    parser.add_argument('--escalation-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', default=f'1,2,4,{os.cpu_count() or 1}', help='comma-separated worker counts')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent HTTP clients')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of load per scenario')
+    parser.add_argument('--scenarios', default=','.join(READ_SCENARIOS), help='comma-separated scenario names')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='reading-reports-scaling-')
+    database = os.path.join(workdir, 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        from src.main import create_app
+        from src.models.user import User, Anomaly
+        from benchmarks.dataset import build_dataset, reader_staff_number
+
+        app = create_app()
+        with app.app_context():
+            counts = build_dataset(
+                readers=args.readers, days=args.days, reports_per_day=args.reports_per_day,
+                anomaly_rate=args.anomaly_rate, escalation_rate=args.escalation_rate, seed=args.seed
+            )
+            reader = User.query.filter_by(staff_number=reader_staff_number(0)).first()
+            engineer = User.query.filter_by(role='Commercial Engineer').first()
+            anomaly_ids = [a.id for a in Anomaly.query.with_entities(Anomaly.id).filter_by(staff_id=reader.id).all()]
+
+        client = app.test_client()
+        tokens = {}
+        for role, (staff_number, pin) in {'reader': (reader.staff_number, READER_PIN), 'supervisor': SUPERVISOR, 'engineer': ENGINEER}.items():
+            tokens[role] = client.post('/api/login', json={'staff_number': staff_number, 'pin': pin}).json['token']
+
+    wanted = set(args.scenarios.split(','))
+    scenarios = Scenarios(tokens, reader.staff_number, anomaly_ids or [1], engineer.id, random.Random(args.seed))
+    all_scenarios = scenarios.all
+    scenarios.all = lambda: [s for s in all_scenarios() if s[0] in wanted]
+
+    results = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+            'dataset': {**vars(args), **counts}
+        },
+        'workers': {}
+    }
+
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(',')]:
+        with gunicorn(workers, args.threads, dict(os.environ)) as base_url:
+            per_scenario = run_http(base_url, scenarios, args.concurrency, args.duration)
+        total = sum(s['throughput_rps'] or 0 for s in per_scenario.values())
+        baseline = baseline or total
+        results['workers'][workers] = {
+            'throughput_rps': round(total, 2),
+            'speedup': round(total / baseline, 2) if baseline else None,
+            'scenarios': per_scenario
+        }
+        print(f'{workers:>3} workers: {total:>9.1f} req/s  x{total / baseline if baseline else 0:.2f}', file=sys.stderr)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Report inserts per second as regions move onto shards of their own.
+
+Usage (from the repository root):
+
+    python -m benchmarks.sharding --shards 1,2,4 --readers-per-region 25 --duration 10
+
+For each number of shards, one meter reader per submitter is created across
+that many regions and reports are POSTed over HTTP to a threaded server for
+the given duration, on fresh databases each time. With one shard every region
+shares the main database, as before sharding; with more, each region writes
+to a SQLite file of its own, so writers only wait on their region's lock.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import date
+
+from benchmarks.run import READER_PIN, summarize, git_revision
+
+def submit_reports(base_url, tokens, duration):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed, token):
+        rng = random.Random(seed)
+        local_latencies, local_errors = [], 0
+        while time.perf_counter() < deadline:
+            body = json.dumps({
+                'itin': f'ITIN{rng.randint(1, 99999):05d}',
+                'report_date': date.today().isoformat(),
+                'percentage_attained': round(rng.uniform(60, 100), 1),
+                'reasons_not_attained': 'Benchmark'
+            }).encode()
+            req = urllib.request.Request(base_url + '/api/reports', data=body, method='POST', headers={
+                'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'
+            })
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=60) as response:
+                    response.read()
+            except (urllib.error.URLError, OSError):
+                local_errors += 1
+            local_latencies.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i, token)) for i, token in enumerate(tokens)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - started, errors=errors[0])
+
+def run_shards(workdir, shards, readers_per_region, duration):
+    from werkzeug.serving import make_server
+    from src.main import create_app
+    from src.models import sharding
+    from src.models.user import User, Report, db
+
+    regions = [f'region{i}' for i in range(1, shards + 1)]
+    # A single shard is the main database alone, as an unsharded deployment runs
+    sharded = regions if shards > 1 else []
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'app.db')}",
+        'DATABASE_SHARDS': ','.join(sharded)
+    })
+
+    readers = []
+    with app.app_context():
+        for r, region in enumerate(regions):
+            for i in range(readers_per_region):
+                staff_number = f'7{r:02d}{i:04d}'
+                user = User(staff_number=staff_number, role='Meter Reader', region=region)
+                user.set_pin(READER_PIN)
+                db.session.add(user)
+                readers.append(staff_number)
+        db.session.commit()
+    client = app.test_client()
+    tokens = [client.post('/api/login', json={'staff_number': s, 'pin': READER_PIN}).json['token'] for s in readers]
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        result = submit_reports(f'http://127.0.0.1:{server.server_port}', tokens, duration)
+    finally:
+        server.shutdown()
+
+    with app.app_context():
+        rows = {}
+        for region in sharding.all_shards():
+            with sharding.use_shard(region):
+                rows[region or 'main'] = Report.query.count()
+        result['rows_written'] = sum(rows.values())
+        result['rows_per_database'] = rows
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', default='1,2,4', help='comma-separated numbers of shards')
+    parser.add_argument('--readers-per-region', type=int, default=25, help='concurrent submitters in each region')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load per run')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix='reading-reports-sharding-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(root, 'unused.db')}"
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    results = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+            'duration': args.duration,
+            'readers_per_region': args.readers_per_region
+        },
+        'runs': {}
+    }
+
+    for shards in [int(n) for n in args.shards.split(',')]:
+        workdir = os.path.join(root, f'shards_{shards}')
+        os.makedirs(workdir)
+        # Confirmation emails are printed; keep them out of the results
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = run_shards(workdir, shards, args.readers_per_region, args.duration)
+        results['runs'][str(shards)] = result
+        print(f"{shards:>3} shards {result['throughput_rps']:>8} inserts/s  "
+              f"p95 {result['p95_ms']} ms  errors {result['errors']}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Gunicorn settings for production.
+
+Every setting can be overridden from the environment (GUNICORN_WORKERS,
+GUNICORN_THREADS, ...) or the command line.
+
+The app is loaded once in the master (preload_app) so Flask and
+SQLAlchemy are imported a single time and shared copy-on-write by the
+forked workers. pandas, NumPy and openpyxl are not imported at startup:
+only workers that serve an export, import or forecast load them.
+Connections must not cross the fork, so each worker discards the
+inherited pools of every engine (main, shards and replicas) in post_fork.
+
+Each worker counts its own requests; METRICS_DIR (a fresh temporary
+directory per master unless set) is where the workers leave those counts
+so /api/metrics can add them up. Under uvicorn with several workers, set
+METRICS_DIR yourself to an empty directory for the same result.
+
+Reloading:
+    kill -HUP <master>     restarts the workers gracefully; with preload_app
+                           they keep the code loaded in the master
+    kill -USR2 <master>    starts a new master with new code alongside the
+                           old one; then kill -WINCH and -QUIT the old master
+"""
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+# Set before the app is loaded, so every worker inherits the same directory
+_own_metrics_dir = 'METRICS_DIR' not in os.environ
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'reading-reports-metrics-{os.getpid()}'))
+
+wsgi_app = 'src.wsgi:app'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Recycle workers periodically so slow leaks (pandas, openpyxl) cannot accumulate
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+# Spreadsheet exports of a large month can take a while
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+
+def on_starting(server):
+    # Counts left by an earlier master with the same pid would be added to this one's
+    if _own_metrics_dir:
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+def on_exit(server):
+    if _own_metrics_dir:
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+def post_fork(server, worker):
+    from src.wsgi import app
+    from src.models.user import db
+    with app.app_context():
+        # Drop pooled connections inherited from the master without closing them under its feet;
+        # db.engines also holds the shard and replica engines
+        for engine in db.engines.values():
+            engine.dispose(close=False)
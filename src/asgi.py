@@ -0,0 +1,206 @@
+"""ASGI entry point: the read-heavy endpoints on asyncio, everything else on Flask.
+
+    uvicorn src.asgi:app --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 src.asgi:app
+
+GET requests for report, anomaly and escalation lists and the dashboards are answered by
+the async views in src.routes.async_reads, so thousands of open polls wait on the event
+loop instead of each holding a worker thread. Every other request, and any read the
+async views do not cover, runs through the Flask app on a thread pool as under gunicorn.
+
+Behind a reverse proxy, use uvicorn's --proxy-headers and --forwarded-allow-ips instead
+of PROXY_FIX_HOPS: the async views read the client address from the ASGI scope.
+"""
+import os
+import sys
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from flask import request
+from src.main import create_app
+from src.models.async_engines import AsyncEngines
+from src.models import sharding
+from src.routes.async_reads import ASYNC_VIEWS, sync_only
+
+# Threads running Flask for requests the async views do not serve
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', '8'))
+# Serve the async views; with false every request goes through Flask
+ASGI_ASYNC_READS = os.environ.get('ASGI_ASYNC_READS', 'true').lower() == 'true'
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope"""
+    script_name = scope.get('root_path', '').encode('utf8').decode('latin1')
+    path_info = scope['path'].encode('utf8').decode('latin1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = f"HTTP_{name.upper().replace('-', '_')}"
+        value = value.decode('latin1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def preprocess_request(app):
+    """app.preprocess_request(), and the shards of the request, which the async views need"""
+    response = app.preprocess_request()
+    if response is None:
+        sharding.request_shards()
+    return response
+
+def response_body(response):
+    body = response.get_data()
+    # Runs the response's close callbacks, which record its metrics
+    response.close()
+    return body
+
+def _start_message(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+    }
+
+class AsgiApp:
+    """ASGI application serving `flask_app`, with async views for the endpoints in ASYNC_VIEWS"""
+
+    def __init__(self, flask_app, async_reads=ASGI_ASYNC_READS):
+        self.flask_app = flask_app
+        self.engines = AsyncEngines(flask_app) if async_reads else None
+        if self.engines is not None and not self.engines.supported:
+            print('No async database driver for the configured database; serving every request through Flask')
+            self.engines = None
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            if not (self.engines is not None and scope['method'] == 'GET' and await self.serve_async(scope, send)):
+                await self.serve_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engines is not None:
+                    await self.engines.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def serve_async(self, scope, send):
+        """Answer a GET with its async view; returns False when the request needs Flask"""
+        app = self.flask_app
+        ctx = app.request_context(build_environ(scope, BytesIO()))
+        ctx.push()
+        error = None
+        try:
+            view = ASYNC_VIEWS.get(request.endpoint)
+            if view is None or sync_only():
+                return False
+            # Flask's own request handling, with the view awaited in place of the sync one. The
+            # hooks around it block (rate limits on Redis, the user's region on the database,
+            # compression), so they run on a thread, in a copy of the request's context
+            try:
+                try:
+                    response = await asyncio.to_thread(preprocess_request, app)
+                    if response is None:
+                        response = await view(self.engines)
+                except Exception as e:
+                    response = app.handle_user_exception(e)
+                response = await asyncio.to_thread(app.finalize_request, response)
+            except Exception as e:
+                error = e
+                response = app.handle_exception(e)
+            body = await asyncio.to_thread(response_body, response)
+        finally:
+            ctx.pop(error)
+
+        await send(_start_message(response.status_code, response.headers.to_wsgi_list()))
+        await send({'type': 'http.response.body', 'body': body})
+        return True
+
+    def executor(self):
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix='wsgi')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    async def serve_wsgi(self, scope, receive, send):
+        """Run the Flask app on the thread pool, passing its response chunks back to the loop"""
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+
+            loop = asyncio.get_running_loop()
+            environ = build_environ(scope, body)
+
+            def send_from_thread(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            def run():
+                # The whole response is produced on one thread: streamed bodies keep the request
+                # context they push on their first chunk
+                started = []
+
+                def start_response(status, headers, exc_info=None):
+                    started[:] = [int(status.split(' ', 1)[0]), headers]
+
+                iterable = self.flask_app(environ, start_response)
+                try:
+                    sent = False
+                    for chunk in iterable:
+                        if not sent:
+                            send_from_thread(_start_message(*started))
+                            sent = True
+                        if chunk:
+                            send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                    if not sent:
+                        send_from_thread(_start_message(*started))
+                    send_from_thread({'type': 'http.response.body'})
+                finally:
+                    if hasattr(iterable, 'close'):
+                        iterable.close()
+
+            await loop.run_in_executor(self.executor(), run)
+
+def create_asgi_app(flask_app=None):
+    return AsgiApp(flask_app or create_app())
+
+app = create_asgi_app()
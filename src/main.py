@@ -3,39 +3,99 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_cors import CORS
 from src.models.user import db
+from src.models import routing, sharding, migrations
 from src.routes.user import user_bp
 from src.routes.auth import auth_bp
 from src.routes.reports import reports_bp
 from src.routes.anomalies import anomalies_bp
+from src.routes.attachments import attachments_bp
 from src.routes.email_service import email_bp
+from src.routes.archive import archive_bp
+from src.routes.backup import backup_bp
+from src.routes.sync import sync_bp
+from src.routes.itineraries import itineraries_bp
+from src.routes.exports import exports_bp
+from src.routes.imports import imports_bp
+from src.routes.metrics import metrics_bp
+from src.routes.generator import generator_bp
+from src.routes.static_assets import assets_bp
+from src.utils.json_provider import FastJSONProvider
+from src.utils import compression, rate_limit, group_commit, backup
 
 from src.routes.dashboard import dashboard_bp
 
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
-app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+def create_app(config=None):
+    """Build the application; `config` overrides settings such as SQLALCHEMY_DATABASE_URI"""
+    app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+    app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+    app.json = FastJSONProvider(app)
 
-# Enable CORS for all routes
-CORS(app, origins="*")
+    # Database configuration
+    os.makedirs(os.path.join(os.path.dirname(__file__), 'database'), exist_ok=True)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'DATABASE_URL',
+        f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+    )
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if config:
+        app.config.update(config)
 
-# Register blueprints
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(auth_bp, url_prefix='/api')
-app.register_blueprint(reports_bp, url_prefix='/api')
-app.register_blueprint(anomalies_bp, url_prefix='/api')
-app.register_blueprint(dashboard_bp, url_prefix='/api')
-app.register_blueprint(email_bp, url_prefix='/api')
+    # Behind a reverse proxy, trust this many X-Forwarded-* hops for client IPs
+    proxy_hops = int(os.environ.get('PROXY_FIX_HOPS', '0'))
+    if proxy_hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops, x_proto=proxy_hops, x_host=proxy_hops)
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
+    # Enable CORS for all routes
+    CORS(app, origins="*")
 
-with app.app_context():
-    db.create_all()
-    
+    # Register blueprints
+    # Metrics first, so its timing hooks wrap every other blueprint's hooks
+    app.register_blueprint(metrics_bp, url_prefix='/api')
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(auth_bp, url_prefix='/api')
+    app.register_blueprint(reports_bp, url_prefix='/api')
+    app.register_blueprint(exports_bp, url_prefix='/api')
+    app.register_blueprint(imports_bp, url_prefix='/api')
+    app.register_blueprint(anomalies_bp, url_prefix='/api')
+    app.register_blueprint(attachments_bp, url_prefix='/api')
+    app.register_blueprint(dashboard_bp, url_prefix='/api')
+    app.register_blueprint(email_bp, url_prefix='/api')
+    app.register_blueprint(archive_bp, url_prefix='/api')
+    app.register_blueprint(backup_bp, url_prefix='/api')
+    app.register_blueprint(sync_bp, url_prefix='/api')
+    app.register_blueprint(itineraries_bp, url_prefix='/api')
+    app.register_blueprint(generator_bp)
+    # Serves the SPA from an in-memory manifest of the static folder
+    app.register_blueprint(assets_bp)
+
+    # After-request hooks run in reverse order of registration, so compression is timed by the metrics blueprint
+    compression.init_app(app)
+    rate_limit.init_app(app)
+
+    # Regions listed in DATABASE_SHARDS keep their reports and anomalies in databases of their own
+    sharding.init_app(app)
+    # GET requests read from a read-only pool; writes go to the single writer engine
+    routing.init_app(app)
+    db.init_app(app)
+    # Optionally batch report and anomaly inserts from concurrent requests into one commit
+    group_commit.init_app(app)
+    # Optionally snapshot the databases on a schedule, from whichever worker gets there first
+    backup.init_app(app)
+
+    with app.app_context():
+        routing.prepare_engines(db)
+        sharding.prepare_engines(db)
+        db.create_all()
+        migrations.run()
+        seed_default_users()
+
+    return app
+
+def seed_default_users():
     # Initialize default users if they don't exist
     from src.models.user import User
     
@@ -69,23 +129,5 @@ with app.app_context():
     
     db.session.commit()
 
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-            return "Static folder not configured", 404
-
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
-            return "index.html not found", 404
-
-
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
-
+    create_app().run(host='0.0.0.0', port=5000, debug=True)
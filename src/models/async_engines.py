@@ -0,0 +1,84 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from src.models import routing, sharding
+
+try:
+    import aiosqlite
+except ImportError:  # only needed to serve reads from SQLite on the async path
+    aiosqlite = None
+
+try:
+    import asyncpg
+except ImportError:  # only needed to serve reads from Postgres on the async path
+    asyncpg = None
+
+# Sync backend -> (async driver URL scheme, driver module or None when not installed)
+ASYNC_DRIVERS = {
+    'sqlite': ('sqlite+aiosqlite', aiosqlite),
+    'postgresql': ('postgresql+asyncpg', asyncpg)
+}
+# Connections per async engine; each SQLite connection runs its queries on a thread of its own
+ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', '8'))
+ASYNC_POOL_OVERFLOW = int(os.environ.get('ASYNC_POOL_OVERFLOW', '8'))
+
+def async_url(url):
+    """The asyncio driver form of a sync engine URL, or None without a driver for its backend"""
+    driver, module = ASYNC_DRIVERS.get(url.get_backend_name(), (None, None))
+    if module is None or (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')):
+        return None
+    return url.set(drivername=driver)
+
+def _busy_timeout(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
+
+class AsyncEngines:
+    """An asyncio engine for every writer and read-only engine of a Flask app
+
+    Built from the app's sync engines, so the async path reads the same databases, shards
+    and replicas. `supported` is false when a backend has no async driver installed (or
+    the database is in memory); the caller then keeps serving everything synchronously.
+    """
+
+    def __init__(self, app):
+        self.engines = {}
+        self.supported = True
+        with app.app_context():
+            db = app.extensions['sqlalchemy']
+            main = db.engine.url
+            directory = None
+            if main.get_backend_name() == 'sqlite' and main.database and main.database != ':memory:':
+                directory = os.path.abspath(main.database)
+            for key, engine in db.engines.items():
+                url = async_url(engine.url)
+                if url is None:
+                    self.supported = False
+                    continue
+                if url.get_backend_name() == 'sqlite':
+                    async_engine = create_async_engine(url, pool_size=ASYNC_POOL_SIZE, max_overflow=ASYNC_POOL_OVERFLOW)
+                    event.listen(async_engine.sync_engine, 'connect', _busy_timeout)
+                    # SQLite shards see the users and anomaly types of the main database
+                    if key is not None and key.startswith('shard:') and directory is not None:
+                        read_only = key.endswith(f':{routing.READ_BIND}')
+                        event.listen(async_engine.sync_engine, 'connect', sharding.attach_directory(directory, read_only))
+                else:
+                    async_engine = create_async_engine(url, pool_size=ASYNC_POOL_SIZE, max_overflow=ASYNC_POOL_OVERFLOW, pool_pre_ping=True)
+                self.engines[key] = async_engine
+
+    def for_shard(self, region):
+        """Engine to read `region`'s shard with in the current request; None is the main database
+
+        Reads go to the read-only engine unless the caller wrote moments ago.
+        """
+        key = sharding.bind_key(region)
+        if routing.reads_allowed():
+            engine = self.engines.get(routing.read_bind_key(key))
+            if engine is not None:
+                return engine
+        return self.engines[key]
+
+    async def dispose(self):
+        for engine in self.engines.values():
+            await engine.dispose()
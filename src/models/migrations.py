@@ -0,0 +1,116 @@
+import re
+from datetime import datetime
+from sqlalchemy import DateTime, bindparam, inspect, select, text
+from src.models import sharding
+from src.models.user import AnomalyType, AnomalyTypeCatalog, anomaly_types, db, install_change_triggers, install_itin_stat_triggers
+
+ANOMALY_ARCHIVE_TABLE = re.compile(r'^anomaly_archive_\d{4}$')
+ESCALATION_ARCHIVE_TABLE = re.compile(r'^escalation_archive_\d{4}$')
+
+def column_names(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+def ensure_column(conn, table, name, ddl):
+    """Add column `name` to `table` as `ddl` unless it is already there; returns whether it was added"""
+    if name in column_names(conn, table):
+        return False
+    conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+    return True
+
+def migrate_anomaly_types(conn):
+    """Move the free-text anomaly.type column, live and archived, onto AnomalyType ids"""
+    tables = [name for name in inspect(conn).get_table_names() if name == 'anomaly' or ANOMALY_ARCHIVE_TABLE.match(name)]
+    migrated = False
+    for table in tables:
+        if 'type' not in column_names(conn, table):
+            continue
+        ensure_column(conn, table, 'type_id', 'INTEGER REFERENCES anomaly_type (id)' if table == 'anomaly' else 'INTEGER')
+
+        catalog = AnomalyType.__table__
+        known = {}
+        for type_id, name in conn.execute(select(catalog.c.id, catalog.c.name)):
+            known.setdefault(AnomalyTypeCatalog.normalize(name).casefold(), type_id)
+
+        # The most common spelling of a name becomes the catalog entry for all its variants
+        for raw, _ in conn.execute(text(f'SELECT type, COUNT(*) FROM {table} GROUP BY type ORDER BY COUNT(*) DESC')).all():
+            canonical = AnomalyTypeCatalog.normalize(raw or 'Unspecified')
+            key = canonical.casefold()
+            if key not in known:
+                known[key] = conn.execute(catalog.insert().values(name=canonical)).inserted_primary_key[0]
+            if raw is None:
+                conn.execute(text(f'UPDATE {table} SET type_id = :type_id WHERE type IS NULL'), {'type_id': known[key]})
+            else:
+                conn.execute(text(f'UPDATE {table} SET type_id = :type_id WHERE type = :raw'), {'type_id': known[key], 'raw': raw})
+
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_type_id ON {table} (type_id)'))
+        conn.execute(text(f'ALTER TABLE {table} DROP COLUMN type'))
+        migrated = True
+    return migrated
+
+def refresh_current_escalations(conn, anomaly='anomaly', escalation='escalation', min_anomaly_id=None):
+    """Point current_escalation_id of anomalies (with id above `min_anomaly_id`) at their latest escalation"""
+    query = (
+        f'UPDATE {anomaly} SET current_escalation_id = ('
+        f'SELECT e.id FROM {escalation} e WHERE e.anomaly_id = {anomaly}.id '
+        f'ORDER BY e.escalation_timestamp DESC, e.id DESC LIMIT 1)'
+    )
+    if min_anomaly_id is not None:
+        conn.execute(text(query + ' WHERE id > :min_id'), {'min_id': min_anomaly_id})
+    else:
+        conn.execute(text(query))
+
+def migrate_current_escalations(conn):
+    """Add and backfill anomaly.current_escalation_id, live and archived"""
+    names = set(inspect(conn).get_table_names())
+    for table in sorted(names):
+        if table != 'anomaly' and not ANOMALY_ARCHIVE_TABLE.match(table):
+            continue
+        ddl = 'INTEGER REFERENCES escalation (id)' if table == 'anomaly' else 'INTEGER'
+        if not ensure_column(conn, table, 'current_escalation_id', ddl):
+            continue
+        # An archived anomaly's escalations are archived under the same year
+        escalation = table.replace('anomaly', 'escalation', 1)
+        if escalation in names:
+            refresh_current_escalations(conn, table, escalation)
+
+def migrate_notification_delivery(conn, now):
+    """Add the escalation delivery columns, live and archived
+
+    Open anomalies' current escalations are due right away, so the first sweep notifies
+    each recipient once and delivery is tracked from then on.
+    """
+    for table in sorted(inspect(conn).get_table_names()):
+        if table != 'escalation' and not ESCALATION_ARCHIVE_TABLE.match(table):
+            continue
+        ensure_column(conn, table, 'notified_at', 'DATETIME')
+        ensure_column(conn, table, 'notify_attempts', 'INTEGER NOT NULL DEFAULT 0')
+        ensure_column(conn, table, 'last_notify_error', 'TEXT')
+        if ensure_column(conn, table, 'next_notify_at', 'DATETIME') and table == 'escalation':
+            conn.execute(text(
+                "UPDATE escalation SET next_notify_at = :now WHERE id IN ("
+                "SELECT current_escalation_id FROM anomaly WHERE escalation_flag "
+                "AND resolution_status NOT IN ('Resolved', 'Closed')) AND resolution_status != 'Resolved'"
+            ).bindparams(bindparam('now', now, type_=DateTime)))
+
+def create_missing_indexes(conn):
+    """create_all() skips tables that already exist; add any index they lack"""
+    names = set(inspect(conn).get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in names:
+            continue
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def run():
+    """Bring an existing database, and every region shard, up to the current models; call after db.create_all()"""
+    for region, engine in sharding.writer_engines(db):
+        with engine.begin() as conn:
+            if region is None:
+                ensure_column(conn, 'user', 'region', 'VARCHAR(50)')
+            if migrate_anomaly_types(conn):
+                anomaly_types.clear()
+            migrate_current_escalations(conn)
+            migrate_notification_delivery(conn, datetime.utcnow())
+            create_missing_indexes(conn)
+            install_change_triggers(conn)
+            install_itin_stat_triggers(conn)
@@ -0,0 +1,74 @@
+"""Read-only queries returning plain rows instead of ORM objects
+
+List, dashboard and download endpoints only turn what they load into dicts, so they select
+exactly the columns of to_dict() with the staff numbers joined in, and skip the identity
+map, attribute instrumentation and lazy-load hooks of the ORM. Rows come back in to_dict()
+order, so a dict is a single zip.
+
+The base statement of each table is built once. Statements derived from it differ only in
+their bound values, so they hit the engine's compiled-statement cache on every call after
+the first. Live and archive tables share them: archive tables have the same columns.
+"""
+from functools import lru_cache
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+from src.models.user import User, Report, Anomaly, Escalation, anomaly_types
+
+REPORT_KEYS = (
+    'id', 'itin', 'report_date', 'percentage_attained', 'reasons_not_attained', 'staff_id',
+    'staff_number', 'timestamp', 'status', 'notes_comments'
+)
+ANOMALY_KEYS = (
+    'id', 'report_id', 'type', 'description', 'timestamp', 'escalation_flag', 'current_escalation_id',
+    'assigned_to_id', 'assigned_to_staff_number', 'resolution_status', 'staff_id', 'staff_number'
+)
+ESCALATION_KEYS = (
+    'id', 'anomaly_id', 'escalation_timestamp', 'escalated_to_id', 'escalated_to_staff_number',
+    'resolution_status', 'notified_at', 'notify_attempts', 'last_notify_error'
+)
+
+@lru_cache(maxsize=None)
+def report_select(table=Report.__table__):
+    """SELECT of the report columns of to_dict(), with the reader's staff number, from `table`"""
+    staff = aliased(User.__table__, name='staff')
+    c = table.c
+    return select(
+        c.id, c.itin, c.report_date, c.percentage_attained, c.reasons_not_attained, c.staff_id,
+        staff.c.staff_number, c.timestamp, c.status, c.notes_comments
+    ).select_from(table).outerjoin(staff, staff.c.id == c.staff_id)
+
+@lru_cache(maxsize=None)
+def anomaly_select(table=Anomaly.__table__):
+    """SELECT of the anomaly columns of to_dict(), with reporter and assignee staff numbers, from `table`"""
+    staff = aliased(User.__table__, name='staff')
+    assignee = aliased(User.__table__, name='assignee')
+    c = table.c
+    return select(
+        c.id, c.report_id, c.type_id, c.description, c.timestamp, c.escalation_flag, c.current_escalation_id,
+        c.assigned_to_id, assignee.c.staff_number.label('assigned_to_staff_number'), c.resolution_status,
+        c.staff_id, staff.c.staff_number
+    ).select_from(table).outerjoin(staff, staff.c.id == c.staff_id).outerjoin(assignee, assignee.c.id == c.assigned_to_id)
+
+@lru_cache(maxsize=None)
+def escalation_select(table=Escalation.__table__):
+    """SELECT of the escalation columns of to_dict(), with the recipient's staff number, from `table`"""
+    recipient = aliased(User.__table__, name='recipient')
+    c = table.c
+    return select(
+        c.id, c.anomaly_id, c.escalation_timestamp, c.escalated_to_id, recipient.c.staff_number.label('escalated_to_staff_number'),
+        c.resolution_status, c.notified_at, c.notify_attempts, c.last_notify_error
+    ).select_from(table).outerjoin(recipient, recipient.c.id == c.escalated_to_id)
+
+def report_dict(row):
+    """Report.to_dict() of a report_select() row"""
+    return dict(zip(REPORT_KEYS, row))
+
+def anomaly_dict(row):
+    """Anomaly.to_dict() of an anomaly_select() row"""
+    item = dict(zip(ANOMALY_KEYS, row))
+    item['type'] = anomaly_types.name(item['type'])
+    return item
+
+def escalation_dict(row):
+    """Escalation.to_dict() of an escalation_select() row"""
+    return dict(zip(ESCALATION_KEYS, row))
@@ -0,0 +1,162 @@
+import os
+import time
+import threading
+import jwt
+from flask import g, request, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from src.models import sharding
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+# Bind key of the read-only engine in SQLALCHEMY_BINDS
+READ_BIND = 'read'
+READ_METHODS = ('GET', 'HEAD')
+
+# Send GET requests to a read-only pool; a SQLite file database gets one automatically
+DATABASE_READ_SPLIT = os.environ.get('DATABASE_READ_SPLIT', 'true').lower() == 'true'
+# A replica to read from instead, e.g. a Postgres streaming replica
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL', '')
+DATABASE_READ_POOL_SIZE = int(os.environ.get('DATABASE_READ_POOL_SIZE', '8'))
+# After a user's own write, their reads go to the writer for this long, so a lagging replica
+# never hides what they just submitted
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '5'))
+READ_YOUR_WRITES_COOKIE = 'rw_until'
+
+_recent_writers = {}
+_recent_lock = threading.Lock()
+
+class RoutingSession(Session):
+    """Session that reads from the read-only engine while serving GET requests
+
+    Flushes always go to the writer, so a GET handler that does write still works;
+    its reads and writes then simply use two connections.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engines = self._db.engines
+            # Rows of a sharded table live in the database of the caller's region
+            key = sharding.bind_key(sharding.statement_shard(mapper, clause))
+            if not self._flushing and reads_allowed():
+                engine = engines.get(read_bind_key(key))
+                if engine is not None:
+                    return engine
+            if key is not None:
+                return engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def read_bind_key(key):
+    """Bind key of the read-only engine for the writer engine bound as `key`"""
+    return READ_BIND if key is None else f'{key}:{READ_BIND}'
+
+def reads_allowed():
+    """Whether the current request may read from the read-only engines"""
+    if not has_request_context() or request.method not in READ_METHODS:
+        return False
+    if 'use_writer' not in g:
+        g.use_writer = _wrote_recently()
+    return not g.use_writer
+
+def _token_user_id():
+    token = request.headers.get('Authorization', '')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=['HS256'])['user_id']
+    except Exception:
+        return None
+
+def _wrote_recently():
+    now = time.time()
+    try:
+        if float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > now:
+            return True
+    except ValueError:
+        pass
+    user_id = _token_user_id()
+    if user_id is None:
+        return False
+    with _recent_lock:
+        return _recent_writers.get(user_id, 0) > now
+
+def note_write():
+    """Mark the current request as one that wrote to the database"""
+    if has_request_context():
+        g.db_wrote = True
+
+@event.listens_for(Session, 'after_flush')
+def _note_write(session, flush_context):
+    note_write()
+
+def remember_write(response):
+    """Pin the caller's reads to the writer for a short while after a request that wrote"""
+    if not g.get('db_wrote') or response.status_code >= 400:
+        return response
+    until = time.time() + READ_YOUR_WRITES_SECONDS
+    user_id = _token_user_id()
+    if user_id is not None:
+        with _recent_lock:
+            _recent_writers[user_id] = until
+            if len(_recent_writers) > 10000:
+                now = time.time()
+                for key in [k for k, v in _recent_writers.items() if v <= now]:
+                    del _recent_writers[key]
+    # Other worker processes learn about the write from the cookie
+    response.set_cookie(READ_YOUR_WRITES_COOKIE, f'{until:.3f}', max_age=int(READ_YOUR_WRITES_SECONDS) + 1, httponly=True, samesite='Lax')
+    return response
+
+def sqlite_read_only_url(url):
+    """The read-only URI form of a SQLite file URL, or None for in-memory databases"""
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:' or url.database.startswith('file:'):
+        return None
+    return f'sqlite:///file:{os.path.abspath(url.database)}?mode=ro&uri=true'
+
+def _enable_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run alongside the single writer instead of waiting on its lock
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
+
+def _read_only_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
+
+def init_app(app):
+    """Configure the writer and read-only engines; call after sharding.init_app(app) and before db.init_app(app)"""
+    app.config.setdefault('DATABASE_READ_SPLIT', DATABASE_READ_SPLIT)
+    if not app.config['DATABASE_READ_SPLIT']:
+        return
+
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    read_urls = {READ_BIND: app.config.get('DATABASE_READ_URL', DATABASE_READ_URL) or sqlite_read_only_url(url)}
+    # Region shards get a read-only engine of their own
+    for key, shard in binds.items():
+        if key.startswith('shard:'):
+            read_urls[read_bind_key(key)] = sqlite_read_only_url(shard['url'] if isinstance(shard, dict) else shard)
+    read_urls = {key: read_url for key, read_url in read_urls.items() if read_url}
+    if not read_urls:
+        return
+
+    for key, read_url in read_urls.items():
+        binds[key] = {'url': read_url, 'pool_size': DATABASE_READ_POOL_SIZE, 'pool_pre_ping': True}
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    app.after_request(remember_write)
+
+def prepare_engines(db):
+    """Attach connection setup to the engines of the current app; call inside its app context"""
+    engines = db.engines
+    for key in [None, *(key for key in engines if key and key.startswith('shard:') and not key.endswith(f':{READ_BIND}'))]:
+        writer = engines[key]
+        reader = engines.get(read_bind_key(key))
+        if reader is None or writer.dialect.name != 'sqlite':
+            continue
+        event.listen(writer, 'connect', _enable_wal)
+        if reader.dialect.name == 'sqlite':
+            event.listen(reader, 'connect', _read_only_pragmas)
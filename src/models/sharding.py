@@ -0,0 +1,348 @@
+import os
+import re
+import heapq
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain
+import jwt
+from flask import copy_current_request_context, current_app, g, has_request_context, request
+from sqlalchemy import and_, event, or_, text, true
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.util import find_tables
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+# Regions with a database of their own, as comma-separated region=URL pairs. A bare region
+# name gets a SQLite file next to the main database. Users of other regions, and users with
+# no region, keep their data in the main database.
+DATABASE_SHARDS = os.environ.get('DATABASE_SHARDS', '')
+# Threads querying shards in parallel for views that cover several regions
+SHARD_FANOUT_WORKERS = int(os.environ.get('SHARD_FANOUT_WORKERS', '8'))
+
+# Tables whose rows live in the shard of the region they belong to. Users, anomaly types and
+# the rest stay in the main database, which SQLite shards attach so joins to them still work;
+# on a server database, give each region a schema and put the shared one on its search_path.
+SHARDED_TABLES = frozenset({'report', 'anomaly', 'escalation', 'attachment', 'change_log', 'itin_stat', 'itin_reader', 'data_version'})
+SHARDED_ARCHIVE_TABLE = re.compile(r'^(report|anomaly|escalation)_archive_\d{4}$')
+DIRECTORY_SCHEMA = 'directory'
+# Staff in these roles without a region of their own see every region
+NATIONAL_ROLES = ('Supervisor', 'Commercial Engineer')
+# Name of the main database in `region` fields, cursors and ?region=; no shard may use it
+MAIN_SHARD = 'main'
+
+_UNSET = object()
+_shard = ContextVar('shard', default=_UNSET)
+
+_user_regions = {}
+_user_regions_lock = threading.Lock()
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def parse_shards(spec, main_url):
+    """{region: URL} from 'north=sqlite:///north.db,coast' style settings"""
+    shards = {}
+    directory = None
+    main = make_url(main_url)
+    if main.get_backend_name() == 'sqlite' and main.database and main.database != ':memory:':
+        directory = os.path.dirname(os.path.abspath(main.database))
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        region, _, url = entry.partition('=')
+        region = region.strip()
+        if region == MAIN_SHARD:
+            raise ValueError(f'{MAIN_SHARD!r} names the main database and cannot be a shard')
+        if not url:
+            if directory is None:
+                raise ValueError(f'Shard {region!r} needs a URL: the main database is not a SQLite file')
+            url = f"sqlite:///{os.path.join(directory, f'shard_{region}.db')}"
+        shards[region] = url.strip()
+    return shards
+
+def bind_key(region):
+    """SQLALCHEMY_BINDS key of a region's writer engine; None is the main database"""
+    return None if region is None else f'shard:{region}'
+
+def regions():
+    """Regions with a shard of their own in the current app"""
+    return list(current_app.config.get('DATABASE_SHARDS') or ())
+
+def all_shards():
+    """Every database holding sharded rows: the main one (None), then each region's"""
+    return [None, *regions()]
+
+def shard_of(region):
+    return region if region in (current_app.config.get('DATABASE_SHARDS') or ()) else None
+
+def shard_name(region):
+    """Name of a shard in responses and cursors; ?region= with it selects the same shard"""
+    return region or MAIN_SHARD
+
+def _token_payload():
+    if 'token_payload' not in g:
+        token = request.headers.get('Authorization', '')
+        if token.startswith('Bearer '):
+            token = token[7:]
+        try:
+            g.token_payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        except Exception:
+            g.token_payload = None
+    return g.token_payload
+
+def _user_region(user_id):
+    # Tokens issued before regions existed carry none; look it up in the main database
+    with _user_regions_lock:
+        if user_id in _user_regions:
+            return _user_regions[user_id]
+    engine = current_app.extensions['sqlalchemy'].engine
+    with engine.connect() as conn:
+        region = conn.execute(text('SELECT region FROM "user" WHERE id = :id'), {'id': user_id}).scalar()
+    with _user_regions_lock:
+        if len(_user_regions) > 10000:
+            _user_regions.clear()
+        _user_regions[user_id] = region
+    return region
+
+def request_shards():
+    """Shards the current request covers: its user's region, or every one for national staff
+
+    Staff without a region of their own pick a single region with ?region=; a region
+    without a shard of its own, or MAIN_SHARD, picks the main database.
+    """
+    if not has_request_context() or not current_app.config.get('DATABASE_SHARDS'):
+        return [None]
+    if 'shards' not in g:
+        payload = _token_payload()
+        if payload is None:
+            g.shards = [None]
+        else:
+            region = payload['region'] if 'region' in payload else _user_region(payload.get('user_id'))
+            if region is None and payload.get('role') in NATIONAL_ROLES:
+                asked = request.args.get('region')
+                g.shards = [shard_of(asked)] if asked else all_shards()
+            else:
+                g.shards = [shard_of(region)]
+    return g.shards
+
+def current_shard():
+    """The shard statements on sharded tables go to; None is the main database"""
+    shard = _shard.get()
+    if shard is not _UNSET:
+        return shard
+    shards = request_shards()
+    return shards[0] if len(shards) == 1 else None
+
+def region_required():
+    """Whether the request covers several shards, so that an id alone does not name one row
+
+    Every shard numbers its own rows. Views loading a row by id answer 400 when this is
+    true; the caller picks the shard with the `region` of the row in a list, as ?region=.
+    """
+    return len(request_shards()) > 1
+
+def region_args():
+    """Query arguments keeping links to a row on the current shard; empty without shards"""
+    return {'region': shard_name(current_shard())} if current_app.config.get('DATABASE_SHARDS') else {}
+
+def tag_regions(parts, shards, key='region'):
+    """Set `key` on each dict of each shard's list to the name of its shard, when sharded"""
+    if current_app.config.get('DATABASE_SHARDS'):
+        for region, items in zip(shards, parts):
+            name = shard_name(region)
+            for item in items:
+                item[key] = name
+    return parts
+
+def keyset_before(columns, position, region=_UNSET):
+    """Condition selecting the rows of `region`'s shard, by default the current one, past `position`
+
+    `position` is the values of `columns` of the last item on a newest-first page merged
+    from several shards, followed by the name of its shard (None for a single-shard
+    cursor). Items with equal values come in descending order of shard name, so rows
+    of shards sorting before that name may still share the values.
+    """
+    *values, name = position
+    region = current_shard() if region is _UNSET else region
+    condition = columns[-1] <= values[-1] if name is not None and shard_name(region) < name else columns[-1] < values[-1]
+    for column, value in zip(reversed(columns[:-1]), reversed(values[:-1])):
+        condition = or_(column < value, and_(column == value, condition))
+    return condition
+
+@contextmanager
+def use_shard(region):
+    """Send statements on sharded tables to `region`'s shard inside the block"""
+    token = _shard.set(region)
+    try:
+        yield
+    finally:
+        _shard.reset(token)
+
+def _is_sharded(name):
+    return name in SHARDED_TABLES or SHARDED_ARCHIVE_TABLE.match(name) is not None
+
+def statement_shard(mapper=None, clause=None):
+    """The region whose shard should run a statement, or None for the main database"""
+    if not current_app.config.get('DATABASE_SHARDS'):
+        return None
+    shard = current_shard()
+    if shard is None:
+        return None
+    if mapper is not None and _is_sharded(mapper.local_table.name):
+        return shard
+    if clause is not None:
+        for table in find_tables(clause, include_crud=True, include_joins=True, include_aliases=True):
+            if _is_sharded(getattr(table, 'name', '') or ''):
+                return shard
+    return None
+
+def engine(region=_UNSET):
+    """Writer engine of `region`'s shard, by default the current one"""
+    db = current_app.extensions['sqlalchemy']
+    key = bind_key(current_shard() if region is _UNSET else region)
+    return db.engines[key]
+
+def writer_engines(db):
+    """(region, engine) for the main database and every shard; call inside an app context"""
+    return [(region, db.engines[bind_key(region)]) for region in all_shards()]
+
+def users_filter(region_column, region=_UNSET):
+    """Condition selecting the users whose rows live in `region`'s shard, by default the current one"""
+    shards = current_app.config.get('DATABASE_SHARDS')
+    if not shards:
+        return true()
+    region = current_shard() if region is _UNSET else region
+    if region is not None:
+        return region_column == region
+    return or_(region_column.is_(None), region_column.notin_(list(shards)))
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=SHARD_FANOUT_WORKERS, thread_name_prefix='shard-fanout')
+            _executor_pid = os.getpid()
+        return _executor
+
+def _call_in_shard(region, fn):
+    with use_shard(region):
+        return fn()
+
+def _call_in_app(app, region, fn):
+    with app.app_context():
+        return _call_in_shard(region, fn)
+
+def fan_out(fn, shards=None):
+    """fn() once per shard, in parallel, returning the results in shard order
+
+    Each call runs in a thread of its own with its own session; inside a request it sees a
+    copy of the request, so reads still go to the read-only engines.
+    """
+    shards = request_shards() if shards is None else shards
+    if len(shards) == 1:
+        return [_call_in_shard(shards[0], fn)]
+    app = current_app._get_current_object()
+    futures = []
+    for region in shards:
+        if has_request_context():
+            task = copy_current_request_context(partial(_call_in_shard, region, fn))
+        else:
+            task = partial(_call_in_app, app, region, fn)
+        futures.append(_get_executor().submit(task))
+    return [future.result() for future in futures]
+
+def fan_out_merged(fn, key, shards=None, region_key='region'):
+    """Concatenate the newest-first lists fn() returns in each shard, keeping them newest first
+
+    Each item gets its shard's name under `region_key` (see tag_regions) before the merge,
+    so `key` may use it.
+    """
+    shards = request_shards() if shards is None else shards
+    parts = tag_regions(fan_out(fn, shards), shards, region_key)
+    if len(parts) == 1:
+        return parts[0]
+    return sorted(chain.from_iterable(parts), key=key, reverse=True)
+
+def stream_merged(make_items, key, shards=None):
+    """Merge the newest-first iterables make_items() yields in each shard into one stream
+
+    The queries start one after another in the calling thread, each on its shard's own
+    connection, and are then consumed together. Items get their shard's name under
+    `region` as in fan_out_merged.
+    """
+    shards = request_shards() if shards is None else shards
+    tagged = bool(current_app.config.get('DATABASE_SHARDS'))
+    iterators = []
+    for region in shards:
+        with use_shard(region):
+            items = iter(make_items())
+            if tagged:
+                items = _tag(items, shard_name(region))
+            # Pull the first item here so the shard's query starts inside its block
+            iterators.append(chain(_peek(items), items))
+    if len(iterators) == 1:
+        return iterators[0]
+    return heapq.merge(*iterators, key=key, reverse=True)
+
+def _tag(items, name):
+    for item in items:
+        item['region'] = name
+        yield item
+
+def _peek(items):
+    for item in items:
+        return [item]
+    return []
+
+def attach_directory(path, read_only):
+    """Connect listener attaching the main database at `path` to a SQLite shard connection"""
+    def attach(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        target = f'file:{path}?mode=ro' if read_only else path
+        cursor.execute(f'ATTACH DATABASE ? AS {DIRECTORY_SCHEMA}', (target,))
+        cursor.close()
+    return attach
+
+def init_app(app):
+    """Add a bind per region to SQLALCHEMY_BINDS; call before routing.init_app(app)"""
+    app.config.setdefault('DATABASE_SHARDS', DATABASE_SHARDS)
+    shards = app.config['DATABASE_SHARDS'] or {}
+    if isinstance(shards, str):
+        shards = parse_shards(shards, app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['DATABASE_SHARDS'] = dict(shards)
+    if not shards:
+        return
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for region, url in shards.items():
+        binds[bind_key(region)] = url
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+def prepare_engines(db):
+    """Attach the main database to SQLite shards and create their tables; call inside the app context
+
+    The read-only engine of a shard, if any, attaches it read-only as well.
+    """
+    shards = current_app.config.get('DATABASE_SHARDS')
+    if not shards:
+        return
+    main = db.engine
+    directory = None
+    if main.dialect.name == 'sqlite' and main.url.database and main.url.database != ':memory:':
+        directory = os.path.abspath(main.url.database)
+
+    tables = [table for name, table in db.metadata.tables.items() if name in SHARDED_TABLES]
+    for region in shards:
+        key = bind_key(region)
+        writer = db.engines[key]
+        # A fresh shard gets its tables before the main database is attached, so none of them
+        # is mistaken for the main database's table of the same name
+        db.metadata.create_all(writer, tables=tables)
+        if writer.dialect.name != 'sqlite' or directory is None:
+            continue
+        event.listen(writer, 'connect', attach_directory(directory, read_only=False))
+        for name, reader in db.engines.items():
+            if name != key and name is not None and name.startswith(f'{key}:'):
+                event.listen(reader, 'connect', attach_directory(directory, read_only=True))
+        writer.dispose()
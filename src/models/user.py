@@ -1,8 +1,14 @@
+import threading
+from contextlib import contextmanager
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import event, func, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 from werkzeug.security import generate_password_hash, check_password_hash
+from src.models.routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -12,6 +18,8 @@ class User(db.Model):
     security_question = db.Column(db.String(255))
     security_answer_hash = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Region whose shard holds this user's reports and anomalies; see src.models.sharding
+    region = db.Column(db.String(50), nullable=True, index=True)
 
     def __repr__(self):
         return f'<User {self.staff_number}>'
@@ -33,7 +41,8 @@ class User(db.Model):
             'id': self.id,
             'staff_number': self.staff_number,
             'role': self.role,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'region': self.region,
+            'created_at': self.created_at
         }
 
 class Report(db.Model):
@@ -49,34 +58,134 @@ class Report(db.Model):
 
     staff = db.relationship('User', backref=db.backref('reports', lazy=True))
 
+    __table_args__ = (
+        # An itinerary's history, newest first, and its statistics rebuilt by the triggers
+        db.Index('ix_report_itin_date', 'itin', 'report_date', 'id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
             'itin': self.itin,
-            'report_date': self.report_date.isoformat() if self.report_date else None,
+            'report_date': self.report_date,
             'percentage_attained': self.percentage_attained,
             'reasons_not_attained': self.reasons_not_attained,
             'staff_id': self.staff_id,
             'staff_number': self.staff.staff_number if self.staff else None,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'timestamp': self.timestamp,
             'status': self.status,
             'notes_comments': self.notes_comments
         }
 
+class AnomalyType(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name
+        }
+
+class AnomalyTypeCatalog:
+    """Anomaly type names by id and ids by name, cached in process per database
+
+    Names are matched ignoring case and repeated whitespace, so 'faulty  meter' is
+    filed under an existing 'Faulty Meter'. A name seen for the first time is added
+    to the table right away, on a connection of its own, so the new id is visible to
+    every worker before any anomaly refers to it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.caches = {}
+
+    @staticmethod
+    def normalize(name):
+        return ' '.join(str(name).split())
+
+    def _cache(self, reload=False):
+        key = str(db.engine.url)
+        cache = self.caches.get(key)
+        if cache is None or reload:
+            table = AnomalyType.__table__
+            with db.engine.connect() as conn:
+                rows = conn.execute(select(table.c.id, table.c.name).order_by(table.c.id)).all()
+            ids, names = {}, {}
+            for type_id, name in rows:
+                ids.setdefault(self.normalize(name).casefold(), type_id)
+                names[type_id] = name
+            cache = self.caches[key] = (ids, names)
+        return cache
+
+    def id_for(self, name, create=True):
+        """Id of the type called `name`; None if it is unknown and `create` is false"""
+        canonical = self.normalize(name)
+        if not canonical:
+            raise ValueError('Anomaly type name is empty')
+        key = canonical.casefold()
+        type_id = self._cache()[0].get(key)
+        if type_id is not None:
+            return type_id
+        with self.lock:
+            type_id = self._cache(reload=True)[0].get(key)
+            if type_id is not None or not create:
+                return type_id
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(AnomalyType.__table__.insert().values(name=canonical))
+            except IntegrityError:
+                pass  # added by another process in the meantime
+            return self._cache(reload=True)[0][key]
+
+    def ensure(self, names):
+        """Ids of all `names`, creating the missing ones"""
+        return {name: self.id_for(name) for name in names}
+
+    def name(self, type_id):
+        if type_id is None:
+            return None
+        name = self._cache()[1].get(type_id)
+        if name is None:
+            with self.lock:
+                name = self._cache(reload=True)[1].get(type_id)
+        return name
+
+    def all(self):
+        """(id, name) pairs ordered by name"""
+        return sorted(self._cache(reload=True)[1].items(), key=lambda item: item[1])
+
+    def clear(self):
+        self.caches.clear()
+
+anomaly_types = AnomalyTypeCatalog()
+
 class Anomaly(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     report_id = db.Column(db.Integer, db.ForeignKey('report.id'), nullable=True)
-    type = db.Column(db.String(100), nullable=False)
+    type_id = db.Column(db.Integer, db.ForeignKey('anomaly_type.id'), nullable=False, index=True)
     description = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     escalation_flag = db.Column(db.Boolean, default=False)
     assigned_to_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     resolution_status = db.Column(db.String(20), default='Open')
     staff_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Latest escalation of this anomaly, kept up to date whenever an escalation is added
+    current_escalation_id = db.Column(db.Integer, db.ForeignKey('escalation.id', use_alter=True, deferrable=True, initially='DEFERRED'), nullable=True, index=True)
 
     report = db.relationship('Report', backref=db.backref('anomalies', lazy=True))
     assigned_to = db.relationship('User', foreign_keys=[assigned_to_id], backref=db.backref('assigned_anomalies', lazy=True))
     staff = db.relationship('User', foreign_keys=[staff_id], backref=db.backref('reported_anomalies', lazy=True))
+    current_escalation = db.relationship('Escalation', foreign_keys=[current_escalation_id], post_update=True)
+
+    @property
+    def type(self):
+        """The type name; stored as an id into the AnomalyType catalog"""
+        return anomaly_types.name(self.type_id)
+
+    @type.setter
+    def type(self, name):
+        self.type_id = anomaly_types.id_for(name)
 
     def to_dict(self):
         return {
@@ -84,8 +193,9 @@ class Anomaly(db.Model):
             'report_id': self.report_id,
             'type': self.type,
             'description': self.description,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'timestamp': self.timestamp,
             'escalation_flag': self.escalation_flag,
+            'current_escalation_id': self.current_escalation_id,
             'assigned_to_id': self.assigned_to_id,
             'assigned_to_staff_number': self.assigned_to.staff_number if self.assigned_to else None,
             'resolution_status': self.resolution_status,
@@ -99,17 +209,382 @@ class Escalation(db.Model):
     escalation_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     escalated_to_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     resolution_status = db.Column(db.String(20), default='Pending')
+    # Notification delivery: when the recipient was last notified, failed attempts since,
+    # and when the next notice (first, retry or reminder) is due; NULL once nothing is due
+    notified_at = db.Column(db.DateTime, nullable=True)
+    notify_attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_notify_error = db.Column(db.Text, nullable=True)
+    next_notify_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, index=True)
 
-    anomaly = db.relationship('Anomaly', backref=db.backref('escalations', lazy=True))
+    anomaly = db.relationship('Anomaly', foreign_keys=[anomaly_id], backref=db.backref('escalations', lazy=True))
     escalated_to = db.relationship('User', backref=db.backref('escalations_received', lazy=True))
 
+    __table_args__ = (
+        # Keyset pagination of the escalation feed, overall and per recipient
+        db.Index('ix_escalation_timestamp_id', 'escalation_timestamp', 'id'),
+        db.Index('ix_escalation_recipient_timestamp', 'escalated_to_id', 'escalation_timestamp', 'id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
             'anomaly_id': self.anomaly_id,
-            'escalation_timestamp': self.escalation_timestamp.isoformat() if self.escalation_timestamp else None,
+            'escalation_timestamp': self.escalation_timestamp,
             'escalated_to_id': self.escalated_to_id,
             'escalated_to_staff_number': self.escalated_to.staff_number if self.escalated_to else None,
-            'resolution_status': self.resolution_status
+            'resolution_status': self.resolution_status,
+            'notified_at': self.notified_at,
+            'notify_attempts': self.notify_attempts,
+            'last_notify_error': self.last_notify_error
         }
 
+class Attachment(db.Model):
+    """A file attached to an anomaly; the bytes live in the attachment store, keyed by sha256"""
+    id = db.Column(db.Integer, primary_key=True)
+    anomaly_id = db.Column(db.Integer, db.ForeignKey('anomaly.id'), nullable=False, index=True)
+    uploaded_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    # Set once the upload is complete; identical files share one stored copy
+    sha256 = db.Column(db.String(64), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default='Uploading')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    anomaly = db.relationship('Anomaly', backref=db.backref('attachments', lazy=True))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'anomaly_id': self.anomaly_id,
+            'uploaded_by_id': self.uploaded_by_id,
+            'filename': self.filename,
+            'content_type': self.content_type,
+            'size': self.size,
+            'sha256': self.sha256,
+            'status': self.status,
+            'created_at': self.created_at,
+            'completed_at': self.completed_at
+        }
+
+
+class DataVersion(db.Model):
+    """Counter bumped whenever rows of a table change through the ORM; part of cache keys"""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+VERSIONED_MODELS = (Report, Anomaly, Escalation)
+
+def bump_data_version(connection, name):
+    """Record a change to table `name` for rows written without the ORM"""
+    table = DataVersion.__table__
+    result = connection.execute(table.update().where(table.c.name == name).values(version=table.c.version + 1))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(name=name, version=1))
+
+class ChangeLog(db.Model):
+    """Latest change of every report, anomaly and escalation row, in sequence order
+
+    Written by database triggers, so bulk inserts, archiving and other Core writes are
+    logged as well as ORM flushes. Each row keeps one entry: a change replaces the
+    previous entry with one at a new, higher seq. Deleted rows leave a tombstone until
+    compact_change_log() purges it.
+    """
+    __tablename__ = 'change_log'
+    # AUTOINCREMENT: a seq is never handed out twice, even after the newest entry is replaced
+    __table_args__ = (
+        db.UniqueConstraint('table_name', 'row_id', name='uq_change_log_row'),
+        db.Index('ix_change_log_owner_seq', 'owner_id', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+
+    seq = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(20), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)
+    # Staff member whose row it is, for readers who may only sync their own
+    owner_id = db.Column(db.Integer, nullable=True)
+    changed_at = db.Column(db.DateTime, nullable=False)
+
+# Tables logged by the change triggers, with the column naming each row's owner
+CHANGE_LOGGED_TABLES = {'report': 'staff_id', 'anomaly': 'staff_id', 'escalation': None}
+# DataVersion entry holding the highest seq compaction has purged
+CHANGE_LOG_PURGED = 'change_log_purged'
+
+def _change_trigger(table, owner, event_name, operation, row):
+    owner_value = f'{row}.{owner}' if owner else 'NULL'
+    return (
+        f'CREATE TRIGGER IF NOT EXISTS {table}_change_{event_name} AFTER {event_name.upper()} ON {table} BEGIN '
+        f"DELETE FROM change_log WHERE table_name = '{table}' AND row_id = {row}.id; "
+        f'INSERT INTO change_log (table_name, row_id, operation, owner_id, changed_at) '
+        f"VALUES ('{table}', {row}.id, '{operation}', {owner_value}, CURRENT_TIMESTAMP); "
+        f'END'
+    )
+
+def install_change_triggers(connection):
+    """Create the change log triggers, logging rows that predate them; returns whether any were missing
+
+    SQLite only; a server database needs equivalent triggers of its own.
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+    existing = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars())
+    installed = False
+    for table, owner in CHANGE_LOGGED_TABLES.items():
+        if f'{table}_change_insert' not in existing:
+            # Rows written before the triggers existed are logged once, so syncing from 0 sees everything
+            owner_value = owner or 'NULL'
+            connection.execute(text(
+                f'INSERT INTO change_log (table_name, row_id, operation, owner_id, changed_at) '
+                f"SELECT '{table}', id, 'upsert', {owner_value}, CURRENT_TIMESTAMP FROM {table} "
+                f"WHERE id NOT IN (SELECT row_id FROM change_log WHERE table_name = '{table}') ORDER BY id"
+            ))
+        for event_name, operation, row in (('insert', 'upsert', 'NEW'), ('update', 'upsert', 'NEW'), ('delete', 'delete', 'OLD')):
+            if f'{table}_change_{event_name}' not in existing:
+                connection.execute(text(_change_trigger(table, owner, event_name, operation, row)))
+                installed = True
+    return installed
+
+def compact_change_log(connection, before):
+    """Purge tombstones of rows deleted before `before`; returns how many were purged
+
+    Clients that last synced before a purged tombstone can no longer learn of that
+    delete, so the sync API tells them to start over.
+    """
+    table = ChangeLog.__table__
+    condition = (table.c.operation == 'delete') & (table.c.changed_at < before)
+    purged_up_to = connection.execute(select(func.max(table.c.seq)).where(condition)).scalar()
+    if purged_up_to is None:
+        return 0
+    purged = connection.execute(table.delete().where(condition)).rowcount
+
+    versions = DataVersion.__table__
+    result = connection.execute(
+        versions.update().where(versions.c.name == CHANGE_LOG_PURGED, versions.c.version < purged_up_to).values(version=purged_up_to)
+    )
+    if result.rowcount == 0 and connection.execute(select(versions.c.name).where(versions.c.name == CHANGE_LOG_PURGED)).first() is None:
+        connection.execute(versions.insert().values(name=CHANGE_LOG_PURGED, version=purged_up_to))
+    return purged
+
+class ItinStat(db.Model):
+    """Coverage of one itinerary over the live reports, kept current by triggers on report"""
+    __tablename__ = 'itin_stat'
+    __table_args__ = (
+        # Worst-performing itineraries first, with keyset pagination
+        db.Index('ix_itin_stat_mean_itin', 'mean_percentage', 'itin'),
+    )
+
+    itin = db.Column(db.String(50), primary_key=True)
+    report_count = db.Column(db.Integer, nullable=False)
+    total_percentage = db.Column(db.Float, nullable=False)
+    mean_percentage = db.Column(db.Float, nullable=False)
+    min_percentage = db.Column(db.Float, nullable=False)
+    max_percentage = db.Column(db.Float, nullable=False)
+    first_report_date = db.Column(db.Date, nullable=False)
+    last_report_date = db.Column(db.Date, nullable=False)
+
+    def to_dict(self):
+        return {
+            'itin': self.itin,
+            'report_count': self.report_count,
+            'mean_percentage': round(self.mean_percentage, 2),
+            'min_percentage': self.min_percentage,
+            'max_percentage': self.max_percentage,
+            'first_report_date': self.first_report_date,
+            'last_report_date': self.last_report_date
+        }
+
+class ItinReader(db.Model):
+    """Reports one staff member has filed for an itinerary"""
+    __tablename__ = 'itin_reader'
+
+    itin = db.Column(db.String(50), primary_key=True)
+    staff_id = db.Column(db.Integer, primary_key=True)
+    report_count = db.Column(db.Integer, nullable=False)
+    mean_percentage = db.Column(db.Float, nullable=False)
+    last_report_date = db.Column(db.Date, nullable=False)
+
+def _recompute_itin(itin, staff_id):
+    # Deletes and edits can remove a minimum or maximum, so the affected rows are rebuilt
+    # from the itinerary's reports, which ix_report_itin_date finds directly
+    return (
+        f'DELETE FROM itin_stat WHERE itin = {itin}; '
+        f'INSERT INTO itin_stat (itin, report_count, total_percentage, mean_percentage, min_percentage, max_percentage, first_report_date, last_report_date) '
+        f'SELECT itin, COUNT(*), SUM(percentage_attained), AVG(percentage_attained), MIN(percentage_attained), MAX(percentage_attained), '
+        f'MIN(report_date), MAX(report_date) FROM report WHERE itin = {itin} GROUP BY itin; '
+        f'DELETE FROM itin_reader WHERE itin = {itin} AND staff_id = {staff_id}; '
+        f'INSERT INTO itin_reader (itin, staff_id, report_count, mean_percentage, last_report_date) '
+        f'SELECT itin, staff_id, COUNT(*), AVG(percentage_attained), MAX(report_date) FROM report '
+        f'WHERE itin = {itin} AND staff_id = {staff_id} GROUP BY itin, staff_id; '
+    )
+
+ITIN_STAT_TRIGGERS = {
+    # New reports, the common case, only add to the running totals
+    'report_itin_stat_insert': (
+        'AFTER INSERT ON report BEGIN '
+        'INSERT INTO itin_stat (itin, report_count, total_percentage, mean_percentage, min_percentage, max_percentage, first_report_date, last_report_date) '
+        'VALUES (NEW.itin, 1, NEW.percentage_attained, NEW.percentage_attained, NEW.percentage_attained, NEW.percentage_attained, NEW.report_date, NEW.report_date) '
+        'ON CONFLICT (itin) DO UPDATE SET report_count = report_count + 1, '
+        'total_percentage = total_percentage + excluded.total_percentage, '
+        'mean_percentage = (total_percentage + excluded.total_percentage) / (report_count + 1), '
+        'min_percentage = MIN(min_percentage, excluded.min_percentage), max_percentage = MAX(max_percentage, excluded.max_percentage), '
+        'first_report_date = MIN(first_report_date, excluded.first_report_date), last_report_date = MAX(last_report_date, excluded.last_report_date); '
+        'INSERT INTO itin_reader (itin, staff_id, report_count, mean_percentage, last_report_date) '
+        'VALUES (NEW.itin, NEW.staff_id, 1, NEW.percentage_attained, NEW.report_date) '
+        'ON CONFLICT (itin, staff_id) DO UPDATE SET report_count = report_count + 1, '
+        'mean_percentage = (mean_percentage * report_count + excluded.mean_percentage) / (report_count + 1), '
+        'last_report_date = MAX(last_report_date, excluded.last_report_date); '
+        'END'
+    ),
+    'report_itin_stat_update': (
+        'AFTER UPDATE OF itin, percentage_attained, report_date, staff_id ON report BEGIN '
+        + _recompute_itin('OLD.itin', 'OLD.staff_id') + _recompute_itin('NEW.itin', 'NEW.staff_id') +
+        'END'
+    ),
+    'report_itin_stat_delete': 'AFTER DELETE ON report BEGIN ' + _recompute_itin('OLD.itin', 'OLD.staff_id') + 'END'
+}
+
+def install_itin_stat_triggers(connection):
+    """Create the itinerary statistics triggers, building the statistics of existing reports first
+
+    SQLite only, like install_change_triggers().
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+    existing = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars())
+    if 'report_itin_stat_insert' not in existing:
+        rebuild_itin_stats(connection)
+    installed = False
+    for name, body in ITIN_STAT_TRIGGERS.items():
+        if name not in existing:
+            connection.execute(text(f'CREATE TRIGGER IF NOT EXISTS {name} {body}'))
+            installed = True
+    return installed
+
+def rebuild_itin_stats(connection):
+    """Rebuild itin_stat and itin_reader from every report, with one GROUP BY each"""
+    connection.execute(text('DELETE FROM itin_stat'))
+    connection.execute(text('DELETE FROM itin_reader'))
+    connection.execute(text(
+        'INSERT INTO itin_stat (itin, report_count, total_percentage, mean_percentage, min_percentage, max_percentage, first_report_date, last_report_date) '
+        'SELECT itin, COUNT(*), SUM(percentage_attained), AVG(percentage_attained), MIN(percentage_attained), MAX(percentage_attained), '
+        'MIN(report_date), MAX(report_date) FROM report GROUP BY itin'
+    ))
+    connection.execute(text(
+        'INSERT INTO itin_reader (itin, staff_id, report_count, mean_percentage, last_report_date) '
+        'SELECT itin, staff_id, COUNT(*), AVG(percentage_attained), MAX(report_date) FROM report GROUP BY itin, staff_id'
+    ))
+
+def add_itin_stats(connection, since_id):
+    """Add the reports whose id is above `since_id` to itin_stat and itin_reader, as the insert trigger would"""
+    # One pass over the new reports, by id range (the planner would otherwise walk every
+    # report through ix_report_itin_date); both tables are summed from its few rows
+    connection.execute(text(
+        'CREATE TEMP TABLE bulk_itin AS SELECT itin, staff_id, COUNT(*) AS n, SUM(percentage_attained) AS total, '
+        'MIN(percentage_attained) AS low, MAX(percentage_attained) AS high, MIN(report_date) AS first, MAX(report_date) AS last '
+        'FROM report NOT INDEXED WHERE id > :since GROUP BY itin, staff_id'
+    ), {'since': since_id})
+    try:
+        connection.execute(text(
+            'INSERT INTO itin_stat (itin, report_count, total_percentage, mean_percentage, min_percentage, max_percentage, first_report_date, last_report_date) '
+            'SELECT itin, SUM(n), SUM(total), SUM(total) / SUM(n), MIN(low), MAX(high), MIN(first), MAX(last) FROM temp.bulk_itin WHERE true GROUP BY itin '
+            'ON CONFLICT (itin) DO UPDATE SET report_count = report_count + excluded.report_count, '
+            'total_percentage = total_percentage + excluded.total_percentage, '
+            'mean_percentage = (total_percentage + excluded.total_percentage) / (report_count + excluded.report_count), '
+            'min_percentage = MIN(min_percentage, excluded.min_percentage), max_percentage = MAX(max_percentage, excluded.max_percentage), '
+            'first_report_date = MIN(first_report_date, excluded.first_report_date), last_report_date = MAX(last_report_date, excluded.last_report_date)'
+        ))
+        connection.execute(text(
+            'INSERT INTO itin_reader (itin, staff_id, report_count, mean_percentage, last_report_date) '
+            'SELECT itin, staff_id, n, total / n, last FROM temp.bulk_itin WHERE true '
+            'ON CONFLICT (itin, staff_id) DO UPDATE SET report_count = report_count + excluded.report_count, '
+            'mean_percentage = (mean_percentage * report_count + excluded.mean_percentage * excluded.report_count) / (report_count + excluded.report_count), '
+            'last_report_date = MAX(last_report_date, excluded.last_report_date)'
+        ))
+    finally:
+        connection.execute(text('DROP TABLE temp.bulk_itin'))
+
+def _log_bulk_changes(connection, table, owner, since_id, deletes):
+    owner_value = owner or 'NULL'
+    # Rows inserted in bulk: one entry each, replacing any tombstone of a reused id
+    connection.execute(text(
+        f"DELETE FROM change_log WHERE table_name = '{table}' AND row_id > :since AND row_id IN (SELECT id FROM {table} WHERE id > :since)"
+    ), {'since': since_id})
+    connection.execute(text(
+        f'INSERT INTO change_log (table_name, row_id, operation, owner_id, changed_at) '
+        f"SELECT '{table}', id, 'upsert', {owner_value}, CURRENT_TIMESTAMP FROM {table} WHERE id > :since ORDER BY id"
+    ), {'since': since_id})
+    if not deletes:
+        return
+    # Rows deleted in bulk: their entries become tombstones at new seqs
+    connection.execute(text(
+        'CREATE TEMP TABLE bulk_deleted AS SELECT seq, row_id, owner_id FROM change_log '
+        f"WHERE table_name = '{table}' AND operation != 'delete' AND row_id NOT IN (SELECT id FROM {table})"
+    ))
+    try:
+        connection.execute(text('DELETE FROM change_log WHERE seq IN (SELECT seq FROM temp.bulk_deleted)'))
+        connection.execute(text(
+            'INSERT INTO change_log (table_name, row_id, operation, owner_id, changed_at) '
+            f"SELECT '{table}', row_id, 'delete', owner_id, CURRENT_TIMESTAMP FROM temp.bulk_deleted ORDER BY seq"
+        ))
+    finally:
+        connection.execute(text('DROP TABLE temp.bulk_deleted'))
+
+@contextmanager
+def bulk_writes(connection, deletes=False):
+    """Run a bulk write without the per-row triggers, then do their work set-based
+
+    The change log and itinerary statistics triggers run a few statements per row, which
+    costs a bulk load most of its speed. Inside the block they are dropped; afterwards the
+    change log gets an entry per row inserted, and with `deletes` a tombstone per row
+    deleted, the new reports are added to the itinerary statistics (which are rebuilt
+    whole with `deletes`), and the triggers are created again. Use it inside the write's
+    transaction: SQLite lets one writer in at a time, so no other connection writes while
+    the triggers are missing, and a rollback brings them back. Rows updated in place inside
+    the block are not logged. SQLite only; elsewhere the block just runs.
+    """
+    if connection.dialect.name != 'sqlite':
+        yield
+        return
+    triggers = connection.execute(text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN ('report', 'anomaly', 'escalation')"
+    )).all()
+    names = {name for name, _ in triggers}
+    since = {table: connection.execute(text(f'SELECT COALESCE(MAX(id), 0) FROM {table}')).scalar() for table in CHANGE_LOGGED_TABLES}
+    for name in names:
+        connection.execute(text(f'DROP TRIGGER {name}'))
+
+    yield
+
+    for table, owner in CHANGE_LOGGED_TABLES.items():
+        if f'{table}_change_insert' in names:
+            _log_bulk_changes(connection, table, owner, since[table], deletes)
+    if 'report_itin_stat_insert' in names:
+        if deletes:
+            rebuild_itin_stats(connection)
+        else:
+            add_itin_stats(connection, since['report'])
+    for _, sql in triggers:
+        connection.exec_driver_sql(sql)
+
+@event.listens_for(Session, 'before_flush')
+def _point_at_new_escalations(session, flush_context, instances):
+    # A new escalation is always the latest one of its anomaly
+    for escalation in [obj for obj in session.new if isinstance(obj, Escalation)]:
+        anomaly = escalation.anomaly
+        if anomaly is None and escalation.anomaly_id is not None:
+            anomaly = session.get(Anomaly, escalation.anomaly_id)
+        if anomaly is not None:
+            # Only the latest escalation is notified; the one it supersedes stops reminding
+            previous = anomaly.current_escalation
+            if previous is not None and previous is not escalation:
+                previous.next_notify_at = None
+            anomaly.current_escalation = escalation
+
+@event.listens_for(Session, 'after_flush')
+def _bump_data_versions(session, flush_context):
+    changed = {obj.__tablename__ for obj in (*session.new, *session.dirty, *session.deleted) if isinstance(obj, VERSIONED_MODELS)}
+    for name in sorted(changed):
+        # The counters live next to the rows they count, in the same shard
+        bump_data_version(session.connection(bind_arguments={'mapper': DataVersion.__mapper__}), name)
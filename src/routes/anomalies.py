@@ -1,14 +1,25 @@
-from flask import Blueprint, jsonify, request
-from src.models.user import User, Anomaly, Escalation, db
+from flask import Blueprint, current_app, jsonify, request
+from src.models.user import User, Anomaly, Escalation, anomaly_types, db
+from src.models import sharding, reads
 import jwt
 import os
-from src.routes.email_service import send_escalation_notification
+import base64
+import binascii
+from src.routes.email_service import load_escalations, notify_escalations
+from src.routes.archive import archived_anomaly_rows, archived_escalation_rows, anomaly_row_to_dict, escalation_row_to_dict, include_archived_requested
 from datetime import datetime, timedelta
+from src.utils.json_provider import stream_requested, stream_json_array, JSON_STREAM_BATCH_SIZE
+from src.utils import group_commit
+from itertools import chain
 
 anomalies_bp = Blueprint('anomalies', __name__)
 
 SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
 
+# Escalations per page of GET /api/escalations; ?limit= can ask for up to the maximum
+ESCALATIONS_PAGE_SIZE = int(os.environ.get('ESCALATIONS_PAGE_SIZE', '100'))
+ESCALATIONS_MAX_PAGE_SIZE = int(os.environ.get('ESCALATIONS_MAX_PAGE_SIZE', '1000'))
+
 def get_user_from_token(token):
     try:
         if token.startswith('Bearer '):
@@ -36,21 +47,65 @@ def create_anomaly():
     if not anomaly_type:
         return jsonify({'error': 'Anomaly type is required'}), 400
 
-    anomaly = Anomaly(
-        type=anomaly_type,
+    values = dict(
+        type_id=anomaly_types.id_for(anomaly_type),
         description=description,
         report_id=report_id,
         staff_id=user.id
     )
 
-    db.session.add(anomaly)
-    db.session.commit()
-
+    if group_commit.enabled(current_app):
+        # Committed together with other requests' inserts; the row comes back with its id
+        try:
+            anomaly = Anomaly(**group_commit.insert_row(current_app, Anomaly.__table__, values))
+        except group_commit.WriteRejected as e:
+            return jsonify({'error': f'{e}, please retry'}), 503, {'Retry-After': '1'}
+    else:
+        anomaly = Anomaly(**values)
+        db.session.add(anomaly)
+        db.session.commit()
+
+    anomaly_dict = anomaly.to_dict()
+    anomaly_dict['staff_number'] = user.staff_number
     return jsonify({
         'message': 'Anomaly submitted successfully',
-        'anomaly': anomaly.to_dict()
+        'anomaly': anomaly_dict
     }), 201
 
+@anomalies_bp.route('/anomaly_types', methods=['GET'])
+def get_anomaly_types():
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    return jsonify([{'id': type_id, 'name': name} for type_id, name in anomaly_types.all()])
+
+def anomaly_filters(user, args):
+    """(staff_id, type, resolution_status, escalation_flag) for an anomaly listing from the query string"""
+    staff_id = args.get('staff_id')
+    # If user is not a supervisor, only show their own anomalies
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        staff_id = user.id
+    escalation_flag = args.get('escalation_flag')
+    escalation_flag = escalation_flag.lower() == 'true' if escalation_flag else None
+    return staff_id, args.get('type'), args.get('resolution_status'), escalation_flag
+
+def anomaly_conditions(staff_id=None, anomaly_type=None, resolution_status=None, escalation_flag=None):
+    """WHERE clauses selecting the anomalies that match anomaly_filters()"""
+    conditions = []
+    if staff_id:
+        conditions.append(Anomaly.staff_id == staff_id)
+    if anomaly_type:
+        # Unknown names match nothing; known ones compare on the integer key
+        conditions.append(Anomaly.type_id == anomaly_types.id_for(anomaly_type, create=False))
+    if resolution_status:
+        conditions.append(Anomaly.resolution_status == resolution_status)
+    if escalation_flag is not None:
+        conditions.append(Anomaly.escalation_flag == escalation_flag)
+    return conditions
+
 @anomalies_bp.route('/anomalies', methods=['GET'])
 def get_anomalies():
     token = request.headers.get('Authorization')
@@ -59,32 +114,34 @@ def get_anomalies():
     if not user:
         return jsonify({'error': 'Invalid or missing token'}), 401
 
-    # Get query parameters for filtering
-    staff_id = request.args.get('staff_id')
-    anomaly_type = request.args.get('type')
-    resolution_status = request.args.get('resolution_status')
-    escalation_flag = request.args.get('escalation_flag')
+    staff_id, anomaly_type, resolution_status, escalation_flag_bool = anomaly_filters(user, request.args)
+    query = reads.anomaly_select().where(
+        *anomaly_conditions(staff_id, anomaly_type, resolution_status, escalation_flag_bool)
+    ).order_by(Anomaly.timestamp.desc())
 
-    query = Anomaly.query
+    def newest_first(anomaly):
+        return anomaly['timestamp'] or datetime.min
 
-    # If user is not a supervisor, only show their own anomalies
-    if user.role not in ['Supervisor', 'Commercial Engineer']:
-        query = query.filter_by(staff_id=user.id)
-    elif staff_id:
-        query = query.filter_by(staff_id=staff_id)
+    if stream_requested():
+        def shard_items():
+            rows = db.session.execute(query.execution_options(yield_per=JSON_STREAM_BATCH_SIZE))
+            items = map(reads.anomaly_dict, rows)
+            if include_archived_requested():
+                archived = archived_anomaly_rows(staff_id, anomaly_type, resolution_status, escalation_flag_bool)
+                items = chain(items, (anomaly_row_to_dict(row) for row in archived))
+            return items
+        return stream_json_array(sharding.stream_merged(shard_items, key=newest_first))
 
-    if anomaly_type:
-        query = query.filter_by(type=anomaly_type)
+    def shard_results():
+        results = [reads.anomaly_dict(row) for row in db.session.execute(query)]
 
-    if resolution_status:
-        query = query.filter_by(resolution_status=resolution_status)
-
-    if escalation_flag:
-        escalation_flag_bool = escalation_flag.lower() == 'true'
-        query = query.filter_by(escalation_flag=escalation_flag_bool)
+        if include_archived_requested():
+            archived = archived_anomaly_rows(staff_id, anomaly_type, resolution_status, escalation_flag_bool)
+            results.extend(anomaly_row_to_dict(row) for row in archived)
+            results.sort(key=newest_first, reverse=True)
+        return results
 
-    anomalies = query.order_by(Anomaly.timestamp.desc()).all()
-    return jsonify([anomaly.to_dict() for anomaly in anomalies])
+    return jsonify(sharding.fan_out_merged(shard_results, key=newest_first))
 
 @anomalies_bp.route('/anomalies/<int:anomaly_id>', methods=['PUT'])
 def update_anomaly(anomaly_id):
@@ -94,6 +151,9 @@ def update_anomaly(anomaly_id):
     if not user:
         return jsonify({'error': 'Invalid or missing token'}), 401
 
+    if sharding.region_required():
+        return jsonify({'error': 'Anomaly ids repeat across regions; pass ?region= with the region of the anomaly'}), 400
+
     anomaly = Anomaly.query.get_or_404(anomaly_id)
     
     # Check if user has permission to update this anomaly
@@ -127,6 +187,9 @@ def escalate_anomaly():
     if not anomaly_id or not escalated_to_id:
         return jsonify({'error': 'Anomaly ID and escalated_to_id are required'}), 400
 
+    if sharding.region_required():
+        return jsonify({'error': 'Anomaly ids repeat across regions; pass ?region= with the region of the anomaly'}), 400
+
     anomaly = Anomaly.query.get_or_404(anomaly_id)
     
     # Check if user has permission to escalate this anomaly
@@ -145,19 +208,64 @@ def escalate_anomaly():
     db.session.add(escalation)
     db.session.commit()
 
-    # Send escalation notification email
-    try:
-        escalated_to_user = User.query.get(escalated_to_id)
-        if escalated_to_user:
-            send_escalation_notification(anomaly, escalated_to_user)
-    except Exception as e:
-        print(f"Failed to send escalation email: {str(e)}")
+    # Send escalation notification email; if it fails, the notification sweep retries it
+    notify_escalations([escalation])
+    db.session.commit()
 
     return jsonify({
         'message': 'Anomaly escalated successfully',
         'escalation': escalation.to_dict()
     }), 201
 
+def escalation_filters(args):
+    """Escalation list filters from the query string; raises ValueError on a malformed value"""
+    filters = {
+        'escalated_to_id': int(args['escalated_to_id']) if args.get('escalated_to_id') else None,
+        'status': args.get('status') or None,
+        'start': None,
+        'end': None
+    }
+    if args.get('start_date'):
+        filters['start'] = datetime.strptime(args['start_date'], '%Y-%m-%d')
+    if args.get('end_date'):
+        # end_date is inclusive
+        filters['end'] = datetime.strptime(args['end_date'], '%Y-%m-%d') + timedelta(days=1)
+    return filters
+
+def filter_escalations(query, escalated_to_id=None, status=None, start=None, end=None, before=None):
+    if escalated_to_id:
+        query = query.filter(Escalation.escalated_to_id == escalated_to_id)
+    if status:
+        query = query.filter(Escalation.resolution_status == status)
+    if start:
+        query = query.filter(Escalation.escalation_timestamp >= start)
+    if end:
+        query = query.filter(Escalation.escalation_timestamp < end)
+    if before:
+        # Goes to the current shard: where the page ended depends on the shard's name
+        query = query.filter(sharding.keyset_before((Escalation.escalation_timestamp, Escalation.id), before))
+    return query
+
+def newest_escalation_first(escalation):
+    """Sort key of merged escalation pages; ids repeat across shards, so the shard breaks ties"""
+    return escalation['escalation_timestamp'] or datetime.min, escalation['id'], escalation.get('region', '')
+
+def encode_escalation_cursor(escalation):
+    """Opaque keyset position: the (timestamp, id, shard) of the last escalation on a page"""
+    position = f"{escalation['escalation_timestamp'].isoformat()}|{escalation['id']}"
+    if 'region' in escalation:
+        position += f"|{escalation['region']}"
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+def decode_escalation_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        timestamp, escalation_id, *region = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError('Malformed cursor')
+    return datetime.fromisoformat(timestamp), int(escalation_id), region[0] if region else None
+
 @anomalies_bp.route('/escalations', methods=['GET'])
 def get_escalations():
     token = request.headers.get('Authorization')
@@ -170,8 +278,44 @@ def get_escalations():
     if user.role not in ['Supervisor', 'Commercial Engineer']:
         return jsonify({'error': 'Permission denied'}), 403
 
-    escalations = Escalation.query.order_by(Escalation.escalation_timestamp.desc()).all()
-    return jsonify([escalation.to_dict() for escalation in escalations])
+    try:
+        filters = escalation_filters(request.args)
+        before = decode_escalation_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid filter or cursor'}), 400
+
+    def shard_query():
+        query = filter_escalations(reads.escalation_select(), before=before, **filters)
+        return query.order_by(Escalation.escalation_timestamp.desc(), Escalation.id.desc())
+
+    if stream_requested():
+        def shard_items():
+            items = map(reads.escalation_dict, db.session.execute(shard_query().execution_options(yield_per=JSON_STREAM_BATCH_SIZE)))
+            if include_archived_requested():
+                items = chain(items, (escalation_row_to_dict(row) for row in archived_escalation_rows(before=before, **filters)))
+            return items
+        return stream_json_array(sharding.stream_merged(shard_items, key=newest_escalation_first))
+
+    try:
+        limit = min(int(request.args.get('limit', ESCALATIONS_PAGE_SIZE)), ESCALATIONS_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    def shard_page():
+        # One row more than the page tells whether there is a next page
+        results = [reads.escalation_dict(row) for row in db.session.execute(shard_query().limit(limit + 1))]
+        if include_archived_requested():
+            results.extend(escalation_row_to_dict(row) for row in archived_escalation_rows(before=before, limit=limit + 1, **filters))
+            results.sort(key=newest_escalation_first, reverse=True)
+        return results
+
+    results = sharding.fan_out_merged(shard_page, key=newest_escalation_first)
+    response = jsonify(results[:limit])
+    if len(results) > limit:
+        response.headers['X-Next-Cursor'] = encode_escalation_cursor(results[limit - 1])
+    return response
 
 @anomalies_bp.route('/anomalies/check_escalation', methods=['POST'])
 def check_escalation():
@@ -187,35 +331,43 @@ def check_escalation():
         return jsonify({'error': 'Permission denied'}), 403
 
     four_days_ago = datetime.utcnow() - timedelta(days=4)
-    
-    # Find anomalies older than 4 days that are still open and not escalated
-    anomalies_to_escalate = Anomaly.query.filter(
-        Anomaly.timestamp <= four_days_ago,
-        Anomaly.resolution_status == 'Open',
-        Anomaly.escalation_flag == False
-    ).all()
-
-    escalated_count = 0
-    for anomaly in anomalies_to_escalate:
-        anomaly.escalation_flag = True
-        
-        # Find a commercial engineer to escalate to
-        commercial_engineer = User.query.filter_by(role='Commercial Engineer').first()
-        if commercial_engineer:
-            escalation = Escalation(
-                anomaly_id=anomaly.id,
-                escalated_to_id=commercial_engineer.id
-            )
-            db.session.add(escalation)
-            escalated_count += 1
-            
-            # Send escalation notification email
-            try:
-                send_escalation_notification(anomaly, commercial_engineer)
-            except Exception as e:
-                print(f"Failed to send escalation email: {str(e)}")
 
-    db.session.commit()
+    # Find a commercial engineer to escalate to
+    commercial_engineer = User.query.filter_by(role='Commercial Engineer').first()
+    engineer_id = commercial_engineer.id if commercial_engineer else None
+
+    def escalate_overdue():
+        # Find anomalies older than 4 days that are still open and not escalated
+        anomalies_to_escalate = Anomaly.query.filter(
+            Anomaly.timestamp <= four_days_ago,
+            Anomaly.resolution_status == 'Open',
+            Anomaly.escalation_flag == False
+        ).all()
+
+        escalations = []
+        for anomaly in anomalies_to_escalate:
+            anomaly.escalation_flag = True
+            
+            if engineer_id:
+                escalation = Escalation(
+                    anomaly=anomaly,
+                    escalated_to_id=engineer_id
+                )
+                db.session.add(escalation)
+                escalations.append(escalation)
+
+        db.session.flush()
+        escalation_ids = [escalation.id for escalation in escalations]
+        db.session.commit()
+
+        # One notice for all of them; failures are retried by the notification sweep
+        if escalation_ids:
+            notify_escalations(load_escalations(escalation_ids))
+            db.session.commit()
+        return len(escalation_ids)
+
+    # Every shard the caller covers is checked, in parallel
+    escalated_count = sum(sharding.fan_out(escalate_overdue))
 
     return jsonify({
         'message': f'{escalated_count} anomalies escalated due to 4-day timeout',
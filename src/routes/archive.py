@@ -0,0 +1,298 @@
+import os
+import re
+from datetime import datetime, timedelta
+import click
+import jwt
+from flask import Blueprint, jsonify, request
+from sqlalchemy import Column, Index, MetaData, Table, and_, delete, extract, func, inspect, insert, not_, exists, select, update
+from src.models.user import User, Report, Anomaly, Escalation, anomaly_types, bulk_writes, bump_data_version, compact_change_log, db
+from src.models import sharding, reads
+from src.routes.sync import SYNC_TOMBSTONE_DAYS
+
+archive_bp = Blueprint('archive', __name__, cli_group='archive')
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+# Reports and closed anomalies older than this many days are moved out of the live tables
+ARCHIVE_HORIZON_DAYS = int(os.environ.get('ARCHIVE_HORIZON_DAYS', '365'))
+ARCHIVE_CLOSED_STATUSES = ('Resolved', 'Closed')
+
+ARCHIVE_TABLE_PATTERN = re.compile(r'^(report|anomaly|escalation)_archive_(\d{4})$')
+
+archive_metadata = MetaData()
+_archive_tables = {}
+
+def get_user_from_token(token):
+    try:
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        user_id = payload['user_id']
+        return User.query.get(user_id)
+    except:
+        return None
+
+def archive_table(base, year):
+    """Return the per-year archive table for `base`, mirroring the live table's columns"""
+    name = f'{base}_archive_{year}'
+    table = _archive_tables.get(name)
+    if table is None:
+        live = db.metadata.tables[base]
+        # Archive tables carry no foreign keys: an archived anomaly may point at a report
+        # that is still live, or that lives in a different year's table
+        columns = [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in live.columns]
+        table = Table(name, archive_metadata, *columns)
+        if 'staff_id' in live.c:
+            Index(f'ix_{name}_staff_id', table.c.staff_id)
+        if 'anomaly_id' in live.c:
+            Index(f'ix_{name}_anomaly_id', table.c.anomaly_id)
+        if 'type_id' in live.c:
+            Index(f'ix_{name}_type_id', table.c.type_id)
+        _archive_tables[name] = table
+    return table
+
+def archive_years(base):
+    """Years for which an archive table of `base` exists in the database"""
+    years = []
+    for name in inspect(sharding.engine()).get_table_names():
+        match = ARCHIVE_TABLE_PATTERN.match(name)
+        if match and match.group(1) == base:
+            years.append(int(match.group(2)))
+    return sorted(years)
+
+def _year_range(column, year):
+    start = datetime(year, 1, 1)
+    end = datetime(year + 1, 1, 1)
+    if isinstance(column.type, db.Date):
+        start, end = start.date(), end.date()
+    return and_(column >= start, column < end)
+
+def archive_before(cutoff):
+    """Move closed anomalies (with their escalations) and reports older than `cutoff` into per-year archive tables
+
+    Works on the current shard; see archive_all_before.
+    """
+    anomaly_table = Anomaly.__table__
+    escalation_table = Escalation.__table__
+    report_table = Report.__table__
+    counts = {'reports': 0, 'anomalies': 0, 'escalations': 0}
+
+    archivable_anomalies = and_(
+        anomaly_table.c.timestamp < cutoff,
+        anomaly_table.c.resolution_status.in_(ARCHIVE_CLOSED_STATUSES)
+    )
+    # Reports still referenced by a live anomaly stay live so the link is not broken
+    archivable_reports = and_(
+        report_table.c.report_date < cutoff.date(),
+        not_(exists().where(anomaly_table.c.report_id == report_table.c.id))
+    )
+
+    # Moved rows leave tombstones in the change log, written once at the end instead of per row
+    with sharding.engine().begin() as conn, bulk_writes(conn, deletes=True):
+        anomaly_years = conn.execute(
+            select(extract('year', anomaly_table.c.timestamp)).where(archivable_anomalies).distinct()
+        ).scalars().all()
+
+        for year in sorted(int(y) for y in anomaly_years):
+            in_year = and_(archivable_anomalies, _year_range(anomaly_table.c.timestamp, year))
+            anomaly_ids = select(anomaly_table.c.id).where(in_year)
+
+            target = archive_table('escalation', year)
+            target.create(conn, checkfirst=True)
+            result = conn.execute(insert(target).from_select(
+                [c.name for c in escalation_table.columns],
+                select(*escalation_table.columns).where(escalation_table.c.anomaly_id.in_(anomaly_ids))
+            ))
+            counts['escalations'] += result.rowcount
+
+            target = archive_table('anomaly', year)
+            target.create(conn, checkfirst=True)
+            result = conn.execute(insert(target).from_select(
+                [c.name for c in anomaly_table.columns],
+                select(*anomaly_table.columns).where(in_year)
+            ))
+            counts['anomalies'] += result.rowcount
+
+            # Anomalies and escalations point at each other; the archived copies keep the link
+            conn.execute(update(anomaly_table).where(in_year).values(current_escalation_id=None))
+            conn.execute(delete(escalation_table).where(escalation_table.c.anomaly_id.in_(anomaly_ids)))
+            conn.execute(delete(anomaly_table).where(in_year))
+
+        report_years = conn.execute(
+            select(extract('year', report_table.c.report_date)).where(archivable_reports).distinct()
+        ).scalars().all()
+
+        for year in sorted(int(y) for y in report_years):
+            in_year = and_(archivable_reports, _year_range(report_table.c.report_date, year))
+
+            target = archive_table('report', year)
+            target.create(conn, checkfirst=True)
+            result = conn.execute(insert(target).from_select(
+                [c.name for c in report_table.columns],
+                select(*report_table.columns).where(in_year)
+            ))
+            counts['reports'] += result.rowcount
+            conn.execute(delete(report_table).where(in_year))
+
+        for name, moved in (('report', counts['reports']), ('anomaly', counts['anomalies']), ('escalation', counts['escalations'])):
+            if moved:
+                bump_data_version(conn, name)
+
+        # Archiving is what deletes rows in bulk; old tombstones in the change log go with it
+        compact_change_log(conn, datetime.utcnow() - timedelta(days=SYNC_TOMBSTONE_DAYS))
+
+    return counts
+
+def archive_all_before(cutoff):
+    """archive_before(cutoff) in the main database and every region shard, with the counts added up"""
+    counts = {'reports': 0, 'anomalies': 0, 'escalations': 0}
+    for shard_counts in sharding.fan_out(lambda: archive_before(cutoff), sharding.all_shards()):
+        for key, moved in shard_counts.items():
+            counts[key] += moved
+    return counts
+
+def archived_report_rows(staff_id=None, start_date=None, end_date=None, status=None):
+    """Rows from every report archive table matching the filters, with the reader's staff number"""
+    rows = []
+    for year in archive_years('report'):
+        if start_date and year < start_date.year or end_date and year > end_date.year:
+            continue
+        table = archive_table('report', year)
+        query = reads.report_select(table)
+        if staff_id:
+            query = query.where(table.c.staff_id == staff_id)
+        if start_date:
+            query = query.where(table.c.report_date >= start_date)
+        if end_date:
+            query = query.where(table.c.report_date <= end_date)
+        if status:
+            query = query.where(table.c.status == status)
+        rows.extend(db.session.execute(query).all())
+    rows.sort(key=lambda row: row.timestamp or datetime.min, reverse=True)
+    return rows
+
+def archived_anomaly_rows(staff_id=None, anomaly_type=None, resolution_status=None, escalation_flag=None):
+    """Rows from every anomaly archive table matching the filters, with reporter and assignee staff numbers"""
+    rows = []
+    for year in archive_years('anomaly'):
+        table = archive_table('anomaly', year)
+        query = reads.anomaly_select(table)
+        if staff_id:
+            query = query.where(table.c.staff_id == staff_id)
+        if anomaly_type:
+            query = query.where(table.c.type_id == anomaly_types.id_for(anomaly_type, create=False))
+        if resolution_status:
+            query = query.where(table.c.resolution_status == resolution_status)
+        if escalation_flag is not None:
+            query = query.where(table.c.escalation_flag == escalation_flag)
+        rows.extend(db.session.execute(query).all())
+    rows.sort(key=lambda row: row.timestamp or datetime.min, reverse=True)
+    return rows
+
+def archived_escalation_rows(escalated_to_id=None, status=None, start=None, end=None, before=None, limit=None):
+    """Rows from every escalation archive table matching the filters, with the recipient's staff number
+
+    Rows come newest first. `start` and `end` bound the escalation timestamp (end exclusive),
+    `before` is a (timestamp, id, shard name) keyset position to continue after, and `limit` caps the rows
+    taken from each table and in total.
+    """
+    rows = []
+    for year in archive_years('escalation'):
+        # Escalations are archived under their anomaly's year, so they are never older than it
+        if end and year > end.year:
+            continue
+        table = archive_table('escalation', year)
+        query = reads.escalation_select(table)
+        if escalated_to_id:
+            query = query.where(table.c.escalated_to_id == escalated_to_id)
+        if status:
+            query = query.where(table.c.resolution_status == status)
+        if start:
+            query = query.where(table.c.escalation_timestamp >= start)
+        if end:
+            query = query.where(table.c.escalation_timestamp < end)
+        if before:
+            query = query.where(sharding.keyset_before((table.c.escalation_timestamp, table.c.id), before))
+        query = query.order_by(table.c.escalation_timestamp.desc(), table.c.id.desc())
+        if limit:
+            query = query.limit(limit)
+        rows.extend(db.session.execute(query).all())
+    rows.sort(key=lambda row: (row.escalation_timestamp or datetime.min, row.id), reverse=True)
+    return rows[:limit] if limit else rows
+
+def report_row_to_dict(row):
+    return {**reads.report_dict(row), 'archived': True}
+
+def anomaly_row_to_dict(row):
+    return {**reads.anomaly_dict(row), 'archived': True}
+
+def escalation_row_to_dict(row):
+    return {**reads.escalation_dict(row), 'archived': True}
+
+def include_archived_requested():
+    return request.args.get('include_archived', 'false').lower() == 'true'
+
+@archive_bp.route('/archive', methods=['GET'])
+def get_archive_summary():
+    """List archive tables with their row counts"""
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        return jsonify({'error': 'Permission denied'}), 403
+
+    def shard_summary():
+        summary = []
+        for base in ('report', 'anomaly', 'escalation'):
+            for year in archive_years(base):
+                table = archive_table(base, year)
+                count = db.session.execute(select(func.count()).select_from(table)).scalar()
+                summary.append({'table': table.name, 'type': base, 'year': year, 'rows': count, 'region': sharding.current_shard()})
+        return summary
+
+    summary = [item for part in sharding.fan_out(shard_summary) for item in part]
+
+    return jsonify({'horizon_days': ARCHIVE_HORIZON_DAYS, 'archives': summary})
+
+@archive_bp.route('/archive/run', methods=['POST'])
+def run_archive():
+    """Archive closed anomalies and reports older than the configured horizon"""
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if user.role != 'Commercial Engineer':
+        return jsonify({'error': 'Permission denied'}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        horizon_days = int(data.get('horizon_days', ARCHIVE_HORIZON_DAYS))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'horizon_days must be an integer'}), 400
+
+    if horizon_days < 1:
+        return jsonify({'error': 'horizon_days must be at least 1'}), 400
+
+    cutoff = datetime.utcnow() - timedelta(days=horizon_days)
+    counts = archive_all_before(cutoff)
+
+    return jsonify({
+        'message': f"Archived {counts['reports']} reports, {counts['anomalies']} anomalies and {counts['escalations']} escalations",
+        'cutoff': cutoff.isoformat(),
+        'archived': counts
+    }), 200
+
+@archive_bp.cli.command('run')
+@click.option('--horizon-days', default=ARCHIVE_HORIZON_DAYS, show_default=True, help='Archive data older than this many days.')
+def run_archive_command(horizon_days):
+    """Archive closed anomalies and reports older than the horizon."""
+    cutoff = datetime.utcnow() - timedelta(days=horizon_days)
+    counts = archive_all_before(cutoff)
+    click.echo(f"Archived {counts['reports']} reports, {counts['anomalies']} anomalies "
+               f"and {counts['escalations']} escalations older than {cutoff.date().isoformat()}")
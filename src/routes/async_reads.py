@@ -0,0 +1,181 @@
+"""Async versions of the read-heavy list and dashboard endpoints, served by src.asgi
+
+Each view answers exactly like the Flask view of the same endpoint, and runs inside its
+request context, so rate limits, metrics, CORS and compression apply unchanged; only the
+queries go through asyncio engines instead of blocking a worker thread. Requests the async
+views do not cover (streaming, archived rows) go to the Flask view.
+"""
+import os
+import asyncio
+from datetime import datetime, timedelta
+from itertools import chain
+import jwt
+from flask import jsonify, request
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models.user import User, Report, Anomaly, Escalation
+from src.models import sharding, reads
+from src.routes.reports import report_filters, report_conditions
+from src.routes.anomalies import (
+    anomaly_filters, anomaly_conditions, escalation_filters, filter_escalations,
+    newest_escalation_first, encode_escalation_cursor, decode_escalation_cursor, ESCALATIONS_PAGE_SIZE, ESCALATIONS_MAX_PAGE_SIZE
+)
+from src.routes.dashboard import (
+    reader_statements, reader_dashboard, supervisor_statements, shard_supervisor_dashboard,
+    merge_supervisor_dashboards, merge_trends, trend_statements
+)
+from src.routes.archive import include_archived_requested
+from src.utils.json_provider import stream_requested
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+async def get_user_from_token(engines, token):
+    try:
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        user_id = payload['user_id']
+    except:
+        return None
+    async with AsyncSession(engines.for_shard(None)) as session:
+        return await session.get(User, user_id)
+
+async def fan_out(engines, fn):
+    """await fn(session, region) once per shard the request covers, concurrently, in shard order"""
+    async def in_shard(region):
+        async with AsyncSession(engines.for_shard(region)) as session:
+            return await fn(session, region)
+    return await asyncio.gather(*(in_shard(region) for region in sharding.request_shards()))
+
+def merged_newest_first(parts, key):
+    # Items name their shard, as in sharding.fan_out_merged
+    parts = sharding.tag_regions(parts, sharding.request_shards())
+    if len(parts) == 1:
+        return parts[0]
+    return sorted(chain.from_iterable(parts), key=key, reverse=True)
+
+def sync_only():
+    """Whether the current request needs the Flask view: streamed bodies and archived rows"""
+    return stream_requested() or include_archived_requested()
+
+async def get_reports(engines):
+    user = await get_user_from_token(engines, request.headers.get('Authorization'))
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    try:
+        filters = report_filters(user, request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid {e} format. Use YYYY-MM-DD'}), 400
+
+    query = reads.report_select().where(*report_conditions(*filters)).order_by(Report.timestamp.desc())
+
+    async def shard_results(session, region):
+        return [reads.report_dict(row) for row in await session.execute(query)]
+
+    return jsonify(merged_newest_first(await fan_out(engines, shard_results), key=lambda report: report['timestamp'] or datetime.min))
+
+async def get_anomalies(engines):
+    user = await get_user_from_token(engines, request.headers.get('Authorization'))
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    # Type names are looked up in the anomaly type catalog, which reloads from the database
+    # on a miss: off the event loop
+    conditions = await asyncio.to_thread(lambda: anomaly_conditions(*anomaly_filters(user, request.args)))
+    query = reads.anomaly_select().where(*conditions).order_by(Anomaly.timestamp.desc())
+
+    async def shard_results(session, region):
+        rows = (await session.execute(query)).all()
+        return await asyncio.to_thread(lambda: [reads.anomaly_dict(row) for row in rows])
+
+    return jsonify(merged_newest_first(await fan_out(engines, shard_results), key=lambda anomaly: anomaly['timestamp'] or datetime.min))
+
+async def get_escalations(engines):
+    user = await get_user_from_token(engines, request.headers.get('Authorization'))
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        return jsonify({'error': 'Permission denied'}), 403
+
+    try:
+        filters = escalation_filters(request.args)
+        before = decode_escalation_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid filter or cursor'}), 400
+
+    try:
+        limit = min(int(request.args.get('limit', ESCALATIONS_PAGE_SIZE)), ESCALATIONS_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    async def shard_page(session, region):
+        with sharding.use_shard(region):
+            query = filter_escalations(reads.escalation_select(), before=before, **filters)
+        # One row more than the page tells whether there is a next page
+        query = query.order_by(Escalation.escalation_timestamp.desc(), Escalation.id.desc()).limit(limit + 1)
+        return [reads.escalation_dict(row) for row in await session.execute(query)]
+
+    results = merged_newest_first(await fan_out(engines, shard_page), key=newest_escalation_first)
+    response = jsonify(results[:limit])
+    if len(results) > limit:
+        response.headers['X-Next-Cursor'] = encode_escalation_cursor(results[limit - 1])
+    return response
+
+async def get_reader_dashboard(engines):
+    user = await get_user_from_token(engines, request.headers.get('Authorization'))
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    async with AsyncSession(engines.for_shard(sharding.current_shard())) as session:
+        results = {name: (await session.execute(statement)).all() for name, statement in reader_statements(user.id).items()}
+    return jsonify(reader_dashboard(results, user))
+
+async def get_supervisor_dashboard(engines):
+    user = await get_user_from_token(engines, request.headers.get('Authorization'))
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        return jsonify({'error': 'Permission denied'}), 403
+
+    async def shard_dashboard(session, region):
+        results = {name: (await session.execute(statement)).all() for name, statement in supervisor_statements(region).items()}
+        return shard_supervisor_dashboard(results)
+
+    parts = await fan_out(engines, shard_dashboard)
+    # Names the anomaly types from the catalog, like anomaly_dict
+    return jsonify(await asyncio.to_thread(merge_supervisor_dashboards, parts, user))
+
+async def get_dashboard_stats(engines):
+    user = await get_user_from_token(engines, request.headers.get('Authorization'))
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    days = int(request.args.get('days', 30))
+    start_date = datetime.now() - timedelta(days=days)
+
+    async def shard_trends(session, region):
+        reports_by_date, anomalies_by_date = trend_statements(start_date)
+        return [tuple(item) for item in await session.execute(reports_by_date)], [tuple(item) for item in await session.execute(anomalies_by_date)]
+
+    return jsonify(merge_trends(await fan_out(engines, shard_trends)))
+
+# Flask endpoint -> async view answering it
+ASYNC_VIEWS = {
+    'reports.get_reports': get_reports,
+    'anomalies.get_anomalies': get_anomalies,
+    'anomalies.get_escalations': get_escalations,
+    'dashboard.get_reader_dashboard': get_reader_dashboard,
+    'dashboard.get_supervisor_dashboard': get_supervisor_dashboard,
+    'dashboard.get_dashboard_stats': get_dashboard_stats
+}
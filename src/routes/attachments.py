@@ -0,0 +1,232 @@
+import os
+from datetime import datetime
+import jwt
+from flask import Blueprint, jsonify, request, send_file, url_for
+from werkzeug.http import parse_content_range_header
+from src.models.user import User, Anomaly, Attachment, db
+from src.models import sharding
+from src.utils import attachment_store
+
+attachments_bp = Blueprint('attachments', __name__)
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+ATTACHMENT_MAX_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', str(25 * 1024 * 1024)))
+ATTACHMENT_TYPES = tuple(t.strip() for t in os.environ.get(
+    'ATTACHMENT_TYPES', 'image/jpeg,image/png,image/webp,image/gif,image/heic'
+).split(',') if t.strip())
+# Stored files never change, so clients may keep them; they still need a token to fetch them
+ATTACHMENT_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+def get_user_from_token(token):
+    try:
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        user_id = payload['user_id']
+        return User.query.get(user_id)
+    except:
+        return None
+
+def _can_access(user, anomaly):
+    # Once an anomaly is archived only supervisors and engineers reach its attachments
+    return user.role in ['Supervisor', 'Commercial Engineer'] or (anomaly is not None and anomaly.staff_id == user.id)
+
+def _upload_key(attachment):
+    # Attachment ids are only unique within a shard
+    return f'{sharding.shard_name(sharding.current_shard())}-{attachment.id}'
+
+def attachment_to_dict(attachment):
+    data = attachment.to_dict()
+    data['thumbnail_status'] = attachment_store.thumbnail_status(attachment.sha256, attachment.content_type)
+    if attachment.status == 'Uploading':
+        data['received'] = attachment_store.received_bytes(_upload_key(attachment))
+        data['upload_url'] = url_for('attachments.upload_content', attachment_id=attachment.id, **sharding.region_args())
+    else:
+        data['content_url'] = url_for('attachments.get_content', attachment_id=attachment.id, **sharding.region_args())
+        if data['thumbnail_status'] is not None:
+            data['thumbnail_url'] = url_for('attachments.get_thumbnail', attachment_id=attachment.id, **sharding.region_args())
+    return data
+
+def _load(attachment_id):
+    """(user, attachment, error response) for a request on one attachment"""
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return None, None, (jsonify({'error': 'Invalid or missing token'}), 401)
+
+    if sharding.region_required():
+        return user, None, (jsonify({'error': 'Attachment ids repeat across regions; pass ?region= with the region of the anomaly'}), 400)
+
+    attachment = Attachment.query.get_or_404(attachment_id)
+    if not _can_access(user, attachment.anomaly):
+        return user, None, (jsonify({'error': 'Permission denied'}), 403)
+    return user, attachment, None
+
+@attachments_bp.route('/anomalies/<int:anomaly_id>/attachments', methods=['POST'])
+def create_attachment(anomaly_id):
+    """Start an upload; the file itself is sent to upload_url in one or more chunks"""
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if sharding.region_required():
+        return jsonify({'error': 'Anomaly ids repeat across regions; pass ?region= with the region of the anomaly'}), 400
+
+    anomaly = Anomaly.query.get_or_404(anomaly_id)
+    if not _can_access(user, anomaly):
+        return jsonify({'error': 'Permission denied'}), 403
+
+    data = request.get_json(silent=True) or {}
+    filename = os.path.basename(str(data.get('filename') or '').replace('\\', '/'))[:255]
+    content_type = str(data.get('content_type') or '').lower()
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size is required'}), 400
+
+    if not filename:
+        return jsonify({'error': 'filename is required'}), 400
+    if content_type not in ATTACHMENT_TYPES:
+        return jsonify({'error': f"Unsupported content type. Use one of {', '.join(ATTACHMENT_TYPES)}"}), 400
+    if not 0 < size <= ATTACHMENT_MAX_BYTES:
+        return jsonify({'error': f'size must be between 1 and {ATTACHMENT_MAX_BYTES} bytes'}), 400
+
+    attachment = Attachment(
+        anomaly_id=anomaly.id,
+        uploaded_by_id=user.id,
+        filename=filename,
+        content_type=content_type,
+        size=size
+    )
+    db.session.add(attachment)
+    db.session.commit()
+    attachment_store.sweep_uploads()
+
+    response = jsonify(attachment_to_dict(attachment))
+    response.status_code = 201
+    response.headers['Location'] = url_for('attachments.upload_content', attachment_id=attachment.id, **sharding.region_args())
+    return response
+
+@attachments_bp.route('/anomalies/<int:anomaly_id>/attachments', methods=['GET'])
+def list_attachments(anomaly_id):
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if sharding.region_required():
+        return jsonify({'error': 'Anomaly ids repeat across regions; pass ?region= with the region of the anomaly'}), 400
+
+    anomaly = Anomaly.query.get_or_404(anomaly_id)
+    if not _can_access(user, anomaly):
+        return jsonify({'error': 'Permission denied'}), 403
+
+    attachments = Attachment.query.filter_by(anomaly_id=anomaly.id).order_by(Attachment.id).all()
+    return jsonify([attachment_to_dict(attachment) for attachment in attachments])
+
+@attachments_bp.route('/attachments/<int:attachment_id>', methods=['GET'])
+def get_attachment(attachment_id):
+    """Metadata; while uploading, `received` is where an interrupted upload resumes"""
+    user, attachment, error = _load(attachment_id)
+    if error:
+        return error
+    return jsonify(attachment_to_dict(attachment))
+
+@attachments_bp.route('/attachments/<int:attachment_id>/content', methods=['PUT'])
+def upload_content(attachment_id):
+    """Receive the next chunk of an upload
+
+    Chunks carry `Content-Range: bytes <first>-<last>/<size>` and must start where the
+    previous one ended; a request without the header sends the whole file. A chunk that
+    does not fit gets 409 with the offset to resume from.
+    """
+    user, attachment, error = _load(attachment_id)
+    if error:
+        return error
+    if attachment.status != 'Uploading':
+        return jsonify({'error': 'Upload is already complete', 'attachment': attachment_to_dict(attachment)}), 409
+
+    length = request.content_length
+    if length is None:
+        return jsonify({'error': 'Content-Length is required'}), 411
+
+    header = request.headers.get('Content-Range')
+    if header:
+        content_range = parse_content_range_header(header)
+        if content_range is None or content_range.units != 'bytes' or content_range.start is None:
+            return jsonify({'error': 'Invalid Content-Range'}), 400
+        if content_range.length != attachment.size or content_range.stop - content_range.start != length:
+            return jsonify({'error': 'Content-Range does not match the upload size or the body'}), 400
+        offset = content_range.start
+    else:
+        if length != attachment.size:
+            return jsonify({'error': 'Body does not match the upload size'}), 400
+        offset = 0
+    if offset + length > attachment.size:
+        return jsonify({'error': 'Chunk runs past the end of the file'}), 400
+
+    key = _upload_key(attachment)
+    try:
+        received = attachment_store.write_chunk(key, offset, request.stream, length)
+    except attachment_store.OffsetMismatch as e:
+        return jsonify({'error': str(e), 'received': e.offset}), 409
+    except attachment_store.UploadBusy as e:
+        return jsonify({'error': str(e)}), 409, {'Retry-After': '1'}
+
+    if received < attachment.size:
+        return jsonify(attachment_to_dict(attachment))
+
+    attachment.sha256 = attachment_store.commit_upload(key)
+    attachment.status = 'Complete'
+    attachment.completed_at = datetime.utcnow()
+    db.session.commit()
+    attachment_store.ensure_thumbnail(attachment.sha256, attachment.content_type)
+    return jsonify(attachment_to_dict(attachment)), 201
+
+@attachments_bp.route('/attachments/<int:attachment_id>/content', methods=['GET'])
+def get_content(attachment_id):
+    """The stored file; supports Range requests and conditional GETs"""
+    user, attachment, error = _load(attachment_id)
+    if error:
+        return error
+    if attachment.status != 'Complete':
+        return jsonify({'error': 'Upload is not complete', 'received': attachment_store.received_bytes(_upload_key(attachment))}), 409
+
+    response = send_file(
+        attachment_store.object_path(attachment.sha256),
+        mimetype=attachment.content_type,
+        download_name=attachment.filename,
+        etag=attachment.sha256,
+        conditional=True,
+        last_modified=attachment.completed_at
+    )
+    response.headers['Cache-Control'] = ATTACHMENT_CACHE_CONTROL
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@attachments_bp.route('/attachments/<int:attachment_id>/thumbnail', methods=['GET'])
+def get_thumbnail(attachment_id):
+    user, attachment, error = _load(attachment_id)
+    if error:
+        return error
+
+    status = attachment_store.ensure_thumbnail(attachment.sha256, attachment.content_type) if attachment.status == 'Complete' else None
+    if status is None:
+        return jsonify({'error': 'No thumbnail for this attachment'}), 404
+    if status != 'Ready':
+        return jsonify({'error': f'Thumbnail is {status.lower()}', 'thumbnail_status': status}), 409, {'Retry-After': '2'}
+
+    response = send_file(
+        attachment_store.thumbnail_path(attachment.sha256),
+        mimetype='image/jpeg',
+        etag=attachment.sha256,
+        conditional=True
+    )
+    response.headers['Cache-Control'] = ATTACHMENT_CACHE_CONTROL
+    return response
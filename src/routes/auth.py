@@ -27,6 +27,7 @@ def login():
         'user_id': user.id,
         'staff_number': user.staff_number,
         'role': user.role,
+        'region': user.region,
         'exp': datetime.utcnow() + timedelta(hours=24)
     }, SECRET_KEY, algorithm='HS256')
 
@@ -0,0 +1,93 @@
+import os
+import click
+import jwt
+from flask import Blueprint, jsonify, request
+from src.models.user import User
+from src.utils import backup
+
+backup_bp = Blueprint('backup', __name__, cli_group='backup')
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+def get_user_from_token(token):
+    try:
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        user_id = payload['user_id']
+        return User.query.get(user_id)
+    except:
+        return None
+
+@backup_bp.route('/backups', methods=['GET'])
+def list_backups():
+    """List the snapshots kept, newest first"""
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if user.role != 'Commercial Engineer':
+        return jsonify({'error': 'Permission denied'}), 403
+
+    return jsonify({
+        'interval_hours': backup.BACKUP_INTERVAL_HOURS,
+        'keep': backup.BACKUP_KEEP,
+        'snapshots': backup.list_snapshots()
+    })
+
+@backup_bp.route('/backups', methods=['POST'])
+def create_backup():
+    """Take a snapshot now; writes carry on while it is copied"""
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if user.role != 'Commercial Engineer':
+        return jsonify({'error': 'Permission denied'}), 403
+
+    try:
+        manifest = backup.create_snapshot()
+    except backup.BackupError as e:
+        return jsonify({'error': str(e)}), 500
+    if manifest is None:
+        return jsonify({'error': 'A backup is already in progress'}), 409
+
+    return jsonify({'message': f"Snapshot {manifest['name']} taken", 'snapshot': manifest}), 201
+
+@backup_bp.cli.command('create')
+def create_backup_command():
+    """Snapshot every database, verify it and apply the retention."""
+    try:
+        manifest = backup.create_snapshot()
+    except backup.BackupError as e:
+        raise click.ClickException(str(e))
+    if manifest is None:
+        raise click.ClickException('A backup is already in progress')
+    for entry in manifest['databases']:
+        click.echo(f"{entry['file']}: {entry['bytes']:,} bytes in {entry['seconds']}s, integrity {entry['integrity']}")
+    click.echo(f"Snapshot {manifest['name']} taken in {backup.BACKUP_DIR}")
+
+@backup_bp.cli.command('list')
+def list_backups_command():
+    """List the snapshots kept, newest first."""
+    for snapshot in backup.list_snapshots():
+        size = sum(entry['bytes'] for entry in snapshot['databases'])
+        click.echo(f"{snapshot['name']}  {len(snapshot['databases'])} databases  {size:,} bytes")
+
+@backup_bp.cli.command('restore')
+@click.argument('name')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def restore_backup_command(name, yes):
+    """Replace the live databases with snapshot NAME. Stop the app first."""
+    if not yes:
+        click.confirm(f'Overwrite the live databases with snapshot {name}?', abort=True)
+    try:
+        snapshot = backup.restore_snapshot(name)
+    except backup.BackupError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Restored {', '.join(entry['file'] for entry in snapshot['databases'])} from snapshot {name}")
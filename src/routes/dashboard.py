@@ -1,13 +1,21 @@
-from flask import Blueprint, jsonify, request
-from src.models.user import User, Report, Anomaly, db
+from flask import Blueprint, current_app, jsonify, request
+from src.models.user import User, Report, Anomaly, anomaly_types, db
+from src.models import sharding, reads
+from src.routes.exports import report_version
+import calendar
 import jwt
 import os
-from datetime import datetime, timedelta
-from sqlalchemy import func
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, select
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
 SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+# Month-end average percentage attained below which a reader is flagged in the forecast
+FORECAST_TARGET_PERCENTAGE = float(os.environ.get('FORECAST_TARGET_PERCENTAGE', '90'))
+
+# (database, shard) -> (report version, day, readers' forecasts), replaced when new reports arrive
+_forecasts = {}
 
 def get_user_from_token(token):
     try:
@@ -28,40 +36,47 @@ def get_reader_dashboard():
     if not user:
         return jsonify({'error': 'Invalid or missing token'}), 401
 
+    results = {name: db.session.execute(statement).all() for name, statement in reader_statements(user.id).items()}
+    return jsonify(reader_dashboard(results, user))
+
+def reader_statements(user_id):
+    """Queries for a meter reader's dashboard, by name"""
     # Get current month's reports for this user
     current_month = datetime.now().replace(day=1)
     previous_month = (current_month - timedelta(days=1)).replace(day=1)
-    
-    current_month_reports = Report.query.filter(
-        Report.staff_id == user.id,
-        Report.report_date >= current_month
-    ).all()
-    
-    previous_month_reports = Report.query.filter(
-        Report.staff_id == user.id,
-        Report.report_date >= previous_month,
-        Report.report_date < current_month
-    ).all()
 
-    # Calculate average percentage for current and previous month
-    current_avg = sum(r.percentage_attained for r in current_month_reports) / len(current_month_reports) if current_month_reports else 0
-    previous_avg = sum(r.percentage_attained for r in previous_month_reports) / len(previous_month_reports) if previous_month_reports else 0
+    return {
+        'current_month': select(Report.percentage_attained).where(
+            Report.staff_id == user_id,
+            Report.report_date >= current_month
+        ),
+        'previous_month': select(Report.percentage_attained).where(
+            Report.staff_id == user_id,
+            Report.report_date >= previous_month,
+            Report.report_date < current_month
+        ),
+        'recent_anomalies': reads.anomaly_select().where(Anomaly.staff_id == user_id).order_by(Anomaly.timestamp.desc()).limit(5),
+        'pending_reports': select(func.count(Report.id)).where(Report.staff_id == user_id, Report.status == 'Pending')
+    }
 
-    # Get recent anomalies
-    recent_anomalies = Anomaly.query.filter_by(staff_id=user.id).order_by(Anomaly.timestamp.desc()).limit(5).all()
+def reader_dashboard(results, user):
+    """The meter reader dashboard from the rows of reader_statements()"""
+    current_month = [percentage for percentage, in results['current_month']]
+    previous_month = [percentage for percentage, in results['previous_month']]
 
-    # Get pending reports
-    pending_reports = Report.query.filter_by(staff_id=user.id, status='Pending').count()
+    # Calculate average percentage for current and previous month
+    current_avg = sum(current_month) / len(current_month) if current_month else 0
+    previous_avg = sum(previous_month) / len(previous_month) if previous_month else 0
 
-    return jsonify({
+    return {
         'current_month_average': round(current_avg, 2),
         'previous_month_average': round(previous_avg, 2),
         'improvement': round(current_avg - previous_avg, 2),
-        'total_reports_current_month': len(current_month_reports),
-        'pending_reports': pending_reports,
-        'recent_anomalies': [anomaly.to_dict() for anomaly in recent_anomalies],
+        'total_reports_current_month': len(current_month),
+        'pending_reports': results['pending_reports'][0][0],
+        'recent_anomalies': [reads.anomaly_dict(row) for row in results['recent_anomalies']],
         'user': user.to_dict()
-    })
+    }
 
 @dashboard_bp.route('/dashboard/supervisor', methods=['GET'])
 def get_supervisor_dashboard():
@@ -74,66 +89,80 @@ def get_supervisor_dashboard():
     if user.role not in ['Supervisor', 'Commercial Engineer']:
         return jsonify({'error': 'Permission denied'}), 403
 
-    # Get all meter readers
-    meter_readers = User.query.filter_by(role='Meter Reader').all()
-    
-    # Get current month data
+    def shard_dashboard():
+        statements = supervisor_statements(sharding.current_shard())
+        return shard_supervisor_dashboard({name: db.session.execute(statement).all() for name, statement in statements.items()})
+
+    # National supervisors get every region's shard, added up
+    return jsonify(merge_supervisor_dashboards(sharding.fan_out(shard_dashboard), user))
+
+def supervisor_statements(region):
+    """Queries for one shard's part of the supervisor dashboard, by name
+
+    Per-reader figures are grouped by staff member, so the number of queries does not
+    grow with the number of readers.
+    """
     current_month = datetime.now().replace(day=1)
-    
-    reader_performance = []
-    for reader in meter_readers:
-        # Get current month reports
-        reports = Report.query.filter(
-            Report.staff_id == reader.id,
+    escalated = Anomaly.escalation_flag == True
+
+    return {
+        # All meter readers whose reports live in this shard
+        'meter_readers': select(User.id, User.staff_number).where(User.role == 'Meter Reader', sharding.users_filter(User.region, region)),
+        'month_reports': select(Report.staff_id, func.count(Report.id), func.sum(Report.percentage_attained)).where(
             Report.report_date >= current_month
-        ).all()
-        
-        # Calculate average percentage
-        avg_percentage = sum(r.percentage_attained for r in reports) / len(reports) if reports else 0
-        
-        # Get pending reports
-        pending_reports = Report.query.filter_by(staff_id=reader.id, status='Pending').count()
-        
-        # Get open anomalies
-        open_anomalies = Anomaly.query.filter_by(staff_id=reader.id, resolution_status='Open').count()
-        
-        # Get escalated anomalies
-        escalated_anomalies = Anomaly.query.filter_by(staff_id=reader.id, escalation_flag=True).count()
+        ).group_by(Report.staff_id),
+        'pending_reports': select(Report.staff_id, func.count(Report.id)).where(Report.status == 'Pending').group_by(Report.staff_id),
+        'open_anomalies': select(Anomaly.staff_id, func.count(Anomaly.id)).where(Anomaly.resolution_status == 'Open').group_by(Anomaly.staff_id),
+        'escalated_anomalies': select(Anomaly.staff_id, func.count(Anomaly.id)).where(escalated).group_by(Anomaly.staff_id),
+        'anomaly_distribution': select(Anomaly.type_id, func.count(Anomaly.id)).where(Anomaly.timestamp >= current_month).group_by(Anomaly.type_id),
+        'total_reports': select(func.count(Report.id)).where(Report.report_date >= current_month),
+        'total_anomalies': select(func.count(Anomaly.id)).where(Anomaly.timestamp >= current_month),
+        'total_escalated': select(func.count(Anomaly.id)).where(Anomaly.timestamp >= current_month, escalated)
+    }
+
+def shard_supervisor_dashboard(results):
+    """One shard's part of the supervisor dashboard from the rows of supervisor_statements()"""
+    month_reports = {staff_id: (count, total) for staff_id, count, total in results['month_reports']}
+    pending_reports = dict(results['pending_reports'])
+    open_anomalies = dict(results['open_anomalies'])
+    escalated_anomalies = dict(results['escalated_anomalies'])
 
+    reader_performance = []
+    for staff_id, staff_number in results['meter_readers']:
+        count, total = month_reports.get(staff_id, (0, 0))
         reader_performance.append({
-            'staff_number': reader.staff_number,
-            'staff_id': reader.id,
-            'average_percentage': round(avg_percentage, 2),
-            'total_reports': len(reports),
-            'pending_reports': pending_reports,
-            'open_anomalies': open_anomalies,
-            'escalated_anomalies': escalated_anomalies
+            'staff_number': staff_number,
+            'staff_id': staff_id,
+            'average_percentage': round(total / count, 2) if count else 0,
+            'total_reports': count,
+            'pending_reports': pending_reports.get(staff_id, 0),
+            'open_anomalies': open_anomalies.get(staff_id, 0),
+            'escalated_anomalies': escalated_anomalies.get(staff_id, 0)
         })
 
-    # Get overall statistics
-    total_reports = Report.query.filter(Report.report_date >= current_month).count()
-    total_anomalies = Anomaly.query.filter(Anomaly.timestamp >= current_month).count()
-    escalated_anomalies = Anomaly.query.filter(
-        Anomaly.timestamp >= current_month,
-        Anomaly.escalation_flag == True
-    ).count()
-
-    # Get anomaly distribution
-    anomaly_distribution = db.session.query(
-        Anomaly.type,
-        func.count(Anomaly.id).label('count')
-    ).filter(
-        Anomaly.timestamp >= current_month
-    ).group_by(Anomaly.type).all()
-
-    return jsonify({
+    return {
         'reader_performance': reader_performance,
-        'total_reports': total_reports,
-        'total_anomalies': total_anomalies,
-        'escalated_anomalies': escalated_anomalies,
-        'anomaly_distribution': [{'type': item[0], 'count': item[1]} for item in anomaly_distribution],
+        'total_reports': results['total_reports'][0][0],
+        'total_anomalies': results['total_anomalies'][0][0],
+        'escalated_anomalies': results['total_escalated'][0][0],
+        'anomaly_distribution': [tuple(item) for item in results['anomaly_distribution']]
+    }
+
+def merge_supervisor_dashboards(shards, user):
+    """The supervisor dashboard from the per-shard parts"""
+    distribution = {}
+    for shard in shards:
+        for type_id, count in shard['anomaly_distribution']:
+            distribution[type_id] = distribution.get(type_id, 0) + count
+
+    return {
+        'reader_performance': [reader for shard in shards for reader in shard['reader_performance']],
+        'total_reports': sum(shard['total_reports'] for shard in shards),
+        'total_anomalies': sum(shard['total_anomalies'] for shard in shards),
+        'escalated_anomalies': sum(shard['escalated_anomalies'] for shard in shards),
+        'anomaly_distribution': [{'type': anomaly_types.name(type_id), 'count': count} for type_id, count in distribution.items()],
         'user': user.to_dict()
-    })
+    }
 
 @dashboard_bp.route('/dashboard/stats', methods=['GET'])
 def get_dashboard_stats():
@@ -147,38 +176,149 @@ def get_dashboard_stats():
     days = int(request.args.get('days', 30))
     start_date = datetime.now() - timedelta(days=days)
 
-    # Get reports trend
-    reports_by_date = db.session.query(
+    def shard_trends():
+        reports_by_date, anomalies_by_date = trend_statements(start_date)
+        return [tuple(item) for item in db.session.execute(reports_by_date)], [tuple(item) for item in db.session.execute(anomalies_by_date)]
+
+    return jsonify(merge_trends(sharding.fan_out(shard_trends)))
+
+def trend_statements(start_date):
+    """Queries for the reports and anomalies per day since `start_date` in one shard"""
+    reports_by_date = select(
         func.date(Report.report_date).label('date'),
         func.count(Report.id).label('count'),
         func.avg(Report.percentage_attained).label('avg_percentage')
-    ).filter(
+    ).where(
         Report.report_date >= start_date.date()
-    ).group_by(func.date(Report.report_date)).all()
+    ).group_by(func.date(Report.report_date))
 
-    # Get anomalies trend
-    anomalies_by_date = db.session.query(
+    anomalies_by_date = select(
         func.date(Anomaly.timestamp).label('date'),
         func.count(Anomaly.id).label('count')
-    ).filter(
+    ).where(
         Anomaly.timestamp >= start_date
-    ).group_by(func.date(Anomaly.timestamp)).all()
+    ).group_by(func.date(Anomaly.timestamp))
+    return reports_by_date, anomalies_by_date
 
-    return jsonify({
+def merge_trends(shards):
+    """Dashboard trends from the per-shard (reports by date, anomalies by date) rows
+
+    Shards are combined by day; averages are weighted by each shard's report count.
+    """
+    reports_by_date, anomalies_by_date = {}, {}
+    for shard_reports, shard_anomalies in shards:
+        for day, count, avg_percentage in shard_reports:
+            total_count, total_percentage = reports_by_date.get(day, (0, 0.0))
+            reports_by_date[day] = (total_count + count, total_percentage + float(avg_percentage or 0) * count)
+        for day, count in shard_anomalies:
+            anomalies_by_date[day] = anomalies_by_date.get(day, 0) + count
+
+    return {
         'reports_trend': [
             {
-                'date': item[0].isoformat() if item[0] else None,
-                'count': item[1],
-                'avg_percentage': round(float(item[2]), 2) if item[2] else 0
+                'date': str(day) if day else None,
+                'count': count,
+                'avg_percentage': round(total_percentage / count, 2) if count and total_percentage else 0
             }
-            for item in reports_by_date
+            for day, (count, total_percentage) in reports_by_date.items()
         ],
         'anomalies_trend': [
             {
-                'date': item[0].isoformat() if item[0] else None,
-                'count': item[1]
+                'date': str(day) if day else None,
+                'count': count
             }
-            for item in anomalies_by_date
+            for day, count in anomalies_by_date.items()
         ]
+    }
+
+@dashboard_bp.route('/dashboard/forecast', methods=['GET'])
+def get_forecast():
+    """Projected month-end report count and average percentage attained per meter reader, worst first
+
+    Supervisors get every reader of their region (or all regions); a meter reader gets their own.
+    """
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    today = date.today()
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    database = current_app.config['SQLALCHEMY_DATABASE_URI']
+
+    def shard_forecast():
+        region = sharding.current_shard()
+        version = report_version()
+        cached = _forecasts.get((database, region))
+        if cached is not None and cached[:2] == (version, today):
+            return cached[2]
+        forecasts = shard_forecasts(region, today, days_in_month)
+        _forecasts[(database, region)] = (version, today, forecasts)
+        return forecasts
+
+    forecasts = [forecast for shard in sharding.fan_out(shard_forecast) for forecast in shard]
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        forecasts = [forecast for forecast in forecasts if forecast['staff_id'] == user.id]
+    forecasts.sort(key=lambda forecast: (forecast['projected_percentage'] is None, forecast['projected_percentage'] or 0))
+
+    return jsonify({
+        'month': today.strftime('%Y-%m'),
+        'days_remaining': days_in_month - today.day,
+        'target_percentage': FORECAST_TARGET_PERCENTAGE,
+        'readers': forecasts
     })
 
+def shard_forecasts(region, today, days_in_month):
+    """Forecasts of the meter readers whose reports live in `region`'s shard
+
+    Daily report counts and percentage sums come from one grouped query, and every
+    reader is projected at once on the resulting (readers x days) arrays.
+    """
+    # NumPy is only imported by the processes that serve forecasts
+    import numpy as np
+    from src.utils.forecast import project_month_end, FORECAST_HISTORY_DAYS
+
+    month_start = today.replace(day=1)
+    start = min(month_start, today - timedelta(days=FORECAST_HISTORY_DAYS))
+    days = (today - start).days + 1
+
+    readers = db.session.execute(
+        select(User.id, User.staff_number).where(User.role == 'Meter Reader', sharding.users_filter(User.region, region)).order_by(User.id)
+    ).all()
+    if not readers:
+        return []
+    rows = {staff_id: index for index, (staff_id, _) in enumerate(readers)}
+
+    counts = np.zeros((len(readers), days))
+    sums = np.zeros((len(readers), days))
+    daily = db.session.execute(
+        select(Report.staff_id, Report.report_date, func.count(Report.id), func.sum(Report.percentage_attained)).where(
+            Report.report_date >= start, Report.report_date <= today
+        ).group_by(Report.staff_id, Report.report_date)
+    )
+    for staff_id, report_date, count, total in daily:
+        row = rows.get(staff_id)
+        if row is not None:
+            counts[row, (report_date - start).days] = count
+            sums[row, (report_date - start).days] = total
+
+    month_columns = (today - month_start).days + 1
+    projected_reports, projected_percentage, trend = project_month_end(counts, sums, month_columns, days_in_month - today.day)
+    month_counts = counts[:, -month_columns:].sum(axis=1)
+    month_sums = sums[:, -month_columns:].sum(axis=1)
+
+    forecasts = []
+    for index, (staff_id, staff_number) in enumerate(readers):
+        percentage = None if np.isnan(projected_percentage[index]) else round(float(projected_percentage[index]), 2)
+        forecasts.append({
+            'staff_id': staff_id,
+            'staff_number': staff_number,
+            'reports_so_far': int(month_counts[index]),
+            'average_so_far': round(float(month_sums[index] / month_counts[index]), 2) if month_counts[index] else 0,
+            'projected_reports': round(float(projected_reports[index]), 1),
+            'projected_percentage': percentage,
+            'trend_per_day': round(float(trend[index]), 3),
+            'at_risk': percentage is not None and percentage < FORECAST_TARGET_PERCENTAGE
+        })
+    return forecasts
@@ -1,10 +1,10 @@
-import smtplib
 import os
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask import Blueprint, jsonify, request
 from src.models.user import User, Anomaly, Escalation, db
+from src.models import sharding
+from sqlalchemy import select, update
+from sqlalchemy.orm import joinedload
 import jwt
 
 email_bp = Blueprint('email', __name__)
@@ -18,6 +18,16 @@ EMAIL_USER = os.environ.get('EMAIL_USER', 'noreply@kenyapower.co.ke')
 EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD', '')
 EMAIL_FROM = os.environ.get('EMAIL_FROM', 'Reading Reports.io <noreply@kenyapower.co.ke>')
 
+# Open escalations are re-notified this often after delivery; 0 sends no reminders
+ESCALATION_REMINDER_HOURS = float(os.environ.get('ESCALATION_REMINDER_HOURS', '24'))
+# A failed notice is retried after this long, doubling with each attempt up to the reminder interval
+ESCALATION_RETRY_MINUTES = float(os.environ.get('ESCALATION_RETRY_MINUTES', '5'))
+ESCALATION_NOTIFY_MAX_ATTEMPTS = int(os.environ.get('ESCALATION_NOTIFY_MAX_ATTEMPTS', '8'))
+# Due escalations handled per call to the notification sweep; the rest wait for the next call
+ESCALATION_NOTIFY_BATCH = int(os.environ.get('ESCALATION_NOTIFY_BATCH', '1000'))
+# How long a sweep holds the escalations it is notifying
+ESCALATION_NOTIFY_LEASE_MINUTES = 10
+
 def get_user_from_token(token):
     try:
         if token.startswith('Bearer '):
@@ -29,42 +39,52 @@ def get_user_from_token(token):
     except:
         return None
 
-def send_email(to_email, subject, body_html, body_text=None):
-    """Send an email notification"""
-    try:
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = EMAIL_FROM
-        msg['To'] = to_email
-
-        # Create the plain-text and HTML version of your message
-        if body_text:
-            part1 = MIMEText(body_text, 'plain')
-            msg.attach(part1)
-
-        part2 = MIMEText(body_html, 'html')
-        msg.attach(part2)
-
-        # Send the message via SMTP server
-        if EMAIL_PASSWORD:  # Only send if email is configured
-            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+def deliver_email(to_email, subject, body_html, body_text=None):
+    """Send an email notification, raising if it could not be sent"""
+    # Loaded on the first email rather than by every worker at startup
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
+    # Create message
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = EMAIL_FROM
+    msg['To'] = to_email
+
+    # Create the plain-text and HTML version of your message
+    if body_text:
+        part1 = MIMEText(body_text, 'plain')
+        msg.attach(part1)
+
+    part2 = MIMEText(body_html, 'html')
+    msg.attach(part2)
+
+    # Send the message via SMTP server
+    if EMAIL_PASSWORD:  # Only send if email is configured
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+        try:
             server.starttls()
             server.login(EMAIL_USER, EMAIL_PASSWORD)
             text = msg.as_string()
             server.sendmail(EMAIL_FROM, to_email, text)
+        finally:
             server.quit()
-            return True
-        else:
-            print(f"Email would be sent to {to_email}: {subject}")
-            print(f"Body: {body_html}")
-            return True  # Simulate success for demo purposes
+    else:
+        print(f"Email would be sent to {to_email}: {subject}")
+        print(f"Body: {body_html}")  # Simulate success for demo purposes
+
+def send_email(to_email, subject, body_html, body_text=None):
+    """Send an email notification"""
+    try:
+        deliver_email(to_email, subject, body_html, body_text)
+        return True
     except Exception as e:
         print(f"Failed to send email: {str(e)}")
         return False
 
-def send_escalation_notification(anomaly, escalated_to_user):
-    """Send escalation notification email"""
+def escalation_notification_message(anomaly, escalated_to_user):
+    """Subject, HTML and plain-text body of the notice for one escalated anomaly"""
     subject = f"[Reading Reports.io] Anomaly Escalated - {anomaly.type}"
     
     body_html = f"""
@@ -139,11 +159,165 @@ def send_escalation_notification(anomaly, escalated_to_user):
     © 2025 Reading Reports.io - powered by 85891
     """
     
+    return subject, body_html, body_text
+
+def escalation_digest_message(escalated_to_user, escalations):
+    """Subject, HTML and plain-text body of one notice covering several escalations"""
+    subject = f"[Reading Reports.io] {len(escalations)} Anomalies Escalated to You"
+
+    def reported_on(anomaly):
+        return anomaly.timestamp.strftime('%Y-%m-%d %H:%M:%S') if anomaly.timestamp else 'Unknown'
+
+    def reported_by(anomaly):
+        return anomaly.staff.staff_number if anomaly.staff else 'Unknown'
+
+    rows_html = "".join(f"""
+                <tr>
+                    <td>{e.anomaly.type}</td>
+                    <td>{e.anomaly.description}</td>
+                    <td>{reported_by(e.anomaly)}</td>
+                    <td>{reported_on(e.anomaly)}</td>
+                    <td>{e.anomaly.resolution_status}</td>
+                </tr>""" for e in escalations)
+    rows_text = "\n".join(
+        f"    - {e.anomaly.type}: {e.anomaly.description} (reported by {reported_by(e.anomaly)} on {reported_on(e.anomaly)}, {e.anomaly.resolution_status})"
+        for e in escalations
+    )
+
+    body_html = f"""
+    <html>
+    <head>
+        <style>
+            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+            .header {{ background-color: #003399; color: white; padding: 20px; text-align: center; }}
+            .content {{ padding: 20px; }}
+            .anomaly-details {{ background-color: #f8f9fa; padding: 15px; border-left: 4px solid #FFD100; margin: 15px 0; }}
+            .anomaly-details td, .anomaly-details th {{ padding: 4px 8px; text-align: left; }}
+            .footer {{ background-color: #f8f9fa; padding: 15px; text-align: center; font-size: 12px; color: #666; }}
+            .urgent {{ color: #dc3545; font-weight: bold; }}
+        </style>
+    </head>
+    <body>
+        <div class="header">
+            <h1>Reading Reports.io</h1>
+            <p>Kenya Power Meter Reading System</p>
+        </div>
+        
+        <div class="content">
+            <h2 class="urgent">Anomaly Escalation Notice</h2>
+            
+            <p>Dear {escalated_to_user.staff_number},</p>
+            
+            <p>The following {len(escalations)} anomalies have been escalated to you and require your attention.</p>
+            
+            <div class="anomaly-details">
+                <table>
+                    <tr><th>Type</th><th>Description</th><th>Reported by</th><th>Reported on</th><th>Current Status</th></tr>{rows_html}
+                </table>
+            </div>
+            
+            <p>Please log into the Reading Reports.io system to review and take appropriate action on these anomalies.</p>
+            
+            <p>Best regards,<br>
+            Reading Reports.io System</p>
+        </div>
+        
+        <div class="footer">
+            <p>© 2025 Reading Reports.io - powered by 85891</p>
+            <p>This is an automated message. Please do not reply to this email.</p>
+        </div>
+    </body>
+    </html>
+    """
+
+    body_text = f"""
+    Reading Reports.io - Anomaly Escalation Notice
+    
+    Dear {escalated_to_user.staff_number},
+    
+    The following {len(escalations)} anomalies have been escalated to you and require your attention:
+    
+{rows_text}
+    
+    Please log into the Reading Reports.io system to review and take appropriate action on these anomalies.
+    
+    Best regards,
+    Reading Reports.io System
+    
+    © 2025 Reading Reports.io - powered by 85891
+    """
+
+    return subject, body_html, body_text
+
+def escalation_email_address(escalated_to_user):
     # For demo purposes, use a placeholder email
     # In production, this would be the user's actual email address
-    to_email = f"{escalated_to_user.staff_number}@kenyapower.co.ke"
-    
-    return send_email(to_email, subject, body_html, body_text)
+    return f"{escalated_to_user.staff_number}@kenyapower.co.ke"
+
+def send_escalation_notification(anomaly, escalated_to_user):
+    """Send escalation notification email"""
+    subject, body_html, body_text = escalation_notification_message(anomaly, escalated_to_user)
+    return send_email(escalation_email_address(escalated_to_user), subject, body_html, body_text)
+
+def record_delivery(escalation, now, error=None):
+    """Note a notification attempt on `escalation` and schedule its next notice"""
+    if error is None:
+        escalation.notified_at = now
+        escalation.notify_attempts = 0
+        escalation.last_notify_error = None
+        escalation.next_notify_at = now + timedelta(hours=ESCALATION_REMINDER_HOURS) if ESCALATION_REMINDER_HOURS > 0 else None
+        return
+    escalation.notify_attempts = (escalation.notify_attempts or 0) + 1
+    escalation.last_notify_error = str(error)[:1000]
+    if escalation.notify_attempts >= ESCALATION_NOTIFY_MAX_ATTEMPTS:
+        escalation.next_notify_at = None
+    else:
+        backoff = timedelta(minutes=ESCALATION_RETRY_MINUTES * 2 ** (escalation.notify_attempts - 1))
+        if ESCALATION_REMINDER_HOURS > 0:
+            backoff = min(backoff, timedelta(hours=ESCALATION_REMINDER_HOURS))
+        escalation.next_notify_at = now + backoff
+
+def load_escalations(ids):
+    """Escalations by id with everything a notice shows, in one query"""
+    return Escalation.query.filter(Escalation.id.in_(ids)).options(
+        joinedload(Escalation.anomaly).joinedload(Anomaly.staff),
+        joinedload(Escalation.escalated_to)
+    ).order_by(Escalation.escalated_to_id, Escalation.escalation_timestamp).all()
+
+def notify_escalations(escalations, now=None):
+    """Email each recipient one notice covering their escalations and record the outcome
+
+    The caller commits. Returns (emails sent, escalations notified, escalations failed).
+    """
+    now = now or datetime.utcnow()
+    by_recipient = {}
+    for escalation in escalations:
+        if escalation.escalated_to is None:
+            escalation.next_notify_at = None
+            continue
+        by_recipient.setdefault(escalation.escalated_to_id, []).append(escalation)
+
+    emails = notified = failed = 0
+    for recipient_escalations in by_recipient.values():
+        recipient = recipient_escalations[0].escalated_to
+        if len(recipient_escalations) == 1:
+            message = escalation_notification_message(recipient_escalations[0].anomaly, recipient)
+        else:
+            message = escalation_digest_message(recipient, recipient_escalations)
+        error = None
+        try:
+            deliver_email(escalation_email_address(recipient), *message)
+        except Exception as e:
+            print(f"Failed to send escalation email: {str(e)}")
+            error = e
+        for escalation in recipient_escalations:
+            record_delivery(escalation, now, error)
+        if error is None:
+            emails += 1
+            notified += len(recipient_escalations)
+        else:
+            failed += len(recipient_escalations)
+    return emails, notified, failed
 
 def send_report_submission_confirmation(user, report):
     """Send report submission confirmation email"""
@@ -204,6 +378,39 @@ def send_report_submission_confirmation(user, report):
     
     return send_email(to_email, subject, body_html)
 
+def sweep_escalation_notifications(now):
+    """Notify every escalation of the current shard that is due; returns the counts of notify_escalations"""
+    # Only escalations that were never delivered, failed, or are due a reminder
+    due_ids = db.session.execute(
+        select(Escalation.id).where(Escalation.next_notify_at <= now)
+        .order_by(Escalation.next_notify_at).limit(ESCALATION_NOTIFY_BATCH)
+    ).scalars().all()
+    if not due_ids:
+        return 0, 0, 0
+
+    # Claim them, so a concurrent call does not notify the same escalations again
+    claimed = db.session.execute(
+        update(Escalation).where(Escalation.id.in_(due_ids), Escalation.next_notify_at <= now)
+        .values(next_notify_at=now + timedelta(minutes=ESCALATION_NOTIFY_LEASE_MINUTES))
+        .returning(Escalation.id),
+        execution_options={'synchronize_session': False}
+    ).scalars().all()
+    db.session.commit()
+
+    deliverable = []
+    for escalation in load_escalations(claimed):
+        anomaly = escalation.anomaly
+        # Superseded, de-escalated or resolved since: nothing more to send
+        if anomaly.current_escalation_id != escalation.id or not anomaly.escalation_flag \
+                or anomaly.resolution_status in ('Resolved', 'Closed') or escalation.resolution_status == 'Resolved':
+            escalation.next_notify_at = None
+        else:
+            deliverable.append(escalation)
+
+    counts = notify_escalations(deliverable, now)
+    db.session.commit()
+    return counts
+
 @email_bp.route('/send_test_email', methods=['POST'])
 def send_test_email():
     """Send a test email to verify email configuration"""
@@ -250,21 +457,22 @@ def send_escalation_notifications():
     if user.role not in ['Supervisor', 'Commercial Engineer']:
         return jsonify({'error': 'Permission denied'}), 403
 
-    # Get all escalated anomalies that haven't been notified
-    escalated_anomalies = Anomaly.query.filter_by(escalation_flag=True).all()
-    
-    notifications_sent = 0
-    for anomaly in escalated_anomalies:
-        # Find the latest escalation for this anomaly
-        escalation = Escalation.query.filter_by(anomaly_id=anomaly.id).order_by(Escalation.escalation_timestamp.desc()).first()
-        
-        if escalation and escalation.escalated_to:
-            success = send_escalation_notification(anomaly, escalation.escalated_to)
-            if success:
-                notifications_sent += 1
+    now = datetime.utcnow()
+    # Every shard the caller covers is swept, in parallel
+    results = sharding.fan_out(lambda: sweep_escalation_notifications(now))
+    notifications_sent, notified, failed = (sum(counts) for counts in zip(*results))
+
+    if not (notifications_sent or notified or failed):
+        return jsonify({
+            'message': 'No escalation notifications due',
+            'notifications_sent': 0,
+            'escalations_notified': 0,
+            'escalations_failed': 0
+        }), 200
 
     return jsonify({
         'message': f'Sent {notifications_sent} escalation notifications',
-        'notifications_sent': notifications_sent
+        'notifications_sent': notifications_sent,
+        'escalations_notified': notified,
+        'escalations_failed': failed
     }), 200
-
@@ -0,0 +1,357 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, date
+from functools import partial
+import jwt
+from flask import Blueprint, Flask, current_app, jsonify, request, send_file, url_for
+from sqlalchemy import func, select
+from src.models.user import User, Report, DataVersion, db
+from src.models import sharding
+from src.routes.reports import EXPORT_MIMETYPES, export_filename, export_rows, write_export
+from src.routes.archive import archive_years
+from src.utils import process_pool
+
+exports_bp = Blueprint('exports', __name__)
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+EXPORT_DIR = os.environ.get('EXPORT_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'exports'))
+# Finished files are served again for identical requests until they expire or are evicted by size
+EXPORT_CACHE_TTL = int(os.environ.get('EXPORT_CACHE_TTL', '3600'))
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# A job still marked running after this long is assumed lost with its process and may be resubmitted
+EXPORT_JOB_TIMEOUT = int(os.environ.get('EXPORT_JOB_TIMEOUT', '600'))
+
+EXTENSIONS = {'excel': 'xlsx', 'csv': 'csv'}
+JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+def get_user_from_token(token):
+    try:
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        user_id = payload['user_id']
+        return User.query.get(user_id)
+    except:
+        return None
+
+def _job_path(job_id, suffix):
+    return os.path.join(EXPORT_DIR, f'{job_id}.{suffix}')
+
+def _result_path(job_id, format_type):
+    return _job_path(job_id, EXTENSIONS[format_type])
+
+def report_version(include_archived=False):
+    """Changes whenever the current shard's reports may have changed
+
+    The ORM and the archiver bump the DataVersion counter on every report change;
+    the highest id catches bulk inserts from the generator.
+    """
+    max_id = db.session.execute(select(func.max(Report.id))).scalar()
+    version = db.session.get(DataVersion, 'report')
+    token = f"{version.version if version else 0}.{max_id}"
+    if include_archived:
+        token += '.' + ','.join(str(year) for year in archive_years('report'))
+    return token
+
+def data_version_token(include_archived=False, shards=None):
+    """Changes whenever the set of exportable reports may have changed; each shard counts its own"""
+    return '/'.join(sharding.fan_out(lambda: report_version(include_archived), shards))
+
+def normalize_export_params(args, user):
+    """Canonical filter parameters, or raise ValueError with a message for the client"""
+    format_type = str(args.get('format') or 'excel').lower()
+    if format_type not in EXTENSIONS:
+        raise ValueError('Invalid format. Use excel or csv')
+
+    staff_id = args.get('staff_id')
+    # If user is not a supervisor, only export their own reports
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        staff_id = user.id
+    if staff_id in ('', None):
+        staff_id = None
+    else:
+        try:
+            staff_id = int(staff_id)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid staff_id')
+
+    dates = {}
+    for name in ('start_date', 'end_date'):
+        value = args.get(name)
+        try:
+            dates[name] = datetime.strptime(value, '%Y-%m-%d').date().isoformat() if value else None
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid {name} format. Use YYYY-MM-DD')
+
+    include_archived = args.get('include_archived', False)
+    if isinstance(include_archived, str):
+        include_archived = include_archived.lower() == 'true'
+
+    return {
+        'format': format_type,
+        'staff_id': staff_id,
+        'start_date': dates['start_date'],
+        'end_date': dates['end_date'],
+        'status': args.get('status') or None,
+        'include_archived': bool(include_archived),
+        # The regions the user may see, fixed when the job is created
+        'shards': sharding.request_shards()
+    }
+
+def database_identity():
+    """The databases an export reads: apps on other databases sharing EXPORT_DIR get other job ids"""
+    return [current_app.config['SQLALCHEMY_DATABASE_URI'], sorted((current_app.config.get('DATABASE_SHARDS') or {}).items())]
+
+def export_job_id(params):
+    """Identical filters over unchanged data map to the same job and the same cached file"""
+    key = json.dumps({
+        **params,
+        'database': database_identity(),
+        'version': data_version_token(params['include_archived'], params['shards'])
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+_worker_apps = {}
+
+def worker_app(database_url, shards):
+    # A bare app is enough to use the models from a pool process
+    cache_key = (database_url, tuple(sorted(shards.items())))
+    app = _worker_apps.get(cache_key)
+    if app is None:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        app.config['DATABASE_SHARDS'] = shards
+        sharding.init_app(app)
+        db.init_app(app)
+        with app.app_context():
+            sharding.prepare_engines(db)
+        _worker_apps[cache_key] = app
+    return app
+
+def build_export(database_url, shards, params, path):
+    """Runs in a pool process: query the reports and write the file atomically to `path`"""
+    with worker_app(database_url, shards).app_context():
+        rows = export_rows(
+            params['staff_id'],
+            date.fromisoformat(params['start_date']) if params['start_date'] else None,
+            date.fromisoformat(params['end_date']) if params['end_date'] else None,
+            params['status'],
+            params['include_archived'],
+            shards=params['shards']
+        )
+        db.session.remove()
+    temporary = f'{path}.{os.getpid()}.tmp'
+    write_export(rows, params['format'], temporary)
+    os.replace(temporary, path)
+    return len(rows)
+
+def _finish_job(job_id, future):
+    exc = future.exception()
+    if exc is not None:
+        with open(_job_path(job_id, 'error'), 'w') as f:
+            f.write(str(exc) or exc.__class__.__name__)
+    try:
+        os.remove(_job_path(job_id, 'lock'))
+    except FileNotFoundError:
+        pass
+    sweep_cache(force=True)
+
+def read_job(job_id):
+    """Metadata and state of a job, or None if it is unknown or has expired"""
+    try:
+        with open(_job_path(job_id, 'json')) as f:
+            job = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    result = _result_path(job_id, job['params']['format'])
+    lock = _job_path(job_id, 'lock')
+    error = _job_path(job_id, 'error')
+    if os.path.exists(result):
+        job['status'] = 'done'
+        job['size'] = os.path.getsize(result)
+    elif os.path.exists(error):
+        job['status'] = 'failed'
+        with open(error) as f:
+            job['error'] = f.read()
+    elif os.path.exists(lock) and time.time() - os.path.getmtime(lock) < EXPORT_JOB_TIMEOUT:
+        job['status'] = 'running'
+    else:
+        return None
+    return job
+
+def submit_export(params, user):
+    """Start a job for `params` unless an identical one is cached or already running"""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    job_id = export_job_id(params)
+    result = _result_path(job_id, params['format'])
+    lock = _job_path(job_id, 'lock')
+
+    if os.path.exists(result):
+        os.utime(result)
+        return job_id, 'done'
+
+    for _ in range(2):
+        try:
+            # The lock file is the coalescing point for every thread and worker process
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            if time.time() - os.path.getmtime(lock) < EXPORT_JOB_TIMEOUT:
+                return job_id, 'running'
+            os.remove(lock)
+    else:
+        return job_id, 'running'
+
+    if os.path.exists(_job_path(job_id, 'error')):
+        os.remove(_job_path(job_id, 'error'))
+    with open(_job_path(job_id, 'json'), 'w') as f:
+        json.dump({'job_id': job_id, 'params': params, 'requested_by': user.id, 'created_at': datetime.utcnow().isoformat()}, f)
+
+    future = process_pool.submit(
+        build_export, current_app.config['SQLALCHEMY_DATABASE_URI'], current_app.config['DATABASE_SHARDS'], params, result
+    )
+    future.add_done_callback(partial(_finish_job, job_id))
+    sweep_cache()
+    return job_id, 'running'
+
+def sweep_cache(force=False):
+    """Drop expired exports, then the least recently used ones while over the size budget"""
+    global _last_sweep
+    now = time.time()
+    if not force and now - _last_sweep < 60:
+        return
+    if not _sweep_lock.acquire(blocking=False):
+        return
+    try:
+        _last_sweep = now
+        if not os.path.isdir(EXPORT_DIR):
+            return
+        jobs = {}
+        for name in os.listdir(EXPORT_DIR):
+            job_id, _, suffix = name.partition('.')
+            jobs.setdefault(job_id, {})[suffix] = os.path.join(EXPORT_DIR, name)
+
+        results = []
+        for job_id, files in jobs.items():
+            if 'lock' in files:
+                continue
+            paths = list(files.values())
+            try:
+                newest = max(os.path.getmtime(p) for p in paths)
+            except FileNotFoundError:
+                continue
+            if now - newest > EXPORT_CACHE_TTL:
+                _remove(paths)
+                continue
+            for extension in EXTENSIONS.values():
+                if extension in files:
+                    results.append((newest, os.path.getsize(files[extension]), paths))
+
+        total = sum(size for _, size, _ in results)
+        for _, size, paths in sorted(results, key=lambda r: r[0]):
+            if total <= EXPORT_CACHE_MAX_BYTES:
+                break
+            _remove(paths)
+            total -= size
+    finally:
+        _sweep_lock.release()
+
+def _remove(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _can_access(user, job):
+    # A job may only be read by staff who cover every region it was built from
+    if not set(job['params'].get('shards', [None])) <= set(sharding.request_shards()):
+        return False
+    return user.role in ['Supervisor', 'Commercial Engineer'] or job['params']['staff_id'] == user.id
+
+def _job_response(job_id, status, params):
+    return {
+        'job_id': job_id,
+        'status': status,
+        'format': params['format'],
+        'status_url': url_for('exports.get_export', job_id=job_id),
+        'download_url': url_for('exports.download_export', job_id=job_id)
+    }
+
+@exports_bp.route('/exports', methods=['POST'])
+def create_export():
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    args = {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+    try:
+        params = normalize_export_params(args, user)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    job_id, status = submit_export(params, user)
+    response = jsonify(_job_response(job_id, status, params))
+    if status == 'done':
+        return response
+    response.status_code = 202
+    response.headers['Location'] = url_for('exports.get_export', job_id=job_id)
+    response.headers['Retry-After'] = '2'
+    return response
+
+@exports_bp.route('/exports/<job_id>', methods=['GET'])
+def get_export(job_id):
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    job = read_job(job_id) if JOB_ID.match(job_id) else None
+    if job is None or not _can_access(user, job):
+        return jsonify({'error': 'Export not found'}), 404
+
+    data = _job_response(job_id, job['status'], job['params'])
+    data.update({'params': job['params'], 'created_at': job['created_at']})
+    for key in ('size', 'error'):
+        if key in job:
+            data[key] = job[key]
+    return jsonify(data)
+
+@exports_bp.route('/exports/<job_id>/download', methods=['GET'])
+def download_export(job_id):
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    job = read_job(job_id) if JOB_ID.match(job_id) else None
+    if job is None or not _can_access(user, job):
+        return jsonify({'error': 'Export not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Export is {job['status']}", 'status': job['status']}), 409
+
+    format_type = job['params']['format']
+    path = _result_path(job_id, format_type)
+    # Downloads count as use for the least-recently-used eviction
+    os.utime(path)
+    return send_file(
+        path,
+        mimetype=EXPORT_MIMETYPES[format_type],
+        as_attachment=True,
+        download_name=export_filename(format_type, datetime.fromisoformat(job['created_at']))
+    )
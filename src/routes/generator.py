@@ -0,0 +1,328 @@
+import os
+import time
+import random
+import tempfile
+from bisect import bisect_right
+from itertools import accumulate
+from datetime import datetime, date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import click
+from flask import Blueprint
+from sqlalchemy import create_engine, event, func, insert, select
+from werkzeug.security import generate_password_hash
+from src.models.user import User, Report, Anomaly, Escalation, anomaly_types, bulk_writes, db
+
+generator_bp = Blueprint('generate', __name__, cli_group='generate')
+
+# Weighted distributions observed in the field; weights need not sum to one
+ANOMALY_TYPES = [
+    ('Meter Not Accessible', 30), ('Faulty Meter', 18), ('Dog on Premises', 12),
+    ('Meter Tampering', 10), ('Illegal Connection', 8), ('Broken Seal', 8),
+    ('Meter Not Found', 6), ('Damaged Display', 5), ('Reverse Reading', 3)
+]
+
+REASONS_NOT_ATTAINED = [
+    ('Locked gates', 30), ('Customer absent', 20), ('Heavy rain', 15), ('Impassable road', 10),
+    ('Vehicle breakdown', 8), ('Insecure area', 7), ('Meter not accessible', 10)
+]
+
+def _cumulative(choices):
+    values, weights = zip(*choices)
+    return values, list(accumulate(weights))
+
+def _pick(rng_random, values, cumulative):
+    # Equivalent to random.choices(values, cum_weights=...)[0] without its per-call setup
+    return values[bisect_right(cumulative, rng_random() * cumulative[-1])]
+
+REPORT_COLUMNS = ('id', 'itin', 'report_date', 'percentage_attained', 'reasons_not_attained',
+                  'staff_id', 'timestamp', 'status', 'notes_comments')
+ANOMALY_COLUMNS = ('id', 'report_id', 'type_id', 'description', 'timestamp', 'escalation_flag',
+                   'assigned_to_id', 'resolution_status', 'staff_id', 'current_escalation_id')
+# Generated history counts as notified when it was escalated, with no notice due
+ESCALATION_COLUMNS = ('id', 'anomaly_id', 'escalation_timestamp', 'escalated_to_id', 'resolution_status',
+                      'notified_at', 'notify_attempts', 'next_notify_at')
+
+def _sqlite_bulk_pragmas(engine):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA synchronous=OFF')
+        # Leaving WAL needs the database to itself, and the app holds connections to it
+        if cursor.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+            cursor.execute('PRAGMA journal_mode=MEMORY')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        # Room for the report indexes, which are written in random order, and the catch-up after the load
+        cursor.execute('PRAGMA cache_size=-65536')
+        cursor.close()
+
+def bulk_insert(conn, table, columns, rows):
+    """executemany of positional tuples; on SQLite this skips Core's per-value bind processing"""
+    if not rows:
+        return
+    if conn.dialect.name == 'sqlite':
+        placeholders = ', '.join('?' for _ in columns)
+        conn.exec_driver_sql(f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+    else:
+        conn.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+
+def timestamp_text(value):
+    # Same text layout SQLAlchemy uses for DateTime columns on SQLite
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+def generate_partition(url, readers, escalation_target_ids, anomaly_type_ids, start_date, days, reports_per_day,
+                       anomaly_rate, escalation_rate, seed, batch_size, id_offsets):
+    """Generate and insert reports, anomalies and escalations for a slice of readers
+
+    `readers` is a list of (reader_index, staff_id) pairs and `anomaly_type_ids` maps the
+    names in ANOMALY_TYPES to their ids in the target database. Every reader draws from its own
+    random stream seeded by (seed, reader_index), so the data does not depend on how readers
+    are split across processes. Rows get explicit ids starting after `id_offsets`.
+    """
+    engine = create_engine(url)
+    if engine.dialect.name == 'sqlite':
+        _sqlite_bulk_pragmas(engine)
+
+    report_table = Report.__table__
+    anomaly_table = Anomaly.__table__
+    escalation_table = Escalation.__table__
+    type_ids, type_weights = _cumulative([(anomaly_type_ids[name], weight) for name, weight in ANOMALY_TYPES])
+    reasons, reason_weights = _cumulative(REASONS_NOT_ATTAINED)
+
+    report_id, anomaly_id, escalation_id = id_offsets
+    reports, anomalies, escalations = [], [], []
+    counts = {'reports': 0, 'anomalies': 0, 'escalations': 0}
+    today = date.today()
+    calendar = [start_date + timedelta(days=day) for day in range(days)]
+    day_strings = [d.isoformat() for d in calendar]
+
+    if engine.dialect.name == 'sqlite':
+        # Partition files are created fresh; the target database already has the schema
+        with engine.begin() as conn:
+            db.metadata.create_all(conn, tables=[report_table, anomaly_table, escalation_table])
+
+    # The change log and itinerary statistics are caught up once, after the last batch
+    with engine.begin() as conn, bulk_writes(conn):
+        def flush():
+            bulk_insert(conn, report_table, REPORT_COLUMNS, reports)
+            bulk_insert(conn, anomaly_table, ANOMALY_COLUMNS, anomalies)
+            bulk_insert(conn, escalation_table, ESCALATION_COLUMNS, escalations)
+            counts['reports'] += len(reports)
+            counts['anomalies'] += len(anomalies)
+            counts['escalations'] += len(escalations)
+            reports.clear()
+            anomalies.clear()
+            escalations.clear()
+
+        for reader_index, staff_id in readers:
+            rng = random.Random(seed * 1000003 + reader_index)
+            random_ = rng.random
+            gauss = rng.gauss
+            skill = rng.uniform(78, 97)
+            spread = rng.uniform(3, 12)
+            zone = rng.randint(1, 400)
+            itins = [f'{zone:03d}-{rng.randint(1, 9999):04d}' for _ in range(rng.randint(4, 20))]
+
+            for day, report_date in enumerate(calendar):
+                weekday = report_date.weekday()
+                # Sundays are mostly off, Saturdays half staffed
+                if weekday == 6 and random_() < 0.9 or weekday == 5 and random_() < 0.5:
+                    continue
+                age = (today - report_date).days
+                day_string = day_strings[day]
+
+                for n in range(reports_per_day):
+                    report_id += 1
+                    # Reports are submitted between 14:00 and 20:00
+                    seconds = int(random_() * 21600)
+                    submitted = f'{day_string} {14 + seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}.000000'
+                    percentage = gauss(skill, spread)
+                    percentage = 100.0 if percentage >= 100 else round(max(percentage, 5.0), 1)
+                    if age > 14:
+                        status = 'Approved' if random_() < 0.85 else 'Reviewed'
+                    else:
+                        status = 'Pending' if random_() < 0.7 else 'Reviewed'
+                    reports.append((
+                        report_id,
+                        itins[(day * reports_per_day + n) % len(itins)],
+                        day_string,
+                        percentage,
+                        _pick(random_, reasons, reason_weights) if percentage < 100 else None,
+                        staff_id,
+                        submitted,
+                        status,
+                        ''
+                    ))
+
+                    if random_() >= anomaly_rate:
+                        continue
+
+                    anomaly_id += 1
+                    escalated = bool(escalation_target_ids) and random_() < escalation_rate
+                    if age > 30:
+                        resolution = 'Resolved' if random_() < 0.9 else 'Open'
+                    else:
+                        resolution = 'Open' if random_() < 0.6 else 'Resolved'
+                    type_id = _pick(random_, type_ids, type_weights)
+
+                    current_escalation_id = None
+                    if escalated:
+                        # Chains climb through the escalation targets; only the last step is still live
+                        steps = rng.randint(1, len(escalation_target_ids))
+                        escalated_at = datetime.strptime(submitted, '%Y-%m-%d %H:%M:%S.%f') + timedelta(days=4)
+                        for step in range(steps):
+                            escalation_id += 1
+                            last = step == steps - 1
+                            escalated_text = timestamp_text(escalated_at)
+                            escalations.append((
+                                escalation_id,
+                                anomaly_id,
+                                escalated_text,
+                                escalation_target_ids[step],
+                                (resolution if resolution == 'Resolved' else 'Pending') if last else 'Escalated',
+                                escalated_text,
+                                0,
+                                None
+                            ))
+                            escalated_at += timedelta(days=rng.randint(1, 4))
+                        current_escalation_id = escalation_id
+
+                    anomalies.append((
+                        anomaly_id,
+                        report_id,
+                        type_id,
+                        'Generated anomaly',
+                        submitted,
+                        escalated,
+                        None,
+                        resolution,
+                        staff_id,
+                        current_escalation_id
+                    ))
+
+                if len(reports) >= batch_size:
+                    flush()
+
+        flush()
+
+    engine.dispose()
+    return counts
+
+def _max_ids(conn):
+    return tuple(
+        conn.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar()
+        for table in (Report.__table__, Anomaly.__table__, Escalation.__table__)
+    )
+
+def _merge_partition(conn, path):
+    """Append a partition file to the target SQLite database, shifting its ids past the existing rows"""
+    report_offset, anomaly_offset, escalation_offset = _max_ids(conn)
+    shifts = {
+        'report': {'id': report_offset},
+        'anomaly': {'id': anomaly_offset, 'report_id': report_offset, 'current_escalation_id': escalation_offset},
+        'escalation': {'id': escalation_offset, 'anomaly_id': anomaly_offset}
+    }
+    conn.exec_driver_sql('ATTACH DATABASE ? AS part', (path,))
+    try:
+        with bulk_writes(conn):
+            for name, columns in (('report', REPORT_COLUMNS), ('anomaly', ANOMALY_COLUMNS), ('escalation', ESCALATION_COLUMNS)):
+                expressions = [f'{c} + {int(shifts[name][c])}' if c in shifts[name] else c for c in columns]
+                conn.exec_driver_sql(
+                    f"INSERT INTO main.{name} ({', '.join(columns)}) "
+                    f"SELECT {', '.join(expressions)} FROM part.{name} ORDER BY id"
+                )
+        conn.commit()
+    finally:
+        conn.exec_driver_sql('DETACH DATABASE part')
+
+def create_generated_users(readers, supervisors, engineers):
+    """Insert generated staff with Core, returning (reader ids, escalation target ids)"""
+    user_table = User.__table__
+    # Password hashing is deliberately slow; every generated account shares the same PIN and answer
+    pin_hash = generate_password_hash('7000')
+    answer_hash = generate_password_hash('generated')
+    now = datetime.utcnow()
+
+    staff = [(f'7{i:06d}', 'Meter Reader') for i in range(readers)]
+    staff += [(f'71{i:05d}', 'Supervisor') for i in range(supervisors)]
+    staff += [(f'72{i:05d}', 'Commercial Engineer') for i in range(engineers)]
+
+    existing = set(db.session.execute(select(user_table.c.staff_number)).scalars())
+    rows = [{
+        'staff_number': staff_number,
+        'role': role,
+        'pin_hash': pin_hash,
+        'security_question': 'What is your staff number?',
+        'security_answer_hash': answer_hash,
+        'created_at': now
+    } for staff_number, role in staff if staff_number not in existing]
+    if rows:
+        db.session.execute(insert(user_table), rows)
+        db.session.commit()
+
+    ids = dict(db.session.execute(
+        select(user_table.c.staff_number, user_table.c.id).where(user_table.c.staff_number.in_([s for s, _ in staff]))
+    ).all())
+    reader_ids = [ids[s] for s, role in staff if role == 'Meter Reader']
+    # Escalation chains go supervisor first, then commercial engineer
+    targets = [ids[s] for s, role in staff if role == 'Supervisor'][:1] + [ids[s] for s, role in staff if role == 'Commercial Engineer'][:1]
+    return reader_ids, targets
+
+@generator_bp.cli.command('data')
+@click.option('--readers', default=200, show_default=True, help='Number of meter readers to generate.')
+@click.option('--supervisors', default=5, show_default=True)
+@click.option('--engineers', default=2, show_default=True)
+@click.option('--days', default=365, show_default=True, help='Days of history, ending today.')
+@click.option('--reports-per-day', default=3, show_default=True, help='Reports per reader per working day.')
+@click.option('--anomaly-rate', default=0.08, show_default=True, help='Probability that a report raises an anomaly.')
+@click.option('--escalation-rate', default=0.25, show_default=True, help='Probability that an anomaly is escalated.')
+@click.option('--seed', default=1, show_default=True, help='Random seed; the same seed always yields the same data.')
+@click.option('--workers', default=1, show_default=True, help='Processes generating partitions in parallel.')
+@click.option('--batch-size', default=20000, show_default=True, help='Reports per bulk insert.')
+def generate_data(readers, supervisors, engineers, days, reports_per_day, anomaly_rate, escalation_rate,
+                  seed, workers, batch_size):
+    """Bulk-load a large synthetic dataset with Core inserts."""
+    started = time.perf_counter()
+    reader_ids, targets = create_generated_users(readers, supervisors, engineers)
+    type_ids = anomaly_types.ensure(name for name, _ in ANOMALY_TYPES)
+    url = db.engine.url.render_as_string(hide_password=False)
+    start_date = date.today() - timedelta(days=days - 1)
+    reader_slices = list(enumerate(reader_ids))
+    params = (targets, type_ids, start_date, days, reports_per_day, anomaly_rate, escalation_rate, seed, batch_size)
+
+    if workers <= 1:
+        with db.engine.connect() as conn:
+            offsets = _max_ids(conn)
+        counts = generate_partition(url, reader_slices, *params, offsets)
+    elif db.engine.dialect.name != 'sqlite':
+        raise click.UsageError('--workers > 1 is only supported on SQLite')
+    else:
+        # SQLite has a single writer, so each process fills its own partition file,
+        # and the partitions are appended to the target in reader order afterwards
+        chunk = -(-len(reader_slices) // workers)
+        partitions = [reader_slices[i:i + chunk] for i in range(0, len(reader_slices), chunk)]
+        workdir = tempfile.mkdtemp(prefix='generate-')
+        paths = [os.path.join(workdir, f'part{i}.db') for i in range(len(partitions))]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(generate_partition, f'sqlite:///{path}', part, *params, (0, 0, 0))
+                for path, part in zip(paths, partitions)
+            ]
+            results = [f.result() for f in futures]
+        generated_at = time.perf_counter()
+        click.echo(f'Generated {len(partitions)} partitions in {generated_at - started:.1f}s, merging')
+
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA synchronous=OFF')
+            for path in paths:
+                _merge_partition(conn, path)
+        for path in paths:
+            os.remove(path)
+        os.rmdir(workdir)
+        counts = {key: sum(r[key] for r in results) for key in results[0]}
+
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    click.echo(
+        f"Inserted {counts['reports']} reports, {counts['anomalies']} anomalies and "
+        f"{counts['escalations']} escalations in {elapsed:.1f}s ({total / elapsed:,.0f} rows/sec)"
+    )
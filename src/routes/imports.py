@@ -0,0 +1,514 @@
+import os
+import csv
+import json
+import time
+import hashlib
+from datetime import datetime, date
+from functools import partial
+import click
+import jwt
+from flask import Blueprint, current_app, jsonify, request, url_for
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+from src.models.user import User, Report, DataVersion, bulk_writes, bump_data_version, db
+from src.models import sharding
+from src.routes.generator import bulk_insert, timestamp_text
+from src.routes.exports import JOB_ID, worker_app
+from src.utils import process_pool
+
+imports_bp = Blueprint('imports', __name__, cli_group='import')
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+IMPORT_DIR = os.environ.get('IMPORT_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'imports'))
+# Rows per transaction in each shard
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '20000'))
+# Rejected rows listed in the job; the rest are only counted
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', '1000'))
+# A job whose progress has not moved for this long is considered dead and may be resumed
+IMPORT_JOB_TIMEOUT = int(os.environ.get('IMPORT_JOB_TIMEOUT', '600'))
+IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', str(512 * 1024 * 1024)))
+
+EXTENSIONS = {'excel': 'xlsx', 'csv': 'csv'}
+# Columns written by download_reports; ID is ignored, imported reports get new ids
+IMPORT_COLUMNS = ('itin', 'report_date', 'percentage_attained', 'reasons_not_attained', 'staff_id', 'timestamp', 'status', 'notes_comments')
+REQUIRED_HEADERS = ('ITIN', 'Report Date', 'Percentage Attained', 'Staff Number')
+
+def get_user_from_token(token):
+    try:
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        user_id = payload['user_id']
+        return User.query.get(user_id)
+    except:
+        return None
+
+def _job_path(job_id, suffix):
+    return os.path.join(IMPORT_DIR, f'{job_id}.{suffix}')
+
+def checkpoint_name(job_id):
+    """DataVersion entry holding the last source row of the job committed to a shard"""
+    return f'import:{job_id}'
+
+def read_rows(path, format_type):
+    """(row number, {header: value}) for every data row of a spreadsheet, read as a stream
+
+    Row numbers are those a spreadsheet shows, so the header is row 1.
+    """
+    if format_type == 'excel':
+        # Imported on the first Excel import only; CSV imports never need it
+        try:
+            import openpyxl
+        except ImportError:
+            raise ValueError('Excel imports need openpyxl installed')
+        # Read-only mode parses the sheet lazily instead of loading the whole workbook
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            headers = [str(h).strip() if h is not None else '' for h in next(rows, ())]
+            _check_headers(headers)
+            for number, values in enumerate(rows, start=2):
+                if any(value not in (None, '') for value in values):
+                    yield number, dict(zip(headers, values))
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            rows = csv.reader(f)
+            headers = [h.strip() for h in next(rows, ())]
+            _check_headers(headers)
+            for number, values in enumerate(rows, start=2):
+                if any(values):
+                    yield number, dict(zip(headers, values))
+
+def check_spreadsheet(path, format_type):
+    """Raise ValueError unless the file opens and has the required columns"""
+    rows = read_rows(path, format_type)
+    try:
+        next(rows, None)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise ValueError(str(e))
+    except Exception:
+        raise ValueError('Not a readable Excel workbook')
+    finally:
+        rows.close()
+
+def _check_headers(headers):
+    missing = [h for h in REQUIRED_HEADERS if h not in headers]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def _datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+def parse_row(values, staff):
+    """(region, insert tuple in IMPORT_COLUMNS order) for a spreadsheet row, or raise ValueError
+
+    `staff` maps staff numbers to (user id, region).
+    """
+    itin = _text(values.get('ITIN'))
+    if not itin or len(itin) > 50:
+        raise ValueError('ITIN is required and at most 50 characters')
+
+    # Excel cells may hold real dates; CSV cells are always text
+    report_date = values.get('Report Date')
+    if not isinstance(report_date, date):
+        report_date = _text(report_date)
+    try:
+        report_date = _date(report_date)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid Report Date. Use YYYY-MM-DD')
+
+    try:
+        percentage = float(values.get('Percentage Attained'))
+    except (TypeError, ValueError):
+        raise ValueError('Percentage Attained must be a number')
+    if not 0 <= percentage <= 100:
+        raise ValueError('Percentage Attained must be between 0 and 100')
+
+    staff_number = _text(values.get('Staff Number'))
+    if staff_number not in staff:
+        raise ValueError(f'Unknown Staff Number {staff_number}')
+    staff_id, region = staff[staff_number]
+
+    timestamp = values.get('Timestamp')
+    if not isinstance(timestamp, date):
+        timestamp = _text(timestamp)
+    try:
+        timestamp = _datetime(timestamp) if timestamp else datetime.utcnow()
+    except (TypeError, ValueError):
+        raise ValueError('Invalid Timestamp. Use YYYY-MM-DD HH:MM:SS')
+
+    status = _text(values.get('Status')) or 'Pending'
+    if len(status) > 20:
+        raise ValueError('Status is at most 20 characters')
+
+    return sharding.shard_of(region), (
+        itin, report_date.isoformat(), percentage, _text(values.get('Reasons Not Attained')), staff_id,
+        timestamp_text(timestamp), status, _text(values.get('Notes/Comments')) or ''
+    )
+
+def import_reports(path, format_type, job_id, state=None, progress=None, batch_size=None):
+    """Stream a spreadsheet of reports into the database; call inside an app context
+
+    Rows are validated as they are read and inserted in batches, one transaction per shard
+    and batch. Each transaction also records the last source row it covers in that
+    shard's DataVersion entry for the job, so running the same job again after an
+    interruption skips what was committed and inserts every row exactly once.
+
+    `state` is the progress of an earlier run, if any: rows up to its `position` were
+    already handled, and its counts and errors carry over. `progress(state)` is called
+    after every batch. Returns the final state.
+    """
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    state = dict(state or {})
+    state.setdefault('position', 0)
+    for key in ('rows', 'inserted', 'failed'):
+        state.setdefault(key, 0)
+    state.setdefault('errors', [])
+
+    staff = {
+        staff_number: (staff_id, region)
+        for staff_number, staff_id, region in db.session.execute(select(User.staff_number, User.id, User.region))
+    }
+    db.session.remove()
+
+    name = checkpoint_name(job_id)
+    shards = sharding.all_shards()
+    checkpoints = {}
+    for region in shards:
+        with sharding.engine(region).connect() as conn:
+            checkpoints[region] = conn.execute(
+                select(DataVersion.version).where(DataVersion.name == name)
+            ).scalar() or 0
+    pending = {region: [] for region in shards}
+
+    def reject(number, message):
+        state['failed'] += 1
+        if len(state['errors']) < IMPORT_MAX_ERRORS:
+            state['errors'].append({'row': number, 'error': message})
+
+    def flush(position):
+        for region, rows in pending.items():
+            if rows:
+                state['inserted'] += insert_batch(region, rows, name, position, reject)
+                rows.clear()
+        state['position'] = position
+        if progress:
+            progress(state)
+
+    count = 0
+    number = state['position']
+    for number, values in read_rows(path, format_type):
+        if number <= state['position']:
+            continue
+        state['rows'] += 1
+        try:
+            region, row = parse_row(values, staff)
+        except ValueError as e:
+            reject(number, str(e))
+            continue
+        # Committed to its shard by a run that stopped before recording its position
+        if number <= checkpoints[region]:
+            state['inserted'] += 1
+            continue
+        pending[region].append((number, row))
+        count += 1
+        if count >= batch_size:
+            flush(number)
+            count = 0
+    flush(max(number, state['position']))
+    return state
+
+def insert_batch(region, rows, name, position, reject):
+    """Insert (row number, values) pairs in one transaction of `region`'s shard, with the checkpoint
+
+    If the batch fails, it is retried row by row, so a bad row only fails itself.
+    Returns the number of rows inserted.
+    """
+    table = Report.__table__
+    engine = sharding.engine(region)
+
+    def checkpoint(conn):
+        versions = DataVersion.__table__
+        if conn.execute(versions.update().where(versions.c.name == name).values(version=position)).rowcount == 0:
+            conn.execute(versions.insert().values(name=name, version=position))
+        bump_data_version(conn, 'report')
+
+    try:
+        with engine.begin() as conn, bulk_writes(conn):
+            bulk_insert(conn, table, IMPORT_COLUMNS, [row for _, row in rows])
+            checkpoint(conn)
+        return len(rows)
+    except DBAPIError:
+        pass
+
+    inserted = 0
+    with engine.begin() as conn, bulk_writes(conn):
+        for number, row in rows:
+            try:
+                with conn.begin_nested():
+                    bulk_insert(conn, table, IMPORT_COLUMNS, [row])
+                inserted += 1
+            except DBAPIError as e:
+                reject(number, str(e.orig))
+        checkpoint(conn)
+    return inserted
+
+def read_job(job_id):
+    """Metadata and progress of an import, or None if it is unknown"""
+    try:
+        with open(_job_path(job_id, 'json')) as f:
+            job = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    lock = _job_path(job_id, 'lock')
+    error = _job_path(job_id, 'error')
+    if job.get('finished_at'):
+        job['status'] = 'done'
+    elif os.path.exists(error):
+        job['status'] = 'failed'
+        with open(error) as f:
+            job['error'] = f.read()
+    elif os.path.exists(lock) and time.time() - os.path.getmtime(lock) < IMPORT_JOB_TIMEOUT:
+        job['status'] = 'running'
+    else:
+        # Submitting the same file again resumes it
+        job['status'] = 'interrupted'
+    return job
+
+def _write_job(job_id, job):
+    temporary = f"{_job_path(job_id, 'json')}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(job, f, default=str)
+    os.replace(temporary, _job_path(job_id, 'json'))
+
+def run_import(job_id, batch_size=None):
+    """Run or resume an import job; call inside an app context. Returns its final state"""
+    job = {key: value for key, value in read_job(job_id).items() if key not in ('status', 'error')}
+    path = _job_path(job_id, EXTENSIONS[job['format']])
+    lock = _job_path(job_id, 'lock')
+    started = time.perf_counter()
+    seconds = job.get('seconds', 0)
+
+    def progress(state):
+        job.update(state)
+        job['seconds'] = round(seconds + time.perf_counter() - started, 1)
+        _write_job(job_id, job)
+        # The lock's age tells readers the job is still alive
+        if os.path.exists(lock):
+            os.utime(lock)
+
+    state = import_reports(path, job['format'], job_id, job, progress, batch_size)
+    job.update(state)
+    job['finished_at'] = datetime.utcnow().isoformat()
+    job['seconds'] = round(seconds + time.perf_counter() - started, 1)
+    _write_job(job_id, job)
+    os.remove(path)
+    return job
+
+def build_import(database_url, shards, job_id):
+    """Runs in a pool process: the import job, with the app the exports use"""
+    with worker_app(database_url, shards).app_context():
+        return run_import(job_id)['inserted']
+
+def _finish_job(job_id, future):
+    exc = future.exception()
+    if exc is not None:
+        with open(_job_path(job_id, 'error'), 'w') as f:
+            f.write(str(exc) or exc.__class__.__name__)
+    try:
+        os.remove(_job_path(job_id, 'lock'))
+    except FileNotFoundError:
+        pass
+
+def store_upload(stream, format_type, filename, user_id):
+    """Save an uploaded spreadsheet under its content hash; returns the job id
+
+    The same file always maps to the same job, which is what lets an upload resume.
+    """
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    temporary = os.path.join(IMPORT_DIR, f'upload.{os.getpid()}.{time.monotonic_ns()}.tmp')
+    try:
+        with open(temporary, 'wb') as f:
+            while True:
+                chunk = stream.read(1024 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > IMPORT_MAX_BYTES:
+                    raise ValueError(f'File is larger than {IMPORT_MAX_BYTES} bytes')
+                digest.update(chunk)
+                f.write(chunk)
+        check_spreadsheet(temporary, format_type)
+        job_id = digest.hexdigest()[:32]
+        # A finished job keeps only its record
+        if (read_job(job_id) or {}).get('status') != 'done':
+            os.replace(temporary, _job_path(job_id, EXTENSIONS[format_type]))
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+    if read_job(job_id) is None:
+        _write_job(job_id, {
+            'job_id': job_id, 'format': format_type, 'filename': filename, 'size': size,
+            'requested_by': user_id, 'created_at': datetime.utcnow().isoformat()
+        })
+    return job_id
+
+def submit_import(job_id):
+    """Start or resume the job unless it is running or done; returns its status"""
+    job = read_job(job_id)
+    if job['status'] in ('done', 'running'):
+        return job['status']
+    lock = _job_path(job_id, 'lock')
+    try:
+        os.remove(lock)
+    except FileNotFoundError:
+        pass
+    try:
+        # The lock file is the coalescing point for every thread and worker process
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return 'running'
+    if os.path.exists(_job_path(job_id, 'error')):
+        os.remove(_job_path(job_id, 'error'))
+
+    future = process_pool.submit(
+        build_import, current_app.config['SQLALCHEMY_DATABASE_URI'], current_app.config['DATABASE_SHARDS'], job_id
+    )
+    future.add_done_callback(partial(_finish_job, job_id))
+    return 'running'
+
+def _job_response(job):
+    data = {key: job.get(key) for key in (
+        'job_id', 'status', 'format', 'filename', 'created_at', 'finished_at', 'position', 'rows', 'inserted', 'failed', 'errors', 'error'
+    ) if key in job}
+    data['status_url'] = url_for('imports.get_import', job_id=job['job_id'])
+    return data
+
+def _format_of(filename, requested):
+    format_type = str(requested or '').lower()
+    if not format_type:
+        format_type = 'excel' if filename.lower().endswith('.xlsx') else 'csv'
+    if format_type not in EXTENSIONS:
+        raise ValueError('Invalid format. Use excel or csv')
+    return format_type
+
+@imports_bp.route('/reports/import', methods=['POST'])
+def create_import():
+    """Upload a spreadsheet in the download_reports layout as multipart `file` and import it in the background
+
+    Uploading the same file again returns its job, resuming it if it was interrupted.
+    """
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        return jsonify({'error': 'Permission denied'}), 403
+
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': 'A spreadsheet is required as multipart field "file"'}), 400
+
+    try:
+        format_type = _format_of(upload.filename or '', request.args.get('format'))
+        job_id = store_upload(upload.stream, format_type, upload.filename, user.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    status = submit_import(job_id)
+    response = jsonify(_job_response({**read_job(job_id), 'status': status}))
+    if status == 'done':
+        return response
+    response.status_code = 202
+    response.headers['Location'] = url_for('imports.get_import', job_id=job_id)
+    response.headers['Retry-After'] = '2'
+    return response
+
+@imports_bp.route('/reports/import/<job_id>', methods=['GET'])
+def get_import(job_id):
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        return jsonify({'error': 'Permission denied'}), 403
+
+    job = read_job(job_id) if JOB_ID.match(job_id) else None
+    if job is None:
+        return jsonify({'error': 'Import not found'}), 404
+    return jsonify(_job_response(job))
+
+@imports_bp.cli.command('reports')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format_type', type=click.Choice(sorted(EXTENSIONS)), help='Default: from the file extension.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Rows per transaction.')
+@click.option('--force', is_flag=True, help='Resume even if the job looks running, e.g. after its process was killed.')
+def import_reports_command(path, format_type, batch_size, force):
+    """Import a CSV or Excel file of reports in the download_reports layout.
+
+    Running it again on the same file resumes an interrupted import.
+    """
+    try:
+        format_type = _format_of(path, format_type)
+        with open(path, 'rb') as f:
+            job_id = store_upload(f, format_type, os.path.basename(path), None)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    job = read_job(job_id)
+    if job['status'] == 'done':
+        click.echo(f"Already imported as job {job_id}: {job['inserted']} reports inserted, {job['failed']} rejected")
+        return
+    if job['status'] == 'running' and not force:
+        raise click.UsageError(f'Job {job_id} is already running; pass --force if its process is gone')
+
+    lock = _job_path(job_id, 'lock')
+    with open(lock, 'w'):
+        pass
+    try:
+        if job.get('position'):
+            click.echo(f"Resuming job {job_id} after row {job['position']}")
+        job = run_import(job_id, batch_size)
+    finally:
+        os.remove(lock)
+
+    for error in job['errors'][:20]:
+        click.echo(f"Row {error['row']}: {error['error']}", err=True)
+    click.echo(
+        f"Job {job_id}: {job['inserted']} reports inserted, {job['failed']} rejected "
+        f"in {job['seconds']}s ({job['rows'] / max(job['seconds'], 0.1) * 60:,.0f} rows/min)"
+    )
@@ -0,0 +1,225 @@
+import os
+import base64
+import binascii
+from datetime import date, datetime
+from itertools import chain
+import jwt
+from flask import Blueprint, jsonify, request
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import joinedload
+from src.models.user import User, Report, ItinStat, ItinReader, db
+from src.models import sharding
+
+itineraries_bp = Blueprint('itineraries', __name__)
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+# Itineraries or history reports per page; ?limit= can ask for up to the maximum
+ITINS_PAGE_SIZE = int(os.environ.get('ITINS_PAGE_SIZE', '50'))
+ITINS_MAX_PAGE_SIZE = int(os.environ.get('ITINS_MAX_PAGE_SIZE', '1000'))
+
+def get_user_from_token(token):
+    try:
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        user_id = payload['user_id']
+        return User.query.get(user_id)
+    except:
+        return None
+
+def encode_cursor(*values):
+    """Opaque keyset position from the sort key of the last item on a page"""
+    return base64.urlsafe_b64encode('|'.join(str(value) for value in values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, parts=2):
+    """The `parts` values of a cursor; values a shorter, older cursor lacks are None"""
+    if not cursor:
+        return None
+    try:
+        values = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|', parts - 1)
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError('Malformed cursor')
+    if len(values) < 2:
+        raise ValueError('Malformed cursor')
+    return (*values, *[None] * (parts - len(values)))
+
+def page_limit(args):
+    limit = min(int(args.get('limit', ITINS_PAGE_SIZE)), ITINS_MAX_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return limit
+
+@itineraries_bp.route('/itins', methods=['GET'])
+def rank_itineraries():
+    """Itineraries ranked by mean percentage attained, worst first (or ?order=best)"""
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        return jsonify({'error': 'Permission denied'}), 403
+
+    best_first = request.args.get('order', 'worst') == 'best'
+    try:
+        limit = page_limit(request.args)
+        min_reports = int(request.args.get('min_reports', 1))
+        after = decode_cursor(request.args.get('cursor'))
+        if after is not None:
+            after = (float(after[0]), after[1])
+    except ValueError:
+        return jsonify({'error': 'Invalid limit, min_reports or cursor'}), 400
+
+    if len(sharding.request_shards()) > 1:
+        ranked = rank_across_shards(best_first, min_reports, after)
+    else:
+        ranked = rank_in_shard(best_first, min_reports, after, limit)
+    response = jsonify([stat for stat, _ in ranked[:limit]])
+    if len(ranked) > limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(*ranked[limit - 1][1])
+    return response
+
+def rank_in_shard(best_first, min_reports, after, limit):
+    """(statistics, sort key) of the next page of the current shard's itineraries, and one more
+
+    The keyset on (mean, itin) runs on the ix_itin_stat_mean_itin index; the unrounded
+    mean is kept alongside as the sort key.
+    """
+    mean, itin = ItinStat.mean_percentage, ItinStat.itin
+    query = ItinStat.query
+    if min_reports > 1:
+        query = query.filter(ItinStat.report_count >= min_reports)
+    if best_first:
+        if after is not None:
+            query = query.filter(or_(mean < after[0], and_(mean == after[0], itin < after[1])))
+        query = query.order_by(mean.desc(), itin.desc())
+    else:
+        if after is not None:
+            query = query.filter(or_(mean > after[0], and_(mean == after[0], itin > after[1])))
+        query = query.order_by(mean, itin)
+    return [(stat.to_dict(), (stat.mean_percentage, stat.itin)) for stat in query.limit(limit + 1)]
+
+def rank_across_shards(best_first, min_reports, after):
+    """(statistics, sort key) of every itinerary past `after`, combined over the shards, in rank order
+
+    An itinerary read in several regions has partial statistics in each shard, and its
+    rank depends on all of them, so every shard's statistics are loaded and combined
+    before sorting; min_reports applies to the combined count.
+    """
+    columns = select(
+        ItinStat.itin, ItinStat.report_count, ItinStat.total_percentage, ItinStat.min_percentage,
+        ItinStat.max_percentage, ItinStat.first_report_date, ItinStat.last_report_date
+    )
+    by_itin = {}
+    for stats in sharding.fan_out(lambda: db.session.execute(columns).all()):
+        for stat in stats:
+            by_itin.setdefault(stat.itin, []).append(stat)
+
+    ranked = []
+    for itin, parts in by_itin.items():
+        combined = _combine_stats(parts)
+        if combined['report_count'] < min_reports:
+            continue
+        key = (sum(stat.total_percentage for stat in parts) / combined['report_count'], itin)
+        if after is None or (key < after if best_first else key > after):
+            ranked.append((combined, key))
+    ranked.sort(key=lambda item: item[1], reverse=best_first)
+    return ranked
+
+def _combine_stats(parts):
+    """One itinerary's statistics from the shards that have reports for it"""
+    parts = [stat for stat in parts if stat is not None]
+    if not parts:
+        return None
+    count = sum(stat.report_count for stat in parts)
+    return {
+        'itin': parts[0].itin,
+        'report_count': count,
+        'mean_percentage': round(sum(stat.total_percentage for stat in parts) / count, 2),
+        'min_percentage': min(stat.min_percentage for stat in parts),
+        'max_percentage': max(stat.max_percentage for stat in parts),
+        'first_report_date': min(stat.first_report_date for stat in parts),
+        'last_report_date': max(stat.last_report_date for stat in parts)
+    }
+
+@itineraries_bp.route('/itins/<path:itin>', methods=['GET'])
+def get_itinerary(itin):
+    """An itinerary's statistics, the staff who read it and a page of its reports, newest first
+
+    Pass X-Next-Cursor back as ?cursor= for older reports; ?start_date= and ?end_date=
+    (YYYY-MM-DD, inclusive) narrow the history.
+    """
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        return jsonify({'error': 'Permission denied'}), 403
+
+    try:
+        limit = page_limit(request.args)
+        before = decode_cursor(request.args.get('cursor'), parts=3)
+        if before is not None:
+            before = (date.fromisoformat(before[0]), int(before[1]), before[2])
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit, cursor or date'}), 400
+
+    history = Report.query.options(joinedload(Report.staff)).filter(Report.itin == itin)
+    if start_date:
+        history = history.filter(Report.report_date >= start_date)
+    if end_date:
+        history = history.filter(Report.report_date <= end_date)
+    history = history.order_by(Report.report_date.desc(), Report.id.desc())
+
+    def shard_itinerary():
+        stat = db.session.get(ItinStat, itin)
+        readers = db.session.query(ItinReader, User.staff_number).outerjoin(
+            User, User.id == ItinReader.staff_id
+        ).filter(ItinReader.itin == itin).all()
+        page = history
+        if before is not None:
+            # Where the page ended depends on the shard's name: report ids repeat across shards
+            page = page.filter(sharding.keyset_before((Report.report_date, Report.id), before))
+        reports = [report.to_dict() for report in page.with_session(db.session).limit(limit + 1)]
+        return stat, readers, reports
+
+    shards = sharding.request_shards()
+    parts = sharding.fan_out(shard_itinerary, shards)
+    sharding.tag_regions([reports for _, _, reports in parts], shards)
+    stats = _combine_stats([stat for stat, _, _ in parts])
+    if stats is None:
+        return jsonify({'error': 'Itinerary not found'}), 404
+
+    readers = [
+        {
+            'staff_id': reader.staff_id,
+            'staff_number': staff_number,
+            'report_count': reader.report_count,
+            'mean_percentage': round(reader.mean_percentage, 2),
+            'last_report_date': reader.last_report_date
+        }
+        for _, shard_readers, _ in parts for reader, staff_number in shard_readers
+    ]
+    readers.sort(key=lambda reader: (reader['report_count'], reader['last_report_date']), reverse=True)
+
+    reports = sorted(
+        chain.from_iterable(reports for _, _, reports in parts),
+        key=lambda r: (r['report_date'], r['id'], r.get('region', '')), reverse=True
+    )
+    response = jsonify({'stats': stats, 'readers': readers, 'history': reports[:limit]})
+    if len(reports) > limit:
+        last = reports[limit - 1]
+        position = [last['report_date'].isoformat(), last['id']]
+        if 'region' in last:
+            position.append(last['region'])
+        response.headers['X-Next-Cursor'] = encode_cursor(*position)
+    return response
@@ -0,0 +1,292 @@
+"""Request timing, SQL counts and /api/metrics in the Prometheus text format
+
+Each process counts the requests it serves. Under gunicorn or uvicorn with several workers,
+set METRICS_DIR to a directory the workers of one server share (gunicorn.conf.py does):
+every worker then writes its counts to a file of its own there, and /api/metrics adds up
+the files of all of them, including workers that have exited since, whichever worker
+answers the scrape. Without it, /api/metrics reports the answering process only.
+"""
+import os
+import json
+import time
+import atexit
+import random
+import cProfile
+import threading
+from datetime import datetime
+from flask import Blueprint, Response, current_app, g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Queries slower than this are logged with their statement
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+
+# Fraction of requests run under cProfile; a profile is only kept when the request is slower than the threshold
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_THRESHOLD_MS = float(os.environ.get('PROFILE_THRESHOLD_MS', '500'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'profiles'))
+
+# Directory shared by the worker processes of one server; empty keeps each process's metrics to itself
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+# Seconds between writes of a process's counts to METRICS_DIR; a scrape always writes its own first
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '1'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Counts of processes that have exited, merged into one file so the directory stays small
+EXITED_FILE = 'exited.json'
+# Per-request SQL totals live in the WSGI environ, which copies of the request context
+# pushed by sharding.fan_out threads and streamed bodies share
+SQL_TOTALS_KEY = 'metrics.sql_totals'
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_last_flush = 0.0
+_pid = os.getpid()
+# Metric name -> {label values: count, or a histogram's bucket counts, sum and count}
+_metrics = {'latency': {}, 'requests': {}, 'sql': {}, 'slow_queries': {}}
+
+class SqlTotals:
+    """Statements run and time spent in SQL by one request, from any of its threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.seconds = 0.0
+
+    def add(self, elapsed):
+        with self.lock:
+            self.count += 1
+            self.seconds += elapsed
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+    if not has_request_context():
+        return
+
+    totals = request.environ.get(SQL_TOTALS_KEY)
+    if totals is not None:
+        totals.add(elapsed)
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        route = _route_label()
+        with _lock:
+            _count('slow_queries', (route,), 1)
+        current_app.logger.warning(f"Slow query ({elapsed * 1000:.1f} ms) during {request.method} {request.path}: {statement}")
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def _count(name, key, value):
+    table = _metrics[name]
+    table[key] = _add(table.get(key), value)
+
+def _add(total, value):
+    """`total` plus `value`: numbers, lists of bucket counts or dicts of either"""
+    if total is None:
+        return json.loads(json.dumps(value))
+    if isinstance(value, dict):
+        return {name: _add(total.get(name), part) for name, part in value.items()}
+    if isinstance(value, list):
+        return [a + b for a, b in zip(total, value)]
+    return total + value
+
+def _record(route, method, status, elapsed, sql_count, sql_time):
+    global _pid
+    key = (route, method)
+    with _lock:
+        if _pid != os.getpid():
+            # A forked worker starts from nothing; what the parent counted is in its own file
+            _pid = os.getpid()
+            for table in _metrics.values():
+                table.clear()
+        _count('latency', key, {
+            'buckets': [1 if elapsed <= bound else 0 for bound in LATENCY_BUCKETS],
+            'sum': elapsed,
+            'count': 1
+        })
+        _count('requests', (route, method, str(status)), 1)
+        _count('sql', key, {'queries': sql_count, 'seconds': sql_time})
+    flush_metrics()
+
+@metrics_bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    request.environ[SQL_TOTALS_KEY] = SqlTotals()
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@metrics_bp.after_app_request
+def record_request_timing(response):
+    start = g.get('request_start')
+    totals = request.environ.get(SQL_TOTALS_KEY)
+    if start is None or totals is None:
+        return response
+
+    elapsed = time.perf_counter() - start
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        if elapsed * 1000 >= PROFILE_THRESHOLD_MS:
+            dump_profile(profiler, elapsed)
+
+    # The header goes out before a streamed body, so it covers the work done so far
+    response.headers.add(
+        'Server-Timing',
+        f'app;dur={elapsed * 1000:.1f}, sql;dur={totals.seconds * 1000:.1f};desc="{totals.count} queries"'
+    )
+
+    # The metrics are recorded once the body has been sent, so a streamed body's queries count
+    route, method, status = _route_label(), request.method, response.status_code
+    response.call_on_close(
+        lambda: _record(route, method, status, time.perf_counter() - start, totals.count, totals.seconds)
+    )
+    return response
+
+def dump_profile(profiler, elapsed):
+    """Write a cProfile dump for a slow request, loadable with pstats or snakeviz"""
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        endpoint = (request.endpoint or 'unmatched').replace('.', '_')
+        filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')}_{request.method}_{endpoint}_{elapsed * 1000:.0f}ms.prof"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+    except Exception as e:
+        current_app.logger.warning(f"Failed to write request profile: {str(e)}")
+
+def _snapshot():
+    with _lock:
+        return {name: [[list(key), value] for key, value in table.items()] for name, table in _metrics.items()}
+
+def _write_json(path, data):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+def flush_metrics(force=False):
+    """Write this process's counts to METRICS_DIR, at most every METRICS_FLUSH_SECONDS unless forced"""
+    global _last_flush
+    if not METRICS_DIR or (not force and time.monotonic() - _last_flush < METRICS_FLUSH_SECONDS):
+        return
+    if not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        _last_flush = time.monotonic()
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _write_json(os.path.join(METRICS_DIR, f'{os.getpid()}.json'), _snapshot())
+    finally:
+        _flush_lock.release()
+
+atexit.register(flush_metrics, force=True)
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _merge(totals, snapshot):
+    for name, entries in snapshot.items():
+        table = totals.setdefault(name, {})
+        for key, value in entries:
+            table[tuple(key)] = _add(table.get(tuple(key)), value)
+    return totals
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _merge_exited():
+    """Fold the files of processes that are gone into EXITED_FILE"""
+    import fcntl
+    with open(os.path.join(METRICS_DIR, 'merge.lock'), 'w') as lock:
+        # Two scrapes merging the same file would count it twice
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited_path = os.path.join(METRICS_DIR, EXITED_FILE)
+        exited = None
+        for name in os.listdir(METRICS_DIR):
+            pid, _, suffix = name.partition('.')
+            if suffix != 'json' or not pid.isdigit() or _running(int(pid)):
+                continue
+            snapshot = _read_json(os.path.join(METRICS_DIR, name))
+            if exited is None:
+                exited = _merge({}, _read_json(exited_path) or {})
+            _merge(exited, snapshot or {})
+            _write_json(exited_path, {name: [[list(key), value] for key, value in table.items()] for name, table in exited.items()})
+            os.remove(os.path.join(METRICS_DIR, name))
+
+def collect_metrics():
+    """{metric name: {label values: value}} of this process, or of every process sharing METRICS_DIR"""
+    if not METRICS_DIR:
+        return _merge({}, _snapshot())
+    flush_metrics(force=True)
+    _merge_exited()
+    totals = {}
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith('.json'):
+            _merge(totals, _read_json(os.path.join(METRICS_DIR, name)) or {})
+    return totals
+
+def _labels(**labels):
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def render_metrics():
+    """Render collected metrics in the Prometheus text exposition format"""
+    metrics = collect_metrics()
+    latency, requests, sql, slow_queries = (metrics.get(name, {}) for name in ('latency', 'requests', 'sql', 'slow_queries'))
+    lines = []
+    lines.append('# HELP http_request_duration_seconds Request wall time per route.')
+    lines.append('# TYPE http_request_duration_seconds histogram')
+    for (route, method), histogram in sorted(latency.items()):
+        # Each bucket already counts every request up to its bound, as Prometheus wants
+        for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+            lines.append(f"http_request_duration_seconds_bucket{_labels(route=route, method=method, le=bound)} {count}")
+        lines.append(f"http_request_duration_seconds_bucket{_labels(route=route, method=method, le='+Inf')} {histogram['count']}")
+        lines.append(f"http_request_duration_seconds_sum{_labels(route=route, method=method)} {histogram['sum']:.6f}")
+        lines.append(f"http_request_duration_seconds_count{_labels(route=route, method=method)} {histogram['count']}")
+
+    lines.append('# HELP http_requests_total Requests per route and status code.')
+    lines.append('# TYPE http_requests_total counter')
+    for (route, method, status), count in sorted(requests.items()):
+        lines.append(f"http_requests_total{_labels(route=route, method=method, status=status)} {count}")
+
+    lines.append('# HELP http_request_sql_queries_total SQL statements executed while serving a route.')
+    lines.append('# TYPE http_request_sql_queries_total counter')
+    for (route, method), totals in sorted(sql.items()):
+        lines.append(f"http_request_sql_queries_total{_labels(route=route, method=method)} {totals['queries']}")
+
+    lines.append('# HELP http_request_sql_seconds_total Time spent in SQL while serving a route.')
+    lines.append('# TYPE http_request_sql_seconds_total counter')
+    for (route, method), totals in sorted(sql.items()):
+        lines.append(f"http_request_sql_seconds_total{_labels(route=route, method=method)} {totals['seconds']:.6f}")
+
+    lines.append(f'# HELP sql_slow_queries_total Statements slower than {SLOW_QUERY_MS:g} ms.')
+    lines.append('# TYPE sql_slow_queries_total counter')
+    for (route,), count in sorted(slow_queries.items()):
+        lines.append(f"sql_slow_queries_total{_labels(route=route)} {count}")
+
+    return '\n'.join(lines) + '\n'
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose request and SQL metrics for Prometheus scraping"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -1,10 +1,14 @@
-from flask import Blueprint, jsonify, request, send_file
+from flask import Blueprint, current_app, jsonify, request, send_file
 from src.models.user import User, Report, db
+from src.models import sharding, reads
 import jwt
 import os
 from datetime import datetime, date
 from src.routes.email_service import send_report_submission_confirmation
-import pandas as pd
+from src.routes.archive import archived_report_rows, report_row_to_dict, include_archived_requested
+from src.utils.json_provider import stream_requested, stream_json_array, JSON_STREAM_BATCH_SIZE
+from src.utils import group_commit
+from itertools import chain
 from io import BytesIO
 
 reports_bp = Blueprint('reports', __name__)
@@ -22,6 +26,92 @@ def get_user_from_token(token):
     except:
         return None
 
+def report_filters(user, args):
+    """(staff_id, start_date, end_date, status) for a report listing from the query string
+
+    Staff other than supervisors and engineers only ever see their own reports. Raises
+    ValueError naming the parameter when a date is malformed.
+    """
+    staff_id = args.get('staff_id')
+    if user.role not in ['Supervisor', 'Commercial Engineer']:
+        staff_id = user.id
+
+    dates = []
+    for name in ('start_date', 'end_date'):
+        value = args.get(name)
+        try:
+            dates.append(datetime.strptime(value, '%Y-%m-%d').date() if value else None)
+        except ValueError:
+            raise ValueError(name)
+    return staff_id, dates[0], dates[1], args.get('status')
+
+def report_conditions(staff_id=None, start_date=None, end_date=None, status=None):
+    """WHERE clauses selecting the reports that match report_filters()"""
+    conditions = []
+    if staff_id:
+        conditions.append(Report.staff_id == staff_id)
+    if start_date:
+        conditions.append(Report.report_date >= start_date)
+    if end_date:
+        conditions.append(Report.report_date <= end_date)
+    if status:
+        conditions.append(Report.status == status)
+    return conditions
+
+def export_row(report, staff_number):
+    """Spreadsheet row for a live Report or an archived report row"""
+    return {
+        'ID': report.id,
+        'ITIN': report.itin,
+        'Report Date': report.report_date.strftime('%Y-%m-%d') if report.report_date else '',
+        'Percentage Attained': report.percentage_attained,
+        'Reasons Not Attained': report.reasons_not_attained or '',
+        'Staff Number': staff_number or '',
+        'Timestamp': report.timestamp.strftime('%Y-%m-%d %H:%M:%S') if report.timestamp else '',
+        'Status': report.status,
+        'Notes/Comments': report.notes_comments or ''
+    }
+
+EXPORT_MIMETYPES = {
+    'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv'
+}
+
+def export_filename(format_type, when=None):
+    extension = 'xlsx' if format_type == 'excel' else 'csv'
+    return f'reading_reports_{(when or datetime.now()).strftime("%Y%m%d_%H%M%S")}.{extension}'
+
+def export_rows(staff_id=None, start_date=None, end_date=None, status=None, include_archived=False, shards=None):
+    """Spreadsheet rows for the reports matching the filters, newest first
+
+    Rows come from every shard in `shards`, by default those the current request covers,
+    and name it in a Region column when the app is sharded.
+    """
+    def shard_rows():
+        query = reads.report_select().where(*report_conditions(staff_id, start_date, end_date, status)).order_by(Report.timestamp.desc())
+
+        data = [export_row(row, row.staff_number) for row in db.session.execute(query)]
+
+        if include_archived:
+            archived = archived_report_rows(staff_id, start_date, end_date, status)
+            data.extend(export_row(row, row.staff_number) for row in archived)
+            data.sort(key=lambda r: r['Timestamp'], reverse=True)
+        return data
+
+    return sharding.fan_out_merged(shard_rows, key=lambda r: r['Timestamp'], shards=shards, region_key='Region')
+
+def write_export(rows, format_type, output):
+    """Write rows as an Excel workbook or CSV to a path or binary file object"""
+    # pandas (and NumPy) cost a worker hundreds of milliseconds and tens of MB to import,
+    # so only the processes that actually build an export load it
+    import pandas as pd
+    df = pd.DataFrame(rows)
+    if format_type == 'excel':
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            df.to_excel(writer, index=False, sheet_name='Reports')
+    else:
+        df.to_csv(output, index=False)
+
 @reports_bp.route('/reports', methods=['POST'])
 def create_report():
     token = request.headers.get('Authorization')
@@ -45,7 +135,7 @@ def create_report():
     except ValueError:
         return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
 
-    report = Report(
+    values = dict(
         itin=itin,
         report_date=report_date,
         percentage_attained=percentage_attained,
@@ -54,8 +144,16 @@ def create_report():
         notes_comments=notes_comments
     )
 
-    db.session.add(report)
-    db.session.commit()
+    if group_commit.enabled(current_app):
+        # Committed together with other requests' inserts; the row comes back with its id
+        try:
+            report = Report(**group_commit.insert_row(current_app, Report.__table__, values))
+        except group_commit.WriteRejected as e:
+            return jsonify({'error': f'{e}, please retry'}), 503, {'Retry-After': '1'}
+    else:
+        report = Report(**values)
+        db.session.add(report)
+        db.session.commit()
 
     # Send confirmation email
     try:
@@ -63,9 +161,11 @@ def create_report():
     except Exception as e:
         print(f"Failed to send confirmation email: {str(e)}")
 
+    report_dict = report.to_dict()
+    report_dict['staff_number'] = user.staff_number
     return jsonify({
         'message': 'Report submitted successfully',
-        'report': report.to_dict()
+        'report': report_dict
     }), 201
 
 @reports_bp.route('/reports', methods=['GET'])
@@ -76,39 +176,38 @@ def get_reports():
     if not user:
         return jsonify({'error': 'Invalid or missing token'}), 401
 
-    # Get query parameters for filtering
-    staff_id = request.args.get('staff_id')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    status = request.args.get('status')
-
-    query = Report.query
-
-    # If user is not a supervisor, only show their own reports
-    if user.role not in ['Supervisor', 'Commercial Engineer']:
-        query = query.filter_by(staff_id=user.id)
-    elif staff_id:
-        query = query.filter_by(staff_id=staff_id)
-
-    if start_date:
-        try:
-            start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(Report.report_date >= start_date_obj)
-        except ValueError:
-            return jsonify({'error': 'Invalid start_date format. Use YYYY-MM-DD'}), 400
-
-    if end_date:
-        try:
-            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(Report.report_date <= end_date_obj)
-        except ValueError:
-            return jsonify({'error': 'Invalid end_date format. Use YYYY-MM-DD'}), 400
-
-    if status:
-        query = query.filter_by(status=status)
-
-    reports = query.order_by(Report.timestamp.desc()).all()
-    return jsonify([report.to_dict() for report in reports])
+    try:
+        staff_id, start_date_obj, end_date_obj, status = report_filters(user, request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid {e} format. Use YYYY-MM-DD'}), 400
+
+    query = reads.report_select().where(*report_conditions(staff_id, start_date_obj, end_date_obj, status)).order_by(Report.timestamp.desc())
+
+    def newest_first(report):
+        return report['timestamp'] or datetime.min
+
+    if stream_requested():
+        def shard_items():
+            rows = db.session.execute(query.execution_options(yield_per=JSON_STREAM_BATCH_SIZE))
+            items = map(reads.report_dict, rows)
+            if include_archived_requested():
+                # Archived reports are older than every live one, so appending keeps the order
+                archived = archived_report_rows(staff_id, start_date_obj, end_date_obj, status)
+                items = chain(items, (report_row_to_dict(row) for row in archived))
+            return items
+        # National supervisors see every region's shard, merged newest first
+        return stream_json_array(sharding.stream_merged(shard_items, key=newest_first))
+
+    def shard_results():
+        results = [reads.report_dict(row) for row in db.session.execute(query)]
+
+        if include_archived_requested():
+            archived = archived_report_rows(staff_id, start_date_obj, end_date_obj, status)
+            results.extend(report_row_to_dict(row) for row in archived)
+            results.sort(key=newest_first, reverse=True)
+        return results
+
+    return jsonify(sharding.fan_out_merged(shard_results, key=newest_first))
 
 @reports_bp.route('/reports/<int:report_id>', methods=['GET'])
 def get_report(report_id):
@@ -118,6 +217,9 @@ def get_report(report_id):
     if not user:
         return jsonify({'error': 'Invalid or missing token'}), 401
 
+    if sharding.region_required():
+        return jsonify({'error': 'Report ids repeat across regions; pass ?region= with the region of the report'}), 400
+
     report = Report.query.get_or_404(report_id)
     
     # Check if user has permission to view this report
@@ -134,6 +236,9 @@ def update_report(report_id):
     if not user:
         return jsonify({'error': 'Invalid or missing token'}), 401
 
+    if sharding.region_required():
+        return jsonify({'error': 'Report ids repeat across regions; pass ?region= with the region of the report'}), 400
+
     report = Report.query.get_or_404(report_id)
     
     # Check if user has permission to update this report
@@ -162,78 +267,22 @@ def download_reports():
     if not user:
         return jsonify({'error': 'Invalid or missing token'}), 401
 
-    # Get query parameters for filtering
     format_type = request.args.get('format', 'excel')  # excel or csv
-    staff_id = request.args.get('staff_id')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    status = request.args.get('status')
-
-    query = Report.query
-
-    # If user is not a supervisor, only show their own reports
-    if user.role not in ['Supervisor', 'Commercial Engineer']:
-        query = query.filter_by(staff_id=user.id)
-    elif staff_id:
-        query = query.filter_by(staff_id=staff_id)
-
-    if start_date:
-        try:
-            start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(Report.report_date >= start_date_obj)
-        except ValueError:
-            return jsonify({'error': 'Invalid start_date format. Use YYYY-MM-DD'}), 400
-
-    if end_date:
-        try:
-            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(Report.report_date <= end_date_obj)
-        except ValueError:
-            return jsonify({'error': 'Invalid end_date format. Use YYYY-MM-DD'}), 400
-
-    if status:
-        query = query.filter_by(status=status)
-
-    reports = query.order_by(Report.timestamp.desc()).all()
-    
-    # Convert to DataFrame
-    data = []
-    for report in reports:
-        data.append({
-            'ID': report.id,
-            'ITIN': report.itin,
-            'Report Date': report.report_date.strftime('%Y-%m-%d') if report.report_date else '',
-            'Percentage Attained': report.percentage_attained,
-            'Reasons Not Attained': report.reasons_not_attained or '',
-            'Staff Number': report.staff.staff_number if report.staff else '',
-            'Timestamp': report.timestamp.strftime('%Y-%m-%d %H:%M:%S') if report.timestamp else '',
-            'Status': report.status,
-            'Notes/Comments': report.notes_comments or ''
-        })
-
-    df = pd.DataFrame(data)
-    
-    if format_type == 'excel':
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Reports')
-        output.seek(0)
-        
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=f'reading_reports_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        )
-    else:
-        output = BytesIO()
-        df.to_csv(output, index=False)
-        output.seek(0)
-        
-        return send_file(
-            output,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'reading_reports_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        )
-
+    try:
+        staff_id, start_date_obj, end_date_obj, status = report_filters(user, request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid {e} format. Use YYYY-MM-DD'}), 400
+
+    data = export_rows(staff_id, start_date_obj, end_date_obj, status, include_archived_requested())
+
+    output = BytesIO()
+    format_type = 'excel' if format_type == 'excel' else 'csv'
+    write_export(data, format_type, output)
+    output.seek(0)
+
+    return send_file(
+        output,
+        mimetype=EXPORT_MIMETYPES[format_type],
+        as_attachment=True,
+        download_name=export_filename(format_type)
+    )
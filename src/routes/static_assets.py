@@ -0,0 +1,133 @@
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+from datetime import datetime, timezone
+from flask import Blueprint, Response, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are always built
+    brotli = None
+
+assets_bp = Blueprint('assets', __name__)
+
+# Cache lifetime for assets whose name does not carry a content hash
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', '3600'))
+# Files above this size are not held in memory and are streamed from disk instead
+STATIC_MANIFEST_MAX_BYTES = int(os.environ.get('STATIC_MANIFEST_MAX_BYTES', str(20 * 1024 * 1024)))
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Build tools fingerprint files as name.<hex>.ext or put them under assets/
+HASHED_NAME = re.compile(r'[.-][0-9a-fA-F]{8,}\.[A-Za-z0-9]+$')
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon')
+MIN_COMPRESS_BYTES = 256
+
+class StaticAsset:
+    __slots__ = ('path', 'body', 'gzip', 'br', 'etag', 'last_modified', 'mimetype', 'cache_control', 'in_memory')
+
+    def __init__(self, path, full_path, in_memory=True):
+        stat = os.stat(full_path)
+        self.path = path
+        self.in_memory = in_memory
+        self.last_modified = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.body = self.gzip = self.br = None
+
+        if path == 'index.html':
+            # The SPA shell must be revalidated so new deployments are picked up immediately
+            self.cache_control = 'no-cache'
+        elif path.startswith('assets/') or HASHED_NAME.search(path):
+            self.cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            self.cache_control = f'public, max-age={STATIC_MAX_AGE}'
+
+        if not in_memory:
+            self.etag = f'{int(stat.st_mtime)}-{stat.st_size}'
+            return
+
+        with open(full_path, 'rb') as f:
+            self.body = f.read()
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+
+        if len(self.body) >= MIN_COMPRESS_BYTES and self.mimetype.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(self.body, compresslevel=9, mtime=0)
+            if len(compressed) < len(self.body):
+                self.gzip = compressed
+            if brotli is not None:
+                compressed = brotli.compress(self.body, quality=11)
+                if len(compressed) < len(self.body):
+                    self.br = compressed
+
+def build_manifest(static_folder):
+    """Read the static folder once into memory with precompressed variants"""
+    manifest = {}
+    if not static_folder or not os.path.isdir(static_folder):
+        return manifest
+    for root, dirs, files in os.walk(static_folder):
+        for name in files:
+            full_path = os.path.join(root, name)
+            path = os.path.relpath(full_path, static_folder).replace(os.sep, '/')
+            in_memory = os.path.getsize(full_path) <= STATIC_MANIFEST_MAX_BYTES
+            manifest[path] = StaticAsset(path, full_path, in_memory)
+    return manifest
+
+_manifest = {}
+_static_folder = None
+
+@assets_bp.record_once
+def load_manifest(state):
+    global _static_folder
+    _static_folder = state.app.static_folder
+    _manifest.clear()
+    _manifest.update(build_manifest(_static_folder))
+
+def _choose_encoding(asset):
+    accepted = request.accept_encodings
+    if asset.br is not None and accepted['br']:
+        return 'br', asset.br
+    if asset.gzip is not None and accepted['gzip']:
+        return 'gzip', asset.gzip
+    return None, asset.body
+
+def serve_asset(asset):
+    if not asset.in_memory:
+        response = send_from_directory(_static_folder, asset.path)
+        response.headers['Cache-Control'] = asset.cache_control
+        return response
+
+    encoding, body = _choose_encoding(asset)
+    # Each encoding is a distinct representation and needs its own strong validator
+    etag = f'{asset.etag}-{encoding}' if encoding else asset.etag
+
+    not_modified = False
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag) or request.if_none_match.contains(asset.etag) or request.if_none_match.star_tag
+    elif request.if_modified_since:
+        not_modified = asset.last_modified <= request.if_modified_since
+
+    response = Response(status=304) if not_modified else Response(body, mimetype=asset.mimetype)
+    response.set_etag(etag)
+    response.last_modified = asset.last_modified
+    response.headers['Cache-Control'] = asset.cache_control
+    if asset.gzip is not None or asset.br is not None:
+        response.vary.add('Accept-Encoding')
+        if encoding and not not_modified:
+            response.headers['Content-Encoding'] = encoding
+    return response
+
+@assets_bp.route('/', defaults={'path': ''})
+@assets_bp.route('/<path:path>')
+def serve(path):
+    if _static_folder is None:
+        return "Static folder not configured", 404
+
+    asset = _manifest.get(path) if path else None
+    if asset is None:
+        # Unknown paths are client-side routes of the SPA
+        asset = _manifest.get('index.html')
+        if asset is None:
+            return "index.html not found", 404
+
+    return serve_asset(asset)
@@ -0,0 +1,153 @@
+import os
+import jwt
+from flask import Blueprint, jsonify, request
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from src.models.user import User, Report, Anomaly, Escalation, ChangeLog, DataVersion, CHANGE_LOG_PURGED, db
+from src.models import sharding
+
+sync_bp = Blueprint('sync', __name__)
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+# Changes per page of GET /api/sync; ?limit= can ask for up to the maximum
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '500'))
+SYNC_MAX_PAGE_SIZE = int(os.environ.get('SYNC_MAX_PAGE_SIZE', '5000'))
+# Tombstones of deleted rows are kept this long; clients offline for longer start over
+SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', '30'))
+
+# Change log table name -> (model, key in the response, options loading what to_dict() reads)
+SYNCED_MODELS = {
+    'report': (Report, 'reports', (joinedload(Report.staff),)),
+    'anomaly': (Anomaly, 'anomalies', (joinedload(Anomaly.staff), joinedload(Anomaly.assigned_to))),
+    'escalation': (Escalation, 'escalations', (joinedload(Escalation.escalated_to),))
+}
+
+def get_user_from_token(token):
+    try:
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        user_id = payload['user_id']
+        return User.query.get(user_id)
+    except:
+        return None
+
+def decode_sync_cursor(value, shards):
+    """{region: seq} from ?since=; a plain number when the caller covers one shard, else 'main:12,north:40'"""
+    since = {region: 0 for region in shards}
+    if not value:
+        return since
+    if len(shards) == 1 and ':' not in value:
+        since[shards[0]] = int(value)
+    else:
+        names = {sharding.shard_name(region): region for region in shards}
+        for part in value.split(','):
+            name, _, seq = part.partition(':')
+            if name in names:
+                since[names[name]] = int(seq)
+    if any(seq < 0 for seq in since.values()):
+        raise ValueError('negative seq')
+    return since
+
+def encode_sync_cursor(positions):
+    if len(positions) == 1:
+        return str(next(iter(positions.values())))
+    return ','.join(f'{sharding.shard_name(region)}:{seq}' for region, seq in positions.items())
+
+def changes_since(since, limit, owner_id=None):
+    """The next page of changes in the current shard after seq `since`
+
+    Returns (changes, next seq, more pages follow, client must start over). `owner_id`
+    limits the page to that staff member's rows; escalations have no owner and are left out.
+    When the app is sharded, rows and tombstones carry the name of the shard as `region`:
+    ids repeat across shards.
+    """
+    region = sharding.shard_name(sharding.current_shard()) if sharding.regions() else None
+    purged = db.session.get(DataVersion, CHANGE_LOG_PURGED)
+    reset = since > 0 and purged is not None and since < purged.version
+    if reset:
+        # A delete the client never saw may have been purged; send everything from the start
+        since = 0
+
+    query = select(ChangeLog.seq, ChangeLog.table_name, ChangeLog.row_id, ChangeLog.operation).where(ChangeLog.seq > since)
+    if owner_id is not None:
+        query = query.where(ChangeLog.owner_id == owner_id)
+    # One entry more than the page tells whether there is a next page
+    entries = db.session.execute(query.order_by(ChangeLog.seq).limit(limit + 1)).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    changes = {key: [] for _, key, _ in SYNCED_MODELS.values()}
+    changes['deleted'] = {key: [] for _, key, _ in SYNCED_MODELS.values()}
+    upserts = {}
+    for seq, table_name, row_id, operation in entries:
+        if table_name not in SYNCED_MODELS:
+            continue
+        if operation == 'delete':
+            changes['deleted'][SYNCED_MODELS[table_name][1]].append(row_id if region is None else {'id': row_id, 'region': region})
+        else:
+            upserts.setdefault(table_name, []).append(row_id)
+
+    for table_name, ids in upserts.items():
+        model, key, options = SYNCED_MODELS[table_name]
+        rows = {row.id: row for row in model.query.options(*options).filter(model.id.in_(ids))}
+        for row_id in ids:
+            row = rows.get(row_id)
+            if row is None:
+                # Deleted since the entry was read; its tombstone is in a later page
+                continue
+            item = row.to_dict()
+            if region is not None:
+                item['region'] = region
+            changes[key].append(item)
+
+    next_seq = entries[-1].seq if entries else since
+    return changes, next_seq, more, reset
+
+@sync_bp.route('/sync', methods=['GET'])
+def sync():
+    """Reports, anomalies and escalations created, changed or deleted since ?since=
+
+    Pass back `next` as ?since= until `has_more` is false. When `reset` is true the
+    client's position has been compacted away: it must drop what it holds and apply
+    this response as a sync from the start.
+    """
+    token = request.headers.get('Authorization')
+    user = get_user_from_token(token)
+
+    if not user:
+        return jsonify({'error': 'Invalid or missing token'}), 401
+
+    shards = sharding.request_shards()
+    try:
+        since = decode_sync_cursor(request.args.get('since'), shards)
+        limit = min(int(request.args.get('limit', SYNC_PAGE_SIZE)), SYNC_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid since or limit'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    # Meter readers sync their own reports and anomalies only
+    owner_id = None if user.role in ['Supervisor', 'Commercial Engineer'] else user.id
+
+    parts = sharding.fan_out(lambda: changes_since(since[sharding.current_shard()], limit, owner_id), shards)
+    if any(part[3] for part in parts) and any(since.values()):
+        # The client starts over from nothing, so every shard has to start from the beginning
+        parts = [(*part[:3], True) for part in sharding.fan_out(lambda: changes_since(0, limit, owner_id), shards)]
+
+    result = {key: [] for _, key, _ in SYNCED_MODELS.values()}
+    result['deleted'] = {key: [] for _, key, _ in SYNCED_MODELS.values()}
+    positions = {}
+    has_more = reset = False
+    for region, (changes, next_seq, more, shard_reset) in zip(shards, parts):
+        for key in result['deleted']:
+            result[key].extend(changes[key])
+            result['deleted'][key].extend(changes['deleted'][key])
+        positions[region] = next_seq
+        has_more = has_more or more
+        reset = reset or shard_reset
+
+    result.update({'next': encode_sync_cursor(positions), 'has_more': has_more, 'reset': reset})
+    return jsonify(result)
@@ -1,10 +1,14 @@
 from flask import Blueprint, jsonify, request
 from src.models.user import User, db
+from src.utils.json_provider import stream_requested, stream_json_array, JSON_STREAM_BATCH_SIZE
 
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/users', methods=['GET'])
 def get_users():
+    if stream_requested():
+        return stream_json_array(user.to_dict() for user in User.query.yield_per(JSON_STREAM_BATCH_SIZE))
+
     users = User.query.all()
     return jsonify([user.to_dict() for user in users])
 
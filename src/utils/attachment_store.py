@@ -0,0 +1,182 @@
+import os
+import time
+import fcntl
+import hashlib
+import threading
+from importlib.util import find_spec
+from src.utils import process_pool
+
+# Pillow is optional; without it attachments simply have no thumbnails. It is only
+# imported by the pool processes that build them.
+PILLOW_AVAILABLE = find_spec('PIL') is not None
+
+# Content-addressed store: objects/ab/<sha256>, thumbnails/ab/<sha256>.jpg, uploads/<id>.part
+ATTACHMENT_DIR = os.environ.get('ATTACHMENT_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'attachments'))
+# Partial uploads untouched for this long are deleted; the client then starts over
+ATTACHMENT_UPLOAD_TTL = int(os.environ.get('ATTACHMENT_UPLOAD_TTL', str(24 * 3600)))
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', '320'))
+THUMBNAIL_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'image/gif')
+
+COPY_BUFFER = 64 * 1024
+
+_pending_thumbnails = set()
+_pending_lock = threading.Lock()
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+class OffsetMismatch(Exception):
+    """A chunk did not start where the partial upload ends"""
+
+    def __init__(self, offset):
+        super().__init__(f'Upload is at byte {offset}')
+        self.offset = offset
+
+class UploadBusy(Exception):
+    """Another request is writing to the same upload"""
+
+def upload_path(attachment_id):
+    return os.path.join(ATTACHMENT_DIR, 'uploads', f'{attachment_id}.part')
+
+def object_path(sha256):
+    return os.path.join(ATTACHMENT_DIR, 'objects', sha256[:2], sha256)
+
+def thumbnail_path(sha256):
+    return os.path.join(ATTACHMENT_DIR, 'thumbnails', sha256[:2], f'{sha256}.jpg')
+
+def received_bytes(attachment_id):
+    """How much of an upload has arrived; a resuming client continues from here"""
+    try:
+        return os.path.getsize(upload_path(attachment_id))
+    except FileNotFoundError:
+        return 0
+
+def write_chunk(attachment_id, offset, stream, length):
+    """Append `length` bytes from `stream` to the partial upload, which must currently end at `offset`
+
+    Returns the new size of the partial upload.
+    """
+    path = upload_path(attachment_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadBusy('Upload is already in progress')
+        try:
+            current = os.fstat(f.fileno()).st_size
+            if current != offset:
+                raise OffsetMismatch(current)
+            remaining = length
+            try:
+                while remaining:
+                    data = stream.read(min(COPY_BUFFER, remaining))
+                    if not data:
+                        break
+                    f.write(data)
+                    remaining -= len(data)
+            finally:
+                # Whatever arrived before a dropped connection is kept for the retry
+                f.flush()
+                os.fsync(f.fileno())
+            return current + length - remaining
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def commit_upload(attachment_id):
+    """Hash the finished upload and move it into the store; returns its sha256
+
+    An identical file already in the store is kept and the new copy is dropped.
+    """
+    path = upload_path(attachment_id)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER), b''):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+
+    target = object_path(sha256)
+    if os.path.exists(target):
+        os.remove(path)
+        os.utime(target)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+    return sha256
+
+def discard_upload(attachment_id):
+    try:
+        os.remove(upload_path(attachment_id))
+    except FileNotFoundError:
+        pass
+
+def thumbnails_supported(content_type):
+    return PILLOW_AVAILABLE and content_type in THUMBNAIL_TYPES
+
+def build_thumbnail(source, target, size):
+    """Runs in a pool process: write a JPEG thumbnail of the image at `source` atomically to `target`"""
+    from PIL import Image, ImageOps
+    with Image.open(source) as image:
+        # Phone photos are often stored sideways with an EXIF orientation tag
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temporary = f'{target}.{os.getpid()}.tmp'
+        image.save(temporary, 'JPEG', quality=80, optimize=True)
+    os.replace(temporary, target)
+
+def _finish_thumbnail(sha256, future):
+    with _pending_lock:
+        _pending_thumbnails.discard(sha256)
+    if future.exception() is not None:
+        # The error file stops every later request from retrying an unreadable image
+        with open(f'{thumbnail_path(sha256)}.error', 'w') as f:
+            f.write(str(future.exception()) or future.exception().__class__.__name__)
+
+def thumbnail_status(sha256, content_type):
+    """'Ready', 'Pending', 'Failed', or None for files that get no thumbnail"""
+    if sha256 is None or not thumbnails_supported(content_type):
+        return None
+    path = thumbnail_path(sha256)
+    if os.path.exists(path):
+        return 'Ready'
+    if os.path.exists(f'{path}.error'):
+        return 'Failed'
+    return 'Pending'
+
+def ensure_thumbnail(sha256, content_type):
+    """Start building the thumbnail of a stored file unless it exists or is under way; returns its status"""
+    status = thumbnail_status(sha256, content_type)
+    if status != 'Pending':
+        return status
+    with _pending_lock:
+        if sha256 in _pending_thumbnails:
+            return status
+        _pending_thumbnails.add(sha256)
+    future = process_pool.submit(build_thumbnail, object_path(sha256), thumbnail_path(sha256), THUMBNAIL_SIZE)
+    future.add_done_callback(lambda f: _finish_thumbnail(sha256, f))
+    return status
+
+def sweep_uploads(force=False):
+    """Delete partial uploads abandoned for longer than ATTACHMENT_UPLOAD_TTL"""
+    global _last_sweep
+    now = time.time()
+    if not force and now - _last_sweep < 600:
+        return
+    if not _sweep_lock.acquire(blocking=False):
+        return
+    try:
+        _last_sweep = now
+        directory = os.path.join(ATTACHMENT_DIR, 'uploads')
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if now - os.path.getmtime(path) > ATTACHMENT_UPLOAD_TTL:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+    finally:
+        _sweep_lock.release()
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+from datetime import datetime
+from src.models.user import VERSIONED_MODELS, bump_data_version, db
+from src.models import sharding
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'backups'))
+# Hours between scheduled snapshots; 0 leaves backups to `flask backup create` (e.g. from cron)
+BACKUP_INTERVAL_HOURS = float(os.environ.get('BACKUP_INTERVAL_HOURS', '0'))
+# Snapshots kept; older ones are deleted after each new one
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', '7'))
+# Pages copied per step, and the pause between steps that leaves the disk to writers
+BACKUP_STEP_PAGES = int(os.environ.get('BACKUP_STEP_PAGES', '256'))
+BACKUP_STEP_PAUSE_MS = float(os.environ.get('BACKUP_STEP_PAUSE_MS', '2'))
+# A snapshot still in progress after this long is assumed dead and its lock is taken over
+BACKUP_LOCK_TIMEOUT = int(os.environ.get('BACKUP_LOCK_TIMEOUT', '3600'))
+
+MANIFEST = 'manifest.json'
+
+class BackupError(Exception):
+    """A snapshot could not be taken, verified or restored"""
+
+def _lock_path():
+    return os.path.join(BACKUP_DIR, 'backup.lock')
+
+def sqlite_path(engine):
+    """File of a SQLite engine's database, or None for other databases and in-memory ones"""
+    url = engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:' or url.database.startswith('file:'):
+        return None
+    return os.path.abspath(url.database)
+
+def copy_database(source_path, target_path):
+    """Copy a live SQLite database to `target_path` with the online backup API; returns the page count
+
+    The copy goes BACKUP_STEP_PAGES at a time. In WAL mode the source is held at one read
+    snapshot for the whole copy, so writers keep committing to the WAL meanwhile and the
+    copy never has to restart; in other journal modes the backup restarts when a writer
+    gets in between steps.
+    """
+    source = sqlite3.connect(source_path, isolation_level=None, timeout=30)
+    target = sqlite3.connect(target_path, isolation_level=None)
+    pages = [0]
+
+    def progress(status, remaining, total):
+        pages[0] = total
+        if remaining and BACKUP_STEP_PAUSE_MS:
+            time.sleep(BACKUP_STEP_PAUSE_MS / 1000)
+
+    try:
+        pinned = source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        if pinned:
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        try:
+            source.backup(target, pages=BACKUP_STEP_PAGES, progress=progress)
+        finally:
+            if pinned:
+                source.execute('COMMIT')
+        # A snapshot is a single self-contained file
+        target.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        target.close()
+        source.close()
+    return pages[0]
+
+def check_integrity(path):
+    """Raise BackupError unless SQLite's integrity check passes on the file"""
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        problems = [row[0] for row in connection.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f'{os.path.basename(path)}: {e}')
+    finally:
+        connection.close()
+    if problems != ['ok']:
+        raise BackupError(f"{os.path.basename(path)}: {'; '.join(problems[:5])}")
+
+def databases():
+    """(region, path) of every SQLite database of the app: the main one, then each shard's"""
+    return [(region, path) for region, engine in sharding.writer_engines(db) if (path := sqlite_path(engine))]
+
+def _acquire_lock():
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    lock = _lock_path()
+    for _ in range(2):
+        try:
+            # The lock file keeps workers of every process from snapshotting at the same time
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) < BACKUP_LOCK_TIMEOUT:
+                    return False
+                os.remove(lock)
+            except FileNotFoundError:
+                pass
+    return False
+
+def _release_lock():
+    try:
+        os.remove(_lock_path())
+    except FileNotFoundError:
+        pass
+
+def create_snapshot():
+    """Snapshot every database, verify it and apply the retention; call inside an app context
+
+    Returns the manifest, or None if another process is taking a snapshot. A snapshot is a
+    directory named after its UTC time, to the millisecond; it only appears under that
+    name once every file has been copied and has passed the integrity check.
+    """
+    if not _acquire_lock():
+        return None
+    try:
+        targets = databases()
+        if not targets:
+            raise BackupError('No SQLite database to back up; use the database server\'s own backups')
+        now = datetime.utcnow()
+        name = f"{now.strftime('%Y%m%dT%H%M%S')}.{now.microsecond // 1000:03d}Z"
+        final = os.path.join(BACKUP_DIR, name)
+        partial = f'{final}.tmp'
+        shutil.rmtree(partial, ignore_errors=True)
+        os.makedirs(partial)
+
+        manifest = {'name': name, 'created_at': now.isoformat(), 'databases': []}
+        try:
+            for region, path in targets:
+                started = time.perf_counter()
+                target = os.path.join(partial, os.path.basename(path))
+                pages = copy_database(path, target)
+                check_integrity(target)
+                manifest['databases'].append({
+                    'region': region,
+                    'file': os.path.basename(path),
+                    'source': path,
+                    'pages': pages,
+                    'bytes': os.path.getsize(target),
+                    'seconds': round(time.perf_counter() - started, 3),
+                    'integrity': 'ok'
+                })
+            with open(os.path.join(partial, MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(partial, final)
+        finally:
+            shutil.rmtree(partial, ignore_errors=True)
+
+        rotate()
+        return manifest
+    finally:
+        _release_lock()
+
+def list_snapshots():
+    """Manifests of the complete snapshots, newest first"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    snapshots = []
+    for name in sorted(os.listdir(BACKUP_DIR), reverse=True):
+        try:
+            with open(os.path.join(BACKUP_DIR, name, MANIFEST)) as f:
+                snapshots.append(json.load(f))
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            continue
+    return snapshots
+
+def rotate(keep=None):
+    """Delete all but the newest `keep` snapshots, and leftovers of interrupted ones"""
+    keep = BACKUP_KEEP if keep is None else keep
+    for snapshot in list_snapshots()[keep:]:
+        shutil.rmtree(os.path.join(BACKUP_DIR, snapshot['name']), ignore_errors=True)
+    for name in os.listdir(BACKUP_DIR):
+        path = os.path.join(BACKUP_DIR, name)
+        if name.endswith('.tmp') and time.time() - os.path.getmtime(path) > BACKUP_LOCK_TIMEOUT:
+            shutil.rmtree(path, ignore_errors=True)
+
+def restore_snapshot(name):
+    """Replace the live databases with a snapshot's; call inside an app context
+
+    Every file is verified before anything is overwritten. The copy goes through SQLite
+    with the online backup API, so the WAL and locks of the live files stay consistent,
+    but requests running meanwhile would see the data change under them: stop the app
+    first. Returns the manifest.
+    """
+    snapshot = next((s for s in list_snapshots() if s['name'] == name), None)
+    if snapshot is None:
+        raise BackupError(f'No snapshot named {name}')
+
+    live = dict(databases())
+    for entry in snapshot['databases']:
+        if entry['region'] not in live:
+            raise BackupError(f"Snapshot has a database for region {entry['region']!r}, which this app does not have")
+        check_integrity(os.path.join(BACKUP_DIR, name, entry['file']))
+
+    for entry in snapshot['databases']:
+        source = sqlite3.connect(f"file:{os.path.join(BACKUP_DIR, name, entry['file'])}?mode=ro", uri=True)
+        target = sqlite3.connect(live[entry['region']], isolation_level=None, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        # Cache keys built from the data versions must not match what was cached before the restore
+        with sharding.engine(entry['region']).begin() as conn:
+            for model in VERSIONED_MODELS:
+                bump_data_version(conn, model.__tablename__)
+    return snapshot
+
+class BackupScheduler:
+    """Takes a snapshot whenever the newest one is older than the interval
+
+    Every server process runs one; the lock file and the age of the newest snapshot keep
+    them from taking more than one per interval between them.
+    """
+
+    def __init__(self, app, interval_hours):
+        self.app = app
+        self.interval = interval_hours * 3600
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def ensure_running(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own
+        if self.thread is None or self.pid != os.getpid():
+            with self.lock:
+                if self.thread is None or self.pid != os.getpid():
+                    self.pid = os.getpid()
+                    self.thread = threading.Thread(target=self._run, name='backup-scheduler', daemon=True)
+                    self.thread.start()
+
+    def seconds_until_due(self):
+        snapshots = list_snapshots()
+        if not snapshots:
+            return 0
+        newest = datetime.fromisoformat(snapshots[0]['created_at'])
+        return self.interval - (datetime.utcnow() - newest).total_seconds()
+
+    def _run(self):
+        while True:
+            wait = self.seconds_until_due()
+            if wait > 0:
+                # Wake up at least every minute: another process may have taken the snapshot
+                time.sleep(min(wait, 60))
+                continue
+            try:
+                with self.app.app_context():
+                    create_snapshot()
+            except Exception as e:
+                print(f'Scheduled backup failed: {e}')
+            time.sleep(60)
+
+def init_app(app):
+    app.config.setdefault('BACKUP_INTERVAL_HOURS', BACKUP_INTERVAL_HOURS)
+    if app.config['BACKUP_INTERVAL_HOURS'] > 0:
+        scheduler = app.extensions['backup_scheduler'] = BackupScheduler(app, app.config['BACKUP_INTERVAL_HOURS'])
+        app.before_request(scheduler.ensure_running)
@@ -0,0 +1,138 @@
+import os
+import gzip
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Responses smaller than this are sent as they are; the headers would eat the savings
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', '5'))
+# Upper bound on the memory holding already-compressed GET bodies
+COMPRESS_CACHE_BYTES = int(os.environ.get('COMPRESS_CACHE_BYTES', str(32 * 1024 * 1024)))
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack', 'text/csv', 'text/plain', 'text/html')
+
+class CompressionCache:
+    """LRU of compressed bodies keyed by the digest of the uncompressed body and the encoding"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+_cache = CompressionCache(COMPRESS_CACHE_BYTES)
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of byte chunks incrementally, flushing after each chunk"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+def choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compress_response(response):
+    """Compress eligible responses according to Accept-Encoding"""
+    if (response.direct_passthrough or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if response.is_streamed:
+        # Streamed bodies are compressed chunk by chunk as they are produced
+        encoding = choose_encoding()
+        if encoding:
+            response.response = compress_stream(response.iter_encoded(), encoding)
+            response.headers['Content-Encoding'] = encoding
+            response.headers.pop('Content-Length', None)
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+
+    encoding = choose_encoding()
+    cacheable = request.method == 'GET' and 'no-store' not in response.headers.get('Cache-Control', '')
+    digest = hashlib.sha1(body).hexdigest() if cacheable else None
+
+    if digest:
+        # Identical GET bodies get a stable validator, so repeat polls can be answered with 304.
+        # The compressed representation carries its own strong validator derived from it.
+        etag = response.get_etag()[0] or digest
+        variant = f'{etag}-{encoding}' if encoding else etag
+        response.set_etag(variant)
+        if request.if_none_match.contains(variant) or request.if_none_match.contains(etag):
+            response.status_code = 304
+            response.set_data(b'')
+            return response
+
+    if encoding is None:
+        return response
+
+    compressed = _cache.get((digest, encoding)) if digest else None
+    if compressed is None:
+        compressed = compress(body, encoding)
+        if digest:
+            _cache.put((digest, encoding), compressed)
+
+    if len(compressed) >= len(body):
+        if digest:
+            response.set_etag(etag)
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -0,0 +1,58 @@
+import os
+import numpy as np
+
+# Days of daily history the projection is fitted on
+FORECAST_HISTORY_DAYS = int(os.environ.get('FORECAST_HISTORY_DAYS', '56'))
+# Weight of a day halves every this many days back, so recent days count most
+FORECAST_HALF_LIFE_DAYS = float(os.environ.get('FORECAST_HALF_LIFE_DAYS', '14'))
+
+def project_month_end(counts, sums, month_columns, days_remaining, half_life=None):
+    """Month-end report counts and average percentage attained for every reader at once
+
+    `counts` and `sums` are (readers x days) arrays of each reader's daily number of reports
+    and sum of percentage attained, oldest day first, ending with today. The last
+    `month_columns` days are this month so far; the days before today are the history.
+
+    The daily report rate is an exponentially weighted mean of the history. The daily
+    percentage is an exponentially weighted least-squares line through each day's average,
+    weighted by its reports too, and is projected to the average of the remaining days.
+    Returns (projected_reports, projected_percentage, trend per day); the percentage is NaN
+    for readers with no reports at all.
+    """
+    half_life = FORECAST_HALF_LIFE_DAYS if half_life is None else half_life
+    counts = np.asarray(counts, dtype=float)
+    sums = np.asarray(sums, dtype=float)
+    days = counts.shape[1]
+
+    # Day offsets relative to today, fitted on the complete days before it
+    x = np.arange(-(days - 1), 1, dtype=float)
+    history_x = x[:-1]
+    history_counts, history_sums = counts[:, :-1], sums[:, :-1]
+    decay = 0.5 ** (-history_x / half_life)
+
+    rate = history_counts @ decay / decay.sum() if days > 1 else np.zeros(len(counts))
+
+    weights = history_counts * decay
+    total_weight = weights.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily_average = np.where(history_counts > 0, history_sums / np.where(history_counts > 0, history_counts, 1), 0.0)
+        mean_x = weights @ history_x / total_weight
+        mean_y = (decay * history_sums).sum(axis=1) / total_weight
+        dx = history_x - mean_x[:, None]
+        sxx = (weights * dx * dx).sum(axis=1)
+        sxy = (weights * dx * (daily_average - mean_y[:, None])).sum(axis=1)
+        slope = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1), 0.0)
+
+    # Average of the line over days 1..days_remaining from today
+    future_x = (days_remaining + 1) / 2
+    future_percentage = np.clip(mean_y + slope * (future_x - mean_x), 0, 100)
+    future_reports = rate * days_remaining
+
+    month_counts = counts[:, -month_columns:].sum(axis=1)
+    month_sums = sums[:, -month_columns:].sum(axis=1)
+    projected_reports = month_counts + future_reports
+    expected_sums = month_sums + np.where(future_reports > 0, np.nan_to_num(future_percentage) * future_reports, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        projected_percentage = np.where(projected_reports > 0, expected_sums / projected_reports, np.nan)
+
+    return projected_reports, projected_percentage, np.where(total_weight > 0, slope, 0.0)
@@ -0,0 +1,193 @@
+import os
+import time
+import queue
+import threading
+from sqlalchemy import Float, insert
+from src.models.user import bump_data_version, db
+from src.models.routing import note_write
+from src.models import sharding
+
+# Off by default: every insert then commits on its own, as before
+WRITE_COALESCING = os.environ.get('WRITE_COALESCING', 'false').lower() == 'true'
+# How long the first insert of a batch waits for others to join it
+WRITE_COALESCE_WINDOW_MS = float(os.environ.get('WRITE_COALESCE_WINDOW_MS', '5'))
+WRITE_COALESCE_MAX_BATCH = int(os.environ.get('WRITE_COALESCE_MAX_BATCH', '200'))
+# Inserts not yet picked up by a batch after this long are withdrawn and fail; nothing is written
+WRITE_COALESCE_TIMEOUT_MS = float(os.environ.get('WRITE_COALESCE_TIMEOUT_MS', '2000'))
+WRITE_COALESCE_MAX_PENDING = int(os.environ.get('WRITE_COALESCE_MAX_PENDING', '5000'))
+
+class WriteRejected(Exception):
+    """The insert was not written and may be retried"""
+
+class PendingInsert:
+    __slots__ = ('table', 'values', 'state', 'row', 'error', 'done')
+
+    def __init__(self, table, values):
+        self.table = table
+        self.values = values
+        self.state = 'queued'
+        self.row = None
+        self.error = None
+        self.done = threading.Event()
+
+class GroupCommitter:
+    """Commits inserts from concurrent requests together, one transaction per batch
+
+    A background thread takes the first queued insert, waits up to the window for more,
+    and inserts them all in a single transaction, so a burst costs one commit (and one
+    fsync) instead of one per row. If the batch fails, its inserts are retried one by
+    one, so a bad row only fails its own request.
+    """
+
+    def __init__(self, app, bind_key=None):
+        self.app = app
+        self.bind_key = bind_key
+        self.queue = queue.Queue(maxsize=WRITE_COALESCE_MAX_PENDING)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.batches = 0
+        self.rows = 0
+
+    def _thread_running(self):
+        # Threads do not survive a fork, so a gunicorn worker starts its own
+        return self.thread is not None and self.pid == os.getpid() and self.thread.is_alive()
+
+    def _ensure_thread(self):
+        if not self._thread_running():
+            with self.lock:
+                if not self._thread_running():
+                    self.pid = os.getpid()
+                    self.thread = threading.Thread(target=self._run, name=f'group-commit-{self.bind_key or "main"}', daemon=True)
+                    self.thread.start()
+
+    def insert(self, table, values):
+        """Insert one row and return it with its generated columns once it is committed"""
+        self._ensure_thread()
+        item = PendingInsert(table, values)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            raise WriteRejected('Write queue is full')
+
+        if not item.done.wait(WRITE_COALESCE_TIMEOUT_MS / 1000):
+            with self.lock:
+                if item.state == 'queued':
+                    item.state = 'cancelled'
+                    raise WriteRejected('Timed out waiting for a write batch')
+            # Already part of a transaction; its outcome is only moments away
+            item.done.wait()
+
+        if item.error is not None:
+            raise item.error
+        note_write()
+        return item.row
+
+    def _take_batch(self):
+        batch = []
+        deadline = None
+        while len(batch) < WRITE_COALESCE_MAX_BATCH:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            with self.lock:
+                if item.state != 'queued':
+                    continue
+                item.state = 'writing'
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + WRITE_COALESCE_WINDOW_MS / 1000
+        return batch
+
+    def _connect(self):
+        with self.app.app_context():
+            # A connection of its own: the waiting requests may hold every pooled one
+            return db.engines[self.bind_key].connect()
+
+    def _run(self):
+        conn = None
+        while True:
+            batch = self._take_batch()
+            try:
+                if conn is None or conn.invalidated:
+                    conn = self._connect()
+                self._commit(conn, batch)
+            except Exception as e:
+                # The database could not be reached or the connection broke: fail what was not
+                # committed, so its requests can retry, and start the next batch on a new connection
+                self.app.logger.exception('Group commit of %d rows failed', len(batch))
+                for item in batch:
+                    if item.row is None and item.error is None:
+                        item.error = WriteRejected(f'Write batch failed ({e.__class__.__name__})')
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+            finally:
+                for item in batch:
+                    item.done.set()
+
+    def _commit(self, conn, batch):
+        """Write the batch in one transaction, or each insert on its own if that fails"""
+        try:
+            self._write(conn, batch)
+        except Exception:
+            if conn.invalidated:
+                raise
+            for item in batch:
+                try:
+                    self._write(conn, [item])
+                except Exception as e:
+                    if conn.invalidated:
+                        raise
+                    item.error = e
+
+    def _write(self, conn, batch):
+        tables = {}
+        for item in batch:
+            tables.setdefault(item.table, []).append(item)
+        written = []
+        with conn.begin():
+            for table, items in tables.items():
+                statement = insert(table).returning(*table.c, sort_by_parameter_order=True)
+                rows = conn.execute(statement, [item.values for item in items]).all()
+                bump_data_version(conn, table.name)
+                # SQLite returns values as bound, before the column's REAL affinity applies
+                floats = [c.name for c in table.c if isinstance(c.type, Float)]
+                for item, row in zip(items, rows):
+                    values = dict(row._mapping)
+                    for name in floats:
+                        if values[name] is not None:
+                            values[name] = float(values[name])
+                    written.append((item, values))
+        # Only rows of a committed transaction go back to their requests
+        for item, values in written:
+            item.row = values
+        self.batches += 1
+        self.rows += len(batch)
+
+_committers_lock = threading.Lock()
+
+def enabled(app):
+    return 'group_commit' in app.extensions
+
+def insert_row(app, table, values):
+    # One committer per database, so each region's shard commits its own batches
+    key = sharding.bind_key(sharding.current_shard())
+    committers = app.extensions['group_commit']
+    committer = committers.get(key)
+    if committer is None:
+        with _committers_lock:
+            committer = committers.setdefault(key, GroupCommitter(app, key))
+    return committer.insert(table, values)
+
+def init_app(app):
+    app.config.setdefault('WRITE_COALESCING', WRITE_COALESCING)
+    if app.config['WRITE_COALESCING']:
+        app.extensions['group_commit'] = {}
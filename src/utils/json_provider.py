@@ -0,0 +1,104 @@
+import os
+import json
+from datetime import date
+from flask import Response, request, stream_with_context, has_request_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder produces the same output, only slower
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # without msgpack every client gets JSON
+    msgpack = None
+
+# Rows fetched per round trip, and bytes buffered per chunk, when streaming a JSON array
+JSON_STREAM_BATCH_SIZE = int(os.environ.get('JSON_STREAM_BATCH_SIZE', '500'))
+JSON_STREAM_CHUNK_BYTES = int(os.environ.get('JSON_STREAM_CHUNK_BYTES', '65536'))
+
+def _default(obj):
+    # Dates go out as ISO 8601, matching orjson's native output, instead of Flask's HTTP dates
+    if isinstance(obj, date):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+if orjson is not None:
+    def encode(obj):
+        """Serialize to compact JSON bytes"""
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def encode(obj):
+        """Serialize to compact JSON bytes"""
+        return _encoder.encode(obj).encode('utf-8')
+
+def wants_msgpack():
+    """Whether the client prefers application/msgpack over application/json"""
+    if msgpack is None or not has_request_context():
+        return False
+    return request.accept_mimetypes.best_match(['application/json', 'application/msgpack']) == 'application/msgpack'
+
+def encode_msgpack(obj):
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson when it is installed
+
+    Clients that send Accept: application/msgpack get the same data as MessagePack when the
+    msgpack package is installed.
+
+    datetime and date values are serialized natively as ISO 8601, so models can hand them
+    over without calling isoformat() themselves. Object keys keep their insertion order.
+    """
+    default = staticmethod(_default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if wants_msgpack():
+            obj = self._prepare_response_obj(args, kwargs)
+            response = self._app.response_class(encode_msgpack(obj), mimetype='application/msgpack')
+        elif orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            response = super().response(*args, **kwargs)
+        else:
+            obj = self._prepare_response_obj(args, kwargs)
+            response = self._app.response_class(encode(obj), mimetype=self.mimetype)
+        if msgpack is not None:
+            response.vary.add('Accept')
+        return response
+
+def stream_requested():
+    return request.args.get('stream', 'false').lower() == 'true'
+
+def stream_json_array(items):
+    """Respond with a JSON array that is encoded and sent element by element
+
+    `items` is any iterable of JSON-serializable objects, typically a generator over a
+    query run with yield_per(), so the full body is never held in memory.
+    """
+    def generate():
+        buffer = bytearray(b'[')
+        first = True
+        for item in items:
+            if not first:
+                buffer += b','
+            first = False
+            buffer += encode(item)
+            if len(buffer) >= JSON_STREAM_CHUNK_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b']'
+        yield bytes(buffer)
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,42 @@
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# CPU-bound work (spreadsheet exports, image processing) runs here instead of in request threads
+PROCESS_POOL_WORKERS = int(os.environ.get('PROCESS_POOL_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+def get_pool():
+    """The process pool of this server process, created on first use
+
+    Children are spawned rather than forked: request threads may hold locks and pooled
+    database connections that must not be copied into them. A pool inherited across a
+    gunicorn fork belongs to the master and is replaced.
+    """
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+        return _pool
+
+def submit(fn, *args, **kwargs):
+    """Submit to the pool, replacing it once if a crashed child has broken it"""
+    global _pool
+    try:
+        return get_pool().submit(fn, *args, **kwargs)
+    except BrokenProcessPool:
+        with _lock:
+            _pool = None
+        return get_pool().submit(fn, *args, **kwargs)
+
+@atexit.register
+def shutdown():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,192 @@
+import os
+import json
+import math
+import time
+import threading
+import jwt
+from flask import current_app, g, jsonify, request
+
+try:
+    import redis
+except ImportError:  # redis is only needed for the shared backend
+    redis = None
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+# Token buckets per endpoint: a list of [scope, requests, period_seconds], where scope is
+# 'ip', 'user' (falls back to ip without a valid token) or 'route' (shared by all callers).
+# An optional '*' entry applies to every endpoint without one of its own.
+# Override with RATE_LIMITS as JSON.
+DEFAULT_RATE_LIMITS = {
+    'auth.login': [['ip', 20, 60], ['route', 120, 60]],
+    'auth.forgot_pin': [['ip', 5, 300]],
+    'auth.change_pin': [['user', 5, 300]],
+    'reports.download_reports': [['user', 6, 60]],
+    'exports.create_export': [['user', 20, 60]],
+    'dashboard.get_supervisor_dashboard': [['user', 30, 60]],
+    'anomalies.check_escalation': [['user', 2, 60]],
+    'email.send_escalation_notifications': [['user', 2, 60]]
+}
+RATE_LIMITS = json.loads(os.environ['RATE_LIMITS']) if os.environ.get('RATE_LIMITS') else DEFAULT_RATE_LIMITS
+
+# Requests an endpoint may run at once in this process; the rest are turned away with 503
+# instead of queueing behind PBKDF2 hashes, spreadsheet builds and N-query dashboards.
+DEFAULT_CONCURRENCY_LIMITS = {
+    'auth.login': 4,
+    'reports.download_reports': 2,
+    'dashboard.get_supervisor_dashboard': 4,
+    'anomalies.check_escalation': 1
+}
+CONCURRENCY_LIMITS = json.loads(os.environ['CONCURRENCY_LIMITS']) if os.environ.get('CONCURRENCY_LIMITS') else DEFAULT_CONCURRENCY_LIMITS
+
+# Set to e.g. redis://localhost:6379/0 to share buckets between worker processes
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', '')
+# Seconds a request waits on Redis before it is admitted by this process's own buckets instead
+RATE_LIMIT_REDIS_TIMEOUT = float(os.environ.get('RATE_LIMIT_REDIS_TIMEOUT', '0.5'))
+
+class MemoryBackend:
+    """Token buckets held in this process"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.last_sweep = time.monotonic()
+
+    def take(self, key, capacity, period):
+        """Take one token; returns (allowed, seconds until a token is available)"""
+        rate = capacity / period
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if now - self.last_sweep > 60:
+                self._sweep(now)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def _sweep(self, now):
+        # Buckets idle for ten minutes are full again or close to it; forget them
+        self.last_sweep = now
+        for key in [k for k, (_, updated) in self.buckets.items() if now - updated > 600]:
+            del self.buckets[key]
+
+class RedisBackend:
+    """Token buckets in Redis, shared by every worker that points at the same server
+
+    While Redis cannot be reached the buckets of this process are used instead, so an
+    outage loosens the limits to per-worker ones rather than failing every request.
+    """
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, socket_timeout=RATE_LIMIT_REDIS_TIMEOUT,
+                                           socket_connect_timeout=RATE_LIMIT_REDIS_TIMEOUT)
+        self.script = self.client.register_script(self.SCRIPT)
+        self.fallback = MemoryBackend()
+        self.failing = False
+
+    def take(self, key, capacity, period):
+        rate = capacity / period
+        try:
+            allowed, tokens = self.script(keys=[f'ratelimit:{key}'], args=[capacity, rate, time.time()])
+        except redis.exceptions.RedisError as e:
+            # Logged once per outage, not once per request
+            if not self.failing:
+                self.failing = True
+                current_app.logger.warning(f'Rate limit backend unavailable, keeping limits per process: {e}')
+            return self.fallback.take(key, capacity, period)
+        if self.failing:
+            self.failing = False
+            current_app.logger.info('Rate limit backend available again')
+        tokens = float(tokens)
+        return bool(allowed), 0 if allowed else (1 - tokens) / rate
+
+def create_backend():
+    if RATE_LIMIT_REDIS_URL and redis is not None:
+        return RedisBackend(RATE_LIMIT_REDIS_URL)
+    return MemoryBackend()
+
+backend = None
+_semaphores = {endpoint: threading.BoundedSemaphore(limit) for endpoint, limit in CONCURRENCY_LIMITS.items()}
+
+def _client_ip():
+    return request.remote_addr or 'unknown'
+
+def _user_key():
+    """Caller identity from the bearer token, without a database lookup"""
+    token = request.headers.get('Authorization', '')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    try:
+        return f"user:{jwt.decode(token, SECRET_KEY, algorithms=['HS256'])['user_id']}"
+    except Exception:
+        return f'ip:{_client_ip()}'
+
+def _too_many(retry_after, status=429, message='Too many requests'):
+    response = jsonify({'error': message, 'retry_after': retry_after})
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def admit_request():
+    endpoint = request.endpoint
+    if endpoint is None or endpoint == 'static' or request.method == 'OPTIONS':
+        return None
+
+    limits = RATE_LIMITS.get(endpoint, RATE_LIMITS.get('*', []))
+    for scope, capacity, period in limits:
+        if scope == 'ip':
+            subject = f'ip:{_client_ip()}'
+        elif scope == 'user':
+            subject = _user_key()
+        else:
+            subject = 'all'
+        allowed, wait = backend.take(f'{endpoint}:{scope}:{subject}', capacity, period)
+        if not allowed:
+            return _too_many(max(1, math.ceil(wait)))
+
+    semaphore = _semaphores.get(endpoint)
+    if semaphore is not None:
+        if not semaphore.acquire(blocking=False):
+            return _too_many(1, 503, 'Server busy, please retry')
+        g.admission_semaphore = semaphore
+    return None
+
+def release_slot(exc=None):
+    semaphore = g.pop('admission_semaphore', None)
+    if semaphore is not None:
+        semaphore.release()
+
+def init_app(app):
+    global backend
+    if not RATE_LIMIT_ENABLED:
+        return
+    if backend is None:
+        if RATE_LIMIT_REDIS_URL and redis is None:
+            # Every worker process would then enforce the limits on its own
+            app.logger.warning('RATE_LIMIT_REDIS_URL is set but the redis package is not installed; rate limits are kept per process')
+        backend = create_backend()
+    app.before_request(admit_request)
+    app.teardown_request(release_slot)
@@ -0,0 +1,20 @@
+"""Production entry point.
+
+    gunicorn                          # picks up ./gunicorn.conf.py, serves src.wsgi:app
+    python -m src.wsgi                # waitress, for hosts without gunicorn (e.g. Windows)
+
+The development server is still `python src/main.py`.
+"""
+import os
+from src.main import create_app
+
+app = create_app()
+
+if __name__ == '__main__':
+    from waitress import serve
+    serve(
+        app,
+        host=os.environ.get('WAITRESS_HOST', '0.0.0.0'),
+        port=int(os.environ.get('WAITRESS_PORT', '5000')),
+        threads=int(os.environ.get('WAITRESS_THREADS', '8'))
+    )
@@ -0,0 +1,18 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings read when the modules are imported: no shards, limits or scheduled backups in tests
+os.environ.pop('DATABASE_SHARDS', None)
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+os.environ['BACKUP_INTERVAL_HOURS'] = '0'
+
+@pytest.fixture
+def app(tmp_path):
+    """The app on an empty database of its own, with its app context pushed"""
+    from src.main import create_app
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}"})
+    with app.app_context():
+        yield app
@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+import pytest
+from src.models.user import User, Report, db
+from src.utils import backup
+
+# Longest a report insert may take while a snapshot is copying the database
+WRITE_LATENCY_BUDGET_SECONDS = 0.5
+
+@pytest.fixture
+def backup_dir(tmp_path, monkeypatch):
+    directory = tmp_path / 'backups'
+    monkeypatch.setattr(backup, 'BACKUP_DIR', str(directory))
+    # Many short steps, so the copy is still running while the writer commits
+    monkeypatch.setattr(backup, 'BACKUP_STEP_PAGES', 4)
+    monkeypatch.setattr(backup, 'BACKUP_STEP_PAUSE_MS', 5)
+    return directory
+
+def add_reports(staff_id, count, notes):
+    db.session.add_all([
+        Report(itin=f'ITIN{i % 20:03d}', report_date=date(2026, 1, 1), percentage_attained=90.0, staff_id=staff_id, notes_comments=notes)
+        for i in range(count)
+    ])
+    db.session.commit()
+
+def report_count(path):
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return connection.execute('SELECT COUNT(*) FROM report').fetchone()[0]
+    finally:
+        connection.close()
+
+def test_online_snapshot_verifies_and_restores(app, backup_dir):
+    staff_id = User.query.filter_by(staff_number='85891').one().id
+    # A few hundred pages, so the copy takes many steps
+    add_reports(staff_id, 500, 'x' * 2000)
+
+    latencies = []
+    stop = threading.Event()
+
+    def write():
+        with app.app_context():
+            while not stop.is_set():
+                started = time.perf_counter()
+                add_reports(staff_id, 1, 'written during the snapshot')
+                latencies.append(time.perf_counter() - started)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        while not latencies:
+            time.sleep(0.001)
+        written_before = len(latencies)
+        manifest = backup.create_snapshot()
+        written_during = len(latencies) - written_before
+    finally:
+        stop.set()
+        writer.join()
+
+    # The writer kept committing while the snapshot was taken, and never waited long
+    assert written_during > 0
+    assert max(latencies) <= WRITE_LATENCY_BUDGET_SECONDS
+
+    # The snapshot is one consistent point in the middle of the writes
+    assert [entry['integrity'] for entry in manifest['databases']] == ['ok']
+    snapshot_path = os.path.join(backup.BACKUP_DIR, manifest['name'], manifest['databases'][0]['file'])
+    backup.check_integrity(snapshot_path)
+    snapshot_reports = report_count(snapshot_path)
+    assert 500 + written_before <= snapshot_reports <= 500 + len(latencies)
+    assert [snapshot['name'] for snapshot in backup.list_snapshots()] == [manifest['name']]
+
+    add_reports(staff_id, 10, 'after the snapshot')
+    assert backup.restore_snapshot(manifest['name'])['name'] == manifest['name']
+    db.session.remove()
+    assert Report.query.count() == snapshot_reports
+
+def test_corrupt_snapshot_is_not_restored(app, backup_dir):
+    staff_id = User.query.filter_by(staff_number='85891').one().id
+    add_reports(staff_id, 50, 'x' * 2000)
+    manifest = backup.create_snapshot()
+    snapshot_path = os.path.join(backup.BACKUP_DIR, manifest['name'], manifest['databases'][0]['file'])
+    with open(snapshot_path, 'r+b') as f:
+        f.seek(4096)
+        f.write(b'\xff' * 4096)
+
+    with pytest.raises(backup.BackupError):
+        backup.restore_snapshot(manifest['name'])
+    assert Report.query.count() == 50
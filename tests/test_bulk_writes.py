@@ -0,0 +1,81 @@
+from datetime import date, datetime
+from sqlalchemy import text
+from src.models.user import User, Report, bulk_writes, db
+from src.routes.archive import archive_before
+from src.routes.generator import REPORT_COLUMNS, bulk_insert
+
+def triggers():
+    return set(db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars())
+
+def assert_itin_stats_current():
+    """itin_stat and itin_reader hold what a GROUP BY over the live reports gives"""
+    def rounded(rows):
+        return [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows]
+    assert rounded(db.session.execute(text(
+        'SELECT itin, report_count, total_percentage, mean_percentage, min_percentage, max_percentage, first_report_date, last_report_date '
+        'FROM itin_stat ORDER BY itin'
+    ))) == rounded(db.session.execute(text(
+        'SELECT itin, COUNT(*), SUM(percentage_attained), AVG(percentage_attained), MIN(percentage_attained), MAX(percentage_attained), '
+        'MIN(report_date), MAX(report_date) FROM report GROUP BY itin ORDER BY itin'
+    )))
+    assert rounded(db.session.execute(text(
+        'SELECT itin, staff_id, report_count, mean_percentage, last_report_date FROM itin_reader ORDER BY itin, staff_id'
+    ))) == rounded(db.session.execute(text(
+        'SELECT itin, staff_id, COUNT(*), AVG(percentage_attained), MAX(report_date) FROM report GROUP BY itin, staff_id ORDER BY itin, staff_id'
+    )))
+
+def change_log(table):
+    return dict(db.session.execute(text('SELECT row_id, operation FROM change_log WHERE table_name = :table'), {'table': table}).all())
+
+def add_report(staff_id, itin, report_date, percentage):
+    report = Report(itin=itin, report_date=report_date, percentage_attained=percentage, staff_id=staff_id)
+    db.session.add(report)
+    db.session.commit()
+    return report.id
+
+def test_bulk_insert_catches_up_on_the_triggers(app):
+    reader = User.query.filter_by(staff_number='85891').one().id
+    other = User.query.filter_by(staff_number='80909').one().id
+    add_report(reader, 'A-1', date(2026, 3, 1), 80.0)
+    add_report(other, 'B-1', date(2026, 3, 2), 60.0)
+    # The newest id is deleted, so the bulk load reuses it over its tombstone
+    reused = add_report(reader, 'A-1', date(2026, 3, 3), 70.0)
+    db.session.delete(db.session.get(Report, reused))
+    db.session.commit()
+    assert change_log('report')[reused] == 'delete'
+    installed = triggers()
+
+    # Ids are left to the database
+    columns = REPORT_COLUMNS[1:]
+    rows = [
+        ('A-1', '2026-03-04', 90.0, None, reader, '2026-03-04 15:00:00.000000', 'Pending', ''),
+        ('A-1', '2026-02-20', 50.0, None, other, '2026-02-20 15:00:00.000000', 'Pending', ''),
+        ('C-1', '2026-03-05', 100.0, None, other, '2026-03-05 15:00:00.000000', 'Pending', '')
+    ]
+    with db.engine.begin() as conn, bulk_writes(conn):
+        assert conn.execute(text("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'")).scalar() == 0
+        bulk_insert(conn, Report.__table__, columns, rows)
+
+    assert triggers() == installed
+    assert_itin_stats_current()
+    logged = change_log('report')
+    assert logged == {report_id: 'upsert' for report_id in db.session.execute(text('SELECT id FROM report')).scalars()}
+    assert logged[reused] == 'upsert'
+
+    # The triggers work again afterwards
+    add_report(reader, 'C-1', date(2026, 3, 6), 40.0)
+    assert_itin_stats_current()
+
+def test_archive_leaves_tombstones_and_current_stats(app):
+    reader = User.query.filter_by(staff_number='85891').one().id
+    old = [add_report(reader, 'A-1', date(2025, 6, day), 50.0 + day) for day in range(1, 4)]
+    kept = add_report(reader, 'A-1', date(2026, 6, 1), 95.0)
+    installed = triggers()
+
+    assert archive_before(datetime(2026, 1, 1))['reports'] == 3
+
+    assert triggers() == installed
+    assert_itin_stats_current()
+    logged = change_log('report')
+    assert {report_id: logged[report_id] for report_id in old} == {report_id: 'delete' for report_id in old}
+    assert logged[kept] == 'upsert'
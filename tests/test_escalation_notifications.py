@@ -0,0 +1,119 @@
+import smtplib
+from datetime import datetime, timedelta
+import pytest
+from src.models.user import User, Anomaly, Escalation, anomaly_types, db
+from src.routes import email_service
+from src.routes.email_service import (
+    sweep_escalation_notifications, ESCALATION_RETRY_MINUTES, ESCALATION_NOTIFY_LEASE_MINUTES
+)
+
+SUPERVISOR_EMAIL = '12345@kenyapower.co.ke'
+
+class Outbox:
+    """Recipients of the emails sent through the fake SMTP server; set `error` to make it fail"""
+
+    def __init__(self):
+        self.sent = []
+        self.error = None
+
+@pytest.fixture
+def outbox(monkeypatch):
+    outbox = Outbox()
+
+    class FakeSMTP:
+        def __init__(self, host, port):
+            pass
+
+        def starttls(self):
+            pass
+
+        def login(self, user, password):
+            pass
+
+        def sendmail(self, sender, to, message):
+            if outbox.error is not None:
+                raise outbox.error
+            outbox.sent.append(to)
+
+        def quit(self):
+            pass
+
+    monkeypatch.setattr(smtplib, 'SMTP', FakeSMTP)
+    # Without a password deliver_email only prints the message
+    monkeypatch.setattr(email_service, 'EMAIL_PASSWORD', 'secret')
+    return outbox
+
+def escalate(now):
+    """An open anomaly escalated to the seeded supervisor at `now`; returns the escalation id"""
+    reader = User.query.filter_by(staff_number='85891').one()
+    supervisor = User.query.filter_by(staff_number='12345').one()
+    anomaly = Anomaly(type_id=anomaly_types.id_for('Faulty Meter'), description='Seal broken', staff_id=reader.id, escalation_flag=True)
+    db.session.add(anomaly)
+    db.session.flush()
+    escalation = Escalation(anomaly_id=anomaly.id, escalated_to_id=supervisor.id, escalation_timestamp=now, next_notify_at=now)
+    db.session.add(escalation)
+    db.session.flush()
+    anomaly.current_escalation_id = escalation.id
+    db.session.commit()
+    return escalation.id
+
+def test_due_escalation_is_emailed_once(app, outbox):
+    now = datetime.utcnow()
+    escalation_id = escalate(now)
+
+    assert sweep_escalation_notifications(now) == (1, 1, 0)
+    assert outbox.sent == [SUPERVISOR_EMAIL]
+
+    # Delivered: the next sweeps find nothing due until the reminder
+    assert sweep_escalation_notifications(now) == (0, 0, 0)
+    assert sweep_escalation_notifications(now + timedelta(minutes=30)) == (0, 0, 0)
+    assert outbox.sent == [SUPERVISOR_EMAIL]
+
+    escalation = db.session.get(Escalation, escalation_id)
+    assert escalation.notified_at == now
+    assert escalation.notify_attempts == 0
+
+def test_failed_delivery_is_retried_after_backoff(app, outbox):
+    now = datetime.utcnow()
+    escalation_id = escalate(now)
+
+    outbox.error = smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+    assert sweep_escalation_notifications(now) == (0, 0, 1)
+    assert outbox.sent == []
+
+    escalation = db.session.get(Escalation, escalation_id)
+    retry_at = now + timedelta(minutes=ESCALATION_RETRY_MINUTES)
+    assert escalation.notify_attempts == 1
+    assert 'Connection unexpectedly closed' in escalation.last_notify_error
+    assert escalation.next_notify_at == retry_at
+
+    outbox.error = None
+    assert sweep_escalation_notifications(retry_at - timedelta(seconds=1)) == (0, 0, 0)
+    assert outbox.sent == []
+
+    assert sweep_escalation_notifications(retry_at) == (1, 1, 0)
+    assert outbox.sent == [SUPERVISOR_EMAIL]
+    db.session.expire_all()
+    escalation = db.session.get(Escalation, escalation_id)
+    assert escalation.notify_attempts == 0
+    assert escalation.last_notify_error is None
+    assert escalation.notified_at == retry_at
+
+def test_escalation_claimed_by_a_failed_sweep_waits_for_the_lease(app, outbox, monkeypatch):
+    now = datetime.utcnow()
+    escalate(now)
+
+    def crash(escalations, now=None):
+        raise RuntimeError('worker died while sending')
+
+    # The sweep claims the escalation, then dies before recording any outcome
+    with monkeypatch.context() as patch:
+        patch.setattr(email_service, 'notify_escalations', crash)
+        with pytest.raises(RuntimeError):
+            sweep_escalation_notifications(now)
+    db.session.rollback()
+
+    lease_end = now + timedelta(minutes=ESCALATION_NOTIFY_LEASE_MINUTES)
+    assert sweep_escalation_notifications(lease_end - timedelta(seconds=1)) == (0, 0, 0)
+    assert sweep_escalation_notifications(lease_end) == (1, 1, 0)
+    assert outbox.sent == [SUPERVISOR_EMAIL]
@@ -0,0 +1,28 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import text
+from src.models.user import Report, Anomaly, Escalation, db
+from src.routes.email_service import sweep_escalation_notifications
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_generate_data_with_escalations(app, workers):
+    result = app.test_cli_runner().invoke(args=[
+        'generate', 'data', '--readers', '4', '--days', '30', '--anomaly-rate', '0.5',
+        '--escalation-rate', '0.9', '--workers', str(workers)
+    ])
+    assert result.exit_code == 0, result.output
+
+    assert Report.query.count() > 0
+    escalated = Anomaly.query.filter(Anomaly.current_escalation_id.isnot(None)).count()
+    assert escalated > 0
+    assert Escalation.query.count() >= escalated
+
+    # The change log and itinerary statistics were caught up after the load
+    logged = db.session.execute(text('SELECT COUNT(*) FROM change_log')).scalar()
+    assert logged == Report.query.count() + Anomaly.query.count() + Escalation.query.count()
+    assert db.session.execute(text('SELECT SUM(report_count) FROM itin_stat')).scalar() == Report.query.count()
+
+    # Generated history is already notified: nothing is emailed for it
+    assert Escalation.query.filter(Escalation.notified_at.is_(None)).count() == 0
+    assert Escalation.query.filter(Escalation.notify_attempts != 0).count() == 0
+    assert sweep_escalation_notifications(datetime.utcnow()) == (0, 0, 0)
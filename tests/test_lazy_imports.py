@@ -0,0 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from benchmarks.import_time import BUDGET_MS, import_profile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded by the code that needs them on first use, never when a worker starts
+LAZY_MODULES = ('pandas', 'numpy', 'openpyxl', 'PIL', 'smtplib')
+
+# Shared CI runners are slower and noisier than the machines the budget was set on
+CI_MARGIN = 2.5
+
+def subprocess_env(tmp_path):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'app.db'}", RATE_LIMIT_ENABLED='false')
+    env.pop('DATABASE_SHARDS', None)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    return env
+
+def loaded_modules(code, tmp_path):
+    """sys.modules of a fresh interpreter after running `code`"""
+    env = subprocess_env(tmp_path)
+    script = f'{code}\nimport json, sys\nprint(json.dumps(sorted(sys.modules)))'
+    result = subprocess.run([sys.executable, '-c', script], env=env, cwd=ROOT, capture_output=True, text=True, check=True)
+    return set(json.loads(result.stdout.strip().splitlines()[-1]))
+
+@pytest.mark.parametrize('code', [
+    'import src.main',
+    'from src.main import create_app\ncreate_app()'
+], ids=['import', 'create_app'])
+def test_startup_does_not_load_lazy_modules(code, tmp_path):
+    modules = loaded_modules(code, tmp_path)
+    assert 'src.main' in modules
+    assert [name for name in LAZY_MODULES if name in modules] == []
+
+def test_import_time_within_budget(tmp_path):
+    env = subprocess_env(tmp_path)
+    # The first run fills the bytecode cache; the best of the rest is the least disturbed
+    import_profile(env)
+    import_ms = min(import_profile(env)[0] for _ in range(3)) / 1000
+    assert import_ms <= BUDGET_MS * CI_MARGIN, f'import src.main took {import_ms:.0f} ms, budget {BUDGET_MS:.0f} ms'
@@ -0,0 +1,28 @@
+import re
+import time
+
+BUCKET = re.compile(r'^http_request_duration_seconds_bucket\{route="/sleep/<float:seconds>",method="GET",le="([^"]+)"\} (\d+)$', re.M)
+COUNT = re.compile(r'^http_request_duration_seconds_count\{route="/sleep/<float:seconds>",method="GET"\} (\d+)$', re.M)
+
+def test_latency_buckets_are_cumulative_once(app):
+    @app.route('/sleep/<float:seconds>')
+    def sleep(seconds):
+        time.sleep(seconds)
+        return 'ok'
+
+    client = app.test_client()
+    for seconds in (0.0, 0.0, 0.02, 0.3):
+        # Metrics are recorded when the server closes the response
+        client.get(f'/sleep/{seconds}').close()
+
+    text = client.get('/api/metrics').get_data(as_text=True)
+    buckets = [(bound, int(count)) for bound, count in BUCKET.findall(text)]
+    count = int(COUNT.search(text).group(1))
+
+    assert count == 4
+    assert buckets[-1] == ('+Inf', count)
+    counts = [value for _, value in buckets]
+    assert counts == sorted(counts)
+    assert max(counts) <= count
+    # The 0.3 s request is above every bound up to 0.25
+    assert dict(buckets)['0.25'] == 3
@@ -0,0 +1,21 @@
+import logging
+import pytest
+from src.utils import rate_limit
+
+pytest.importorskip('redis')
+
+def test_unreachable_redis_falls_back_to_process_buckets(app, monkeypatch, caplog):
+    # Nothing listens on port 1, so every call fails to connect
+    monkeypatch.setattr(rate_limit, 'backend', rate_limit.RedisBackend('redis://127.0.0.1:1/0'))
+    monkeypatch.setattr(rate_limit, 'RATE_LIMITS', {'*': [['ip', 2, 60]]})
+    app.before_request(rate_limit.admit_request)
+    app.teardown_request(rate_limit.release_slot)
+
+    client = app.test_client()
+    with caplog.at_level(logging.WARNING):
+        statuses = [client.get('/api/metrics').status_code for _ in range(3)]
+
+    # Admitted, then limited, by the fallback buckets instead of a 500
+    assert statuses == [200, 200, 429]
+    warnings = [record for record in caplog.records if 'Rate limit backend unavailable' in record.getMessage()]
+    assert len(warnings) == 1